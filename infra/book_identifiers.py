@@ -0,0 +1,169 @@
+"""Every identifier in a book's OPF metadata, keyed by scheme.
+
+Calibre writes several <dc:identifier> elements per book: its own id and uuid,
+ISBNs, Amazon ASINs, Google ids. All of them are stored as (scheme, value) rows
+in book_identifiers. ISBN-10s are converted to ISBN-13 so both printings of a
+number meet, and ASINs and UUIDs are case-normalized. The (scheme, value) index
+lets the StoryGraph importer and the duplicate checks find a book by identifier
+with one lookup instead of comparing titles.
+
+refresh_identifiers() backfills books catalogued before identifiers were kept,
+reading their OPF files again.
+"""
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+OPF_NS = 'http://www.idpf.org/2007/opf'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+
+# opf:scheme values as Calibre and other tools write them
+SCHEME_ALIASES = {
+    'isbn': 'isbn', 'isbn10': 'isbn', 'isbn13': 'isbn', 'isbn-10': 'isbn', 'isbn-13': 'isbn',
+    'mobi-asin': 'asin', 'amazon': 'asin', 'asin': 'asin',
+    'uuid': 'uuid', 'calibre': 'calibre', 'google': 'google', 'goodreads': 'goodreads',
+}
+# Schemes that name an edition rather than a library entry; calibre ids differ between copies of one book
+EDITION_SCHEMES = ('isbn', 'asin', 'google', 'goodreads')
+# EPUB 3 puts the scheme in the value instead: urn:isbn:978..., urn:uuid:...
+URN_PREFIX = re.compile(r'^(?:urn:)?(isbn|uuid|asin):\s*', re.IGNORECASE)
+UUID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+ASIN = re.compile(r'^B0[0-9A-Z]{8}$', re.IGNORECASE)
+ISBN_SEPARATORS = re.compile(r'[\s-]')
+
+
+def isbn13_check_digit(digits):
+    """Check digit for the first 12 digits of an ISBN-13"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return str(-total % 10)
+
+
+def normalize_isbn(value):
+    """ISBN-13 form of an ISBN-10 or ISBN-13 with a valid check digit, else None"""
+    isbn = ISBN_SEPARATORS.sub('', value or '').upper()
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        total = sum((10 - i) * (10 if d == 'X' else int(d)) for i, d in enumerate(isbn))
+        if total % 11:
+            return None
+        isbn = '978' + isbn[:9]
+        return isbn + isbn13_check_digit(isbn)
+    if len(isbn) == 13 and isbn.isdigit() and isbn[:3] in ('978', '979') and isbn13_check_digit(isbn[:12]) == isbn[12]:
+        return isbn
+    return None
+
+
+def normalize_identifier(scheme, value):
+    """(scheme, value) in stored form, or None for an empty value or an invalid ISBN.
+
+    Without a scheme, ISBNs, UUIDs and ASINs are recognized by their shape; anything
+    else is not an identifier worth matching on.
+    """
+    value = (value or '').strip()
+    urn = URN_PREFIX.match(value)
+    if urn:
+        scheme, value = urn.group(1), value[urn.end():].strip()
+    if not value:
+        return None
+    if scheme:
+        scheme = scheme.strip().lower()
+        scheme = SCHEME_ALIASES.get(scheme, scheme)
+    elif normalize_isbn(value):
+        scheme = 'isbn'
+    elif UUID.match(value):
+        scheme = 'uuid'
+    elif ASIN.match(value):
+        scheme = 'asin'
+    else:
+        return None
+
+    if scheme == 'isbn':
+        isbn = normalize_isbn(value)
+        return ('isbn', isbn) if isbn else None
+    if scheme == 'uuid':
+        return scheme, value.lower()
+    if scheme == 'asin':
+        return scheme, value.upper()
+    return scheme, value
+
+
+def opf_identifiers(root):
+    """Normalized (scheme, value) pairs of every identifier element under an OPF root, in document order"""
+    identifiers = []
+    for elem in root.findall(f'.//{{{DC_NS}}}identifier') + root.findall('.//identifier'):
+        scheme = elem.get(f'{{{OPF_NS}}}scheme') or elem.get('scheme') or elem.get('opf:scheme')
+        identifier = normalize_identifier(scheme, elem.text)
+        if identifier:
+            identifiers.append(identifier)
+    return list(dict.fromkeys(identifiers))
+
+
+def first_isbn(identifiers):
+    return next((value for scheme, value in identifiers if scheme == 'isbn'), None)
+
+
+def store_identifiers(cursor, book_id, identifiers):
+    """Replace a book's identifier rows"""
+    cursor.execute('DELETE FROM book_identifiers WHERE book_id = ?', (book_id,))
+    cursor.executemany('INSERT OR IGNORE INTO book_identifiers (book_id, scheme, value) VALUES (?, ?, ?)',
+                       [(book_id, scheme, value) for scheme, value in identifiers])
+
+
+def load_identifier_index(cursor, schemes=None):
+    """{(scheme, value): book_id}; the lowest book id wins when several books share an identifier"""
+    sql = 'SELECT scheme, value, book_id FROM book_identifiers'
+    params = ()
+    if schemes:
+        sql += f" WHERE scheme IN ({', '.join('?' * len(schemes))})"
+        params = tuple(schemes)
+    index = {}
+    for scheme, value, book_id in cursor.execute(sql + ' ORDER BY book_id DESC', params):
+        index[(scheme, value)] = book_id
+    return index
+
+
+def refresh_identifiers(conn):
+    """Fill book_identifiers for books that have no rows yet; returns the number of books given identifiers.
+
+    A book whose OPF file is gone keeps whatever its isbn column holds, if that
+    looks like an identifier. When the OPF file is read, the isbn column is
+    rewritten to the book's ISBN-13, or NULL when the OPF has no ISBN, like a
+    freshly scanned book.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, isbn, metadata_path FROM books
+        WHERE NOT EXISTS (SELECT 1 FROM book_identifiers bi WHERE bi.book_id = books.id)
+    ''')
+    refreshed = 0
+    for book_id, isbn, metadata_path in cursor.fetchall():
+        identifiers = []
+        from_opf = False
+        if metadata_path and Path(metadata_path).exists():
+            try:
+                identifiers = opf_identifiers(ET.parse(metadata_path).getroot())
+                from_opf = bool(identifiers)
+            except ET.ParseError as e:
+                print(f"Error parsing OPF file {metadata_path}: {e}")
+        if not identifiers:
+            identifier = normalize_identifier(None, isbn)
+            identifiers = [identifier] if identifier else []
+        if not identifiers:
+            continue
+        store_identifiers(cursor, book_id, identifiers)
+        normalized = first_isbn(identifiers)
+        # Calibre ids and UUIDs only live in book_identifiers
+        if normalized != isbn and (normalized or from_opf):
+            cursor.execute('UPDATE books SET isbn = ? WHERE id = ?', (normalized, book_id))
+        refreshed += 1
+    conn.commit()
+    return refreshed
+
+
+if __name__ == '__main__':
+    db_path = Path(__file__).parent / 'data' / 'tt_db_ebook_lib.db'
+    from catalog_schema import ensure_serving_schema
+    conn = sqlite3.connect(str(db_path))
+    ensure_serving_schema(conn)
+    print(f"Stored identifiers for {refresh_identifiers(conn)} book(s)")
+    conn.close()
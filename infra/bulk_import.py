@@ -0,0 +1,232 @@
+"""Streaming import engine for reading-history CSV exports.
+
+Each export format is an ImportAdapter. An adapter names the columns it needs,
+gives every row a stable source key, and maps the row onto the reading history
+fields. BulkImporter does the rest for every source:
+
+- it streams the file with csv.DictReader and holds at most batch_size parsed
+  rows, so memory does not grow with the size of the export;
+- it skips rows whose content hash matches the last import;
+- it matches books by identifier first, then by title and author;
+- it hands batches to the store (StoryGraphImporter, which owns the
+  reading_history schema) to write in one transaction;
+- it reports rows per second and the time spent reading, matching and writing.
+
+Adding a source means writing an adapter; see StoryGraphAdapter in
+storygraph_processor.py and GoodreadsAdapter in goodreads_processor.py.
+"""
+import csv
+import hashlib
+import time
+from pathlib import Path
+
+from book_identifiers import load_identifier_index, normalize_identifier
+from title_matcher import TitleMatcher
+
+# CSV rows parsed and written per executemany round
+IMPORT_BATCH_SIZE = 1000
+
+# reading_history fields an adapter fills, in column order
+RECORD_FIELDS = (
+    'title', 'authors', 'isbn', 'format', 'read_status', 'date_added', 'last_date_read', 'dates_read',
+    'read_count', 'star_rating', 'review', 'owned',
+)
+# book_attributes fields; moods and pace come first because tags are parsed from them
+ATTRIBUTE_FIELDS = (
+    'moods', 'pace', 'character_or_plot', 'strong_character_dev', 'loveable_characters',
+    'diverse_characters', 'flawed_characters',
+)
+
+
+def row_content_hash(row):
+    """Hash of every field of an export row, independent of column order"""
+    text = '\x1f'.join(f'{key}\x1e{row[key] or ""}' for key in sorted(row, key=str))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def parse_int(text):
+    return int(text) if text else 0
+
+
+def parse_float(text):
+    return float(text) if text else None
+
+
+class ImportAdapter:
+    """One export format; subclasses set source and required_columns and implement source_key and map_row"""
+    source = None
+    # Header columns without which the file is not this format
+    required_columns = ()
+
+    def missing_columns(self, fieldnames):
+        return [column for column in self.required_columns if column not in (fieldnames or ())]
+
+    def source_key(self, row):
+        """Stable identity of a row across exports"""
+        raise NotImplementedError
+
+    def map_row(self, row):
+        """Dict with every RECORD_FIELDS and ATTRIBUTE_FIELDS key, plus warning_text and warning_description"""
+        raise NotImplementedError
+
+
+class BookMatcher:
+    """Finds the library book of an export row: identifier lookup first, then the title matcher"""
+
+    def __init__(self, identifiers, titles):
+        self.identifiers = identifiers
+        self.titles = titles
+
+    @classmethod
+    def from_db(cls, cursor):
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'book_identifiers'")
+        identifiers = load_identifier_index(cursor) if cursor.fetchone()[0] else {}
+        return cls(identifiers, TitleMatcher.from_db(cursor))
+
+    def match(self, isbn, title, authors):
+        """Return (book_id, confidence, by_identifier); book_id is None when nothing matches"""
+        identifier = normalize_identifier(None, isbn)
+        if identifier in self.identifiers:
+            return self.identifiers[identifier], 1.0, True
+        book_id, confidence = self.titles.match(title, authors)
+        return book_id, confidence, False
+
+
+class ImportStats:
+    """Counters and phase timings of one import run"""
+
+    def __init__(self, source):
+        self.source = source
+        self.rows = self.duplicates = 0
+        self.added = self.updated = self.unchanged = 0
+        self.matched = self.matched_by_identifier = self.relinked = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.match_seconds = self.write_seconds = 0.0
+
+    def rate(self):
+        elapsed = self.elapsed or time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def report(self):
+        """Summary lines printed at the end of an import"""
+        written = self.added + self.updated
+        read_seconds = self.elapsed - self.match_seconds - self.write_seconds
+        return [
+            f"Rows in export: {self.rows}" + (f" ({self.duplicates} repeated rows skipped)" if self.duplicates else ''),
+            f"New: {self.added}, changed: {self.updated}, unchanged: {self.unchanged}",
+            f"Matched to library: {self.matched} of {written} written ({self.matched_by_identifier} by identifier), "
+            f"plus {self.relinked} previously unmatched",
+            f"Took {self.elapsed:.2f}s ({self.rate():,.0f} rows/s): reading {read_seconds:.2f}s, "
+            f"matching {self.match_seconds:.2f}s, writing {self.write_seconds:.2f}s in {self.batches} batch(es)",
+        ]
+
+
+class BulkImporter:
+    """Streams one export through an adapter into the store's reading history"""
+
+    def __init__(self, store, adapter, batch_size=IMPORT_BATCH_SIZE):
+        self.store = store
+        self.adapter = adapter
+        self.batch_size = batch_size
+
+    def build_record(self, row_id, mapped, book_id, confidence, source_key, content_hash):
+        """(reading_history_id, history values, attribute values, warning values or None) for write_batch"""
+        history = (book_id, confidence, source_key, content_hash) + tuple(mapped[field] for field in RECORD_FIELDS)
+        attributes = tuple(mapped[field] for field in ATTRIBUTE_FIELDS)
+        # Content warnings only if present
+        warning = (mapped['warning_text'], mapped['warning_description']) if mapped['warning_text'] else None
+        return row_id, history, attributes, warning
+
+    def run(self, csv_path):
+        """Import csv_path; returns ImportStats, or None when the file is missing or not this adapter's format"""
+        csv_path = Path(csv_path)
+        if not csv_path.exists():
+            print(f"Error: CSV file not found: {csv_path}")
+            return None
+
+        store, adapter = self.store, self.adapter
+        stats = ImportStats(adapter.source)
+        # Library identifiers and titles are indexed once per import
+        matcher = BookMatcher.from_db(store.cursor)
+        existing = store.existing_sources()
+        # Ids are assigned here so attribute and warning rows can reference them without lastrowid
+        next_id = store.next_reading_history_id()
+        seen = set()
+        stale_periods = set()
+        new_records, changed_records, relinks = [], [], []
+
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            missing = adapter.missing_columns(reader.fieldnames)
+            if missing:
+                print(f"Error: {csv_path.name} is not a {adapter.source} export, missing columns: {', '.join(missing)}")
+                return None
+
+            for row in reader:
+                source_key = adapter.source_key(row)
+                if source_key in seen:
+                    stats.duplicates += 1
+                    continue
+                seen.add(source_key)
+                stats.rows += 1
+                content_hash = row_content_hash(row)
+                current = existing.get(source_key)
+
+                if current and current[1] == content_hash:
+                    stats.unchanged += 1
+                    # Unchanged rows are left alone unless the library has gained their book since
+                    if current[2] is None:
+                        mapped = adapter.map_row(row)
+                        start = time.perf_counter()
+                        book_id, confidence, _ = matcher.match(mapped['isbn'], mapped['title'], mapped['authors'])
+                        stats.match_seconds += time.perf_counter() - start
+                        if book_id:
+                            relinks.append((book_id, confidence, current[0]))
+                    continue
+
+                mapped = adapter.map_row(row)
+                start = time.perf_counter()
+                book_id, confidence, by_identifier = matcher.match(mapped['isbn'], mapped['title'], mapped['authors'])
+                stats.match_seconds += time.perf_counter() - start
+                if book_id:
+                    stats.matched += 1
+                    stats.matched_by_identifier += by_identifier
+
+                if current:
+                    changed_records.append(self.build_record(current[0], mapped, book_id, confidence, source_key, content_hash))
+                    stats.updated += 1
+                else:
+                    new_records.append(self.build_record(next_id, mapped, book_id, confidence, source_key, content_hash))
+                    next_id += 1
+                    stats.added += 1
+
+                if len(new_records) + len(changed_records) >= self.batch_size:
+                    stale_periods |= self.write(stats, new_records, changed_records)
+                    new_records, changed_records = [], []
+                    print(f"Imported {stats.added + stats.updated} changed books ({stats.rate():,.0f} rows/s)...")
+
+        # Every batch shares one transaction, committed by finish_import
+        stale_periods |= self.write(stats, new_records, changed_records)
+        start = time.perf_counter()
+        stats.relinked = store.relink_rows(relinks)
+        # A relinked row may now share a read with another source's row for the same book
+        stale_periods |= store.session_periods([(row_id,) for _, _, row_id in relinks])
+        store.finish_import(stale_periods, wrote=bool(stats.added or stats.updated or stats.relinked))
+        stats.write_seconds += time.perf_counter() - start
+        stats.elapsed = time.perf_counter() - stats.started
+
+        print(f"\n{'='*60}")
+        print(f"{adapter.source} import complete!")
+        for line in stats.report():
+            print(line)
+        print(f"{'='*60}")
+        return stats
+
+    def write(self, stats, new_records, changed_records):
+        start = time.perf_counter()
+        periods = self.store.write_batch(new_records, changed_records)
+        stats.write_seconds += time.perf_counter() - start
+        stats.batches += 1
+        return periods
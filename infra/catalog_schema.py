@@ -0,0 +1,148 @@
+"""Indexes and change tracking the web server relies on, shared by the cataloger and the server.
+
+The primary keys on the link tables lead with book_id, which serves "authors of
+this book" lookups. These indexes cover the reverse direction (books of an
+author, series or subject) and the author gender filter.
+
+Triggers log every change that affects a book's list entry to catalog_changes.
+The log's autoincrement id is the catalog generation: clients remember the
+generation they last saw and ask /api/changes for anything newer. Because the
+triggers live in the database, edits made by the utils scripts are picked up too.
+compact_catalog_changes() trims the log to one row per book at the end of each
+scan, so it grows with the catalog rather than with its history.
+"""
+
+SERVING_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_authors_sex ON authors (sex)',
+    'CREATE INDEX IF NOT EXISTS idx_book_authors_author ON book_authors (author_id, book_id)',
+    'CREATE INDEX IF NOT EXISTS idx_book_series_series ON book_series (series_id, book_id)',
+    'CREATE INDEX IF NOT EXISTS idx_book_subjects_subject ON book_subjects (subject_id, book_id)',
+    'CREATE INDEX IF NOT EXISTS idx_book_files_book ON book_files (book_id)',
+    # Title order for the paged OPDS feeds and the cover wall; books without a title sort first
+    "CREATE INDEX IF NOT EXISTS idx_books_title_key ON books (COALESCE(title, ''), id)",
+    # Cover colour lookups from a book and change tracking back from a cover
+    'CREATE INDEX IF NOT EXISTS idx_books_cover_path ON books (cover_path)',
+    'CREATE INDEX IF NOT EXISTS idx_cover_sources_hash ON cover_sources (content_hash)',
+    # Book lookups by ISBN, ASIN or any other identifier
+    'CREATE INDEX IF NOT EXISTS idx_book_identifiers_value ON book_identifiers (scheme, value, book_id)',
+]
+
+# Written by thumbnails.py: cover_sources maps cover files to content hashes so a
+# cover's thumbnails can be found with a stat; cover_colors holds placeholder
+# colours per image for the list payloads. Written by ebook_processor.py:
+# book_identifiers holds every OPF identifier of a book (see book_identifiers.py).
+SERVING_TABLES = [
+    '''
+        CREATE TABLE IF NOT EXISTS cover_sources (
+            cover_path TEXT PRIMARY KEY,
+            file_size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            content_hash TEXT NOT NULL
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS cover_colors (
+            content_hash TEXT PRIMARY KEY,
+            dominant_color TEXT NOT NULL,
+            placeholder TEXT NOT NULL,
+            color_sort INTEGER NOT NULL
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS book_identifiers (
+            book_id INTEGER NOT NULL,
+            scheme TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (book_id, scheme, value),
+            FOREIGN KEY (book_id) REFERENCES books (id) ON DELETE CASCADE
+        )
+    ''',
+]
+
+CHANGE_TRACKING = [
+    '''
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            generation INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            change TEXT NOT NULL CHECK(change IN ('upsert', 'delete'))
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_catalog_changes_book ON catalog_changes (book_id)',
+    '''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''',
+    # Identifies this database so clients notice when it was rebuilt from scratch
+    "INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('catalog_id', lower(hex(randomblob(8))))",
+]
+
+# (trigger name, table and event, body)
+CHANGE_TRIGGERS = [
+    ('trg_books_insert', 'AFTER INSERT ON books', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.id, 'upsert')"),
+    ('trg_books_update', 'AFTER UPDATE ON books', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.id, 'upsert')"),
+    ('trg_books_delete', 'AFTER DELETE ON books', "INSERT INTO catalog_changes (book_id, change) VALUES (OLD.id, 'delete')"),
+    ('trg_book_authors_insert', 'AFTER INSERT ON book_authors', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.book_id, 'upsert')"),
+    ('trg_book_authors_delete', 'AFTER DELETE ON book_authors', "INSERT INTO catalog_changes (book_id, change) VALUES (OLD.book_id, 'upsert')"),
+    ('trg_book_series_insert', 'AFTER INSERT ON book_series', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.book_id, 'upsert')"),
+    ('trg_book_series_update', 'AFTER UPDATE ON book_series', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.book_id, 'upsert')"),
+    ('trg_book_series_delete', 'AFTER DELETE ON book_series', "INSERT INTO catalog_changes (book_id, change) VALUES (OLD.book_id, 'upsert')"),
+    ('trg_book_subjects_insert', 'AFTER INSERT ON book_subjects', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.book_id, 'upsert')"),
+    ('trg_book_subjects_delete', 'AFTER DELETE ON book_subjects', "INSERT INTO catalog_changes (book_id, change) VALUES (OLD.book_id, 'upsert')"),
+    ('trg_book_files_insert', 'AFTER INSERT ON book_files', "INSERT INTO catalog_changes (book_id, change) VALUES (NEW.book_id, 'upsert')"),
+    ('trg_book_files_delete', 'AFTER DELETE ON book_files', "INSERT INTO catalog_changes (book_id, change) VALUES (OLD.book_id, 'upsert')"),
+    # A book's placeholder colours change when its cover gets a new hash or the hash is first analyzed
+    ('trg_cover_sources_insert', 'AFTER INSERT ON cover_sources',
+     "INSERT INTO catalog_changes (book_id, change) SELECT id, 'upsert' FROM books WHERE cover_path = NEW.cover_path"),
+    ('trg_cover_sources_hash_update', 'AFTER UPDATE OF content_hash ON cover_sources WHEN OLD.content_hash IS NOT NEW.content_hash',
+     "INSERT INTO catalog_changes (book_id, change) SELECT id, 'upsert' FROM books WHERE cover_path = NEW.cover_path"),
+    ('trg_cover_colors_insert', 'AFTER INSERT ON cover_colors',
+     "INSERT INTO catalog_changes (book_id, change) SELECT b.id, 'upsert' FROM cover_sources cs JOIN books b ON b.cover_path = cs.cover_path WHERE cs.content_hash = NEW.content_hash"),
+    ('trg_authors_update', 'AFTER UPDATE OF author_name, author_sort, sex ON authors',
+     "INSERT INTO catalog_changes (book_id, change) SELECT book_id, 'upsert' FROM book_authors WHERE author_id = NEW.id"),
+    ('trg_series_update', 'AFTER UPDATE OF series_name ON series',
+     "INSERT INTO catalog_changes (book_id, change) SELECT book_id, 'upsert' FROM book_series WHERE series_id = NEW.id"),
+    ('trg_subjects_update', 'AFTER UPDATE OF subject_name ON subjects',
+     "INSERT INTO catalog_changes (book_id, change) SELECT book_id, 'upsert' FROM book_subjects WHERE subject_id = NEW.id"),
+]
+
+# Triggers replaced by ones above, dropped from older databases
+RETIRED_TRIGGERS = ['trg_cover_sources_update']
+# Indexes replaced by ones above
+RETIRED_INDEXES = ['idx_books_title']
+
+def ensure_serving_schema(conn):
+    """Create the serving indexes, tables and change tracking if they are missing (safe to call on every start)"""
+    cursor = conn.cursor()
+    for statement in SERVING_TABLES + SERVING_INDEXES + CHANGE_TRACKING:
+        cursor.execute(statement)
+    for name in RETIRED_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    for name in RETIRED_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, event, body in CHANGE_TRIGGERS:
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body}; END')
+    conn.commit()
+
+def compact_catalog_changes(conn):
+    """Keep only the latest catalog_changes row per book; returns the rows removed.
+
+    /api/changes only needs to know which books changed after a generation, and
+    a book's latest row is after it exactly when any of its rows is. The newest
+    row survives, so the current generation does not move.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM catalog_changes
+        WHERE generation NOT IN (SELECT MAX(generation) FROM catalog_changes GROUP BY book_id)
+    ''')
+    conn.commit()
+    return cursor.rowcount
+
+def get_catalog_version(cursor):
+    """Return (catalog_id, generation) for the database behind this cursor"""
+    cursor.execute("SELECT value FROM catalog_meta WHERE key = 'catalog_id'")
+    row = cursor.fetchone()
+    cursor.execute('SELECT COALESCE(MAX(generation), 0) FROM catalog_changes')
+    return (row[0] if row else None), cursor.fetchone()[0]
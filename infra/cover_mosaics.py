@@ -0,0 +1,142 @@
+"""Pre-rendered cover strips for the author and series list views.
+
+Each author and series row shows up to four covers. Instead of four /api/cover
+requests per row, the row loads one mosaic image with the covers side by side.
+A mosaic's file name carries a key derived from its member books and their cover
+files. When membership or a cover changes, the key changes, so the old file is
+never served again and can be cached by browsers forever.
+
+Pillow is optional: without it mosaic_url() returns None and the list views fall
+back to individual covers.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+MOSAIC_DIR = Path(__file__).parent / 'data' / 'mosaics'
+
+# Drawn at 2x the 40x60 thumbnails and 5px gaps used by .list-item-covers
+TILE_WIDTH, TILE_HEIGHT = 80, 120
+TILE_GAP = 10
+MAX_TILES = 4
+BACKGROUND = (255, 255, 255)
+PLACEHOLDER = (45, 95, 63)
+
+MEMBERS_SQL = {
+    'author': 'SELECT b.id, b.title, b.cover_path FROM books b JOIN book_authors ba ON b.id = ba.book_id WHERE ba.author_id = ? ORDER BY b.id LIMIT 4',
+    'series': 'SELECT b.id, b.title, b.cover_path FROM books b JOIN book_series bs ON b.id = bs.book_id WHERE bs.series_id = ? ORDER BY bs.series_index, b.id LIMIT 4',
+}
+
+ENTITIES_SQL = {
+    'author': 'SELECT DISTINCT author_id FROM book_authors',
+    'series': 'SELECT DISTINCT series_id FROM book_series',
+}
+
+
+def cover_mtime(cover_path):
+    """Return the cover file's mtime, or None when there is no usable cover"""
+    if not cover_path:
+        return None
+    try:
+        return os.stat(cover_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def mosaic_key(members):
+    """Key a mosaic on its (book_id, cover_path, cover_mtime) members"""
+    digest = hashlib.sha1()
+    for book_id, cover_path, mtime in members:
+        digest.update(f'{book_id}|{cover_path if mtime is not None else ""}|{mtime}\n'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def mosaic_path(kind, entity_id, key):
+    return MOSAIC_DIR / f'{kind}-{entity_id}-{key}.jpg'
+
+
+def mosaic_url(kind, entity_id, members):
+    """URL of the mosaic for these members, or None if it cannot be drawn"""
+    if Image is None or not any(mtime is not None for _, _, mtime in members):
+        return None
+    return f'/api/mosaic/{kind}/{entity_id}?v={mosaic_key(members)}'
+
+
+def load_members(cursor, kind, entity_id):
+    """Return [(book_id, cover_path, cover_mtime)] for the books shown in a list row"""
+    cursor.execute(MEMBERS_SQL[kind], (entity_id,))
+    return [(book_id, cover_path, cover_mtime(cover_path)) for book_id, _, cover_path in cursor.fetchall()]
+
+
+def build_mosaic(kind, entity_id, members):
+    """Render the mosaic for these members (if not already on disk) and return its path"""
+    if Image is None or not members:
+        return None
+    key = mosaic_key(members)
+    path = mosaic_path(kind, entity_id, key)
+    if path.exists():
+        return path
+
+    tiles = members[:MAX_TILES]
+    width = len(tiles) * TILE_WIDTH + (len(tiles) - 1) * TILE_GAP
+    mosaic = Image.new('RGB', (width, TILE_HEIGHT), BACKGROUND)
+    for position, (_, cover_path, mtime) in enumerate(tiles):
+        tile = None
+        if mtime is not None:
+            try:
+                with Image.open(cover_path) as cover:
+                    tile = ImageOps.fit(cover.convert('RGB'), (TILE_WIDTH, TILE_HEIGHT), Image.LANCZOS)
+            except OSError:
+                tile = None
+        if tile is None:
+            tile = Image.new('RGB', (TILE_WIDTH, TILE_HEIGHT), PLACEHOLDER)
+        mosaic.paste(tile, (position * (TILE_WIDTH + TILE_GAP), 0))
+
+    MOSAIC_DIR.mkdir(parents=True, exist_ok=True)
+    # Write then rename so a concurrent request never serves a half-written file
+    temp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    mosaic.save(temp_path, 'JPEG', quality=82, optimize=True)
+    os.replace(temp_path, path)
+    remove_stale(kind, entity_id, keep=path)
+    return path
+
+
+def remove_stale(kind, entity_id, keep=None):
+    for old in MOSAIC_DIR.glob(f'{kind}-{entity_id}-*.jpg'):
+        if old != keep:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+
+def refresh_mosaics(conn):
+    """Build missing mosaics for every author and series and drop ones no longer used"""
+    if Image is None:
+        print("Pillow is not installed; skipping cover mosaics")
+        return 0
+    cursor = conn.cursor()
+    built = 0
+    wanted = set()
+    for kind in MEMBERS_SQL:
+        cursor.execute(ENTITIES_SQL[kind])
+        for (entity_id,) in cursor.fetchall():
+            members = load_members(cursor, kind, entity_id)
+            if not any(mtime is not None for _, _, mtime in members):
+                continue
+            path = mosaic_path(kind, entity_id, mosaic_key(members))
+            wanted.add(path.name)
+            if not path.exists():
+                build_mosaic(kind, entity_id, members)
+                built += 1
+    if MOSAIC_DIR.exists():
+        for old in MOSAIC_DIR.glob('*.jpg'):
+            if old.name not in wanted:
+                old.unlink()
+    return built
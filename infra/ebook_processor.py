@@ -6,6 +6,10 @@ from datetime import datetime
 import requests
 import time
 from urllib.parse import quote
+from book_identifiers import first_isbn, opf_identifiers, refresh_identifiers, store_identifiers
+from catalog_schema import compact_catalog_changes, ensure_serving_schema
+from cover_mosaics import refresh_mosaics
+from thumbnails import refresh_thumbnails
 
 class EbookCatalog:
     def __init__(self, db_path='data/tt_db_ebook_lib.db', lookup_gender=False):
@@ -107,6 +111,7 @@ class EbookCatalog:
         ''')
         
         self.conn.commit()
+        ensure_serving_schema(self.conn)
         print("Database tables created successfully")
     
     def parse_opf_metadata(self, opf_path):
@@ -115,6 +120,7 @@ class EbookCatalog:
             'title': None,
             'authors': [],
             'isbn': None,
+            'identifiers': [],
             'publisher': None,
             'publish_date': None,
             'language': None,
@@ -177,13 +183,6 @@ class EbookCatalog:
                     if desc_elem is not None:
                         metadata['description'] = desc_elem.text
                 
-                if metadata['isbn'] is None:
-                    isbn_elem = root.find(f'.//{prefix}identifier[@id="isbn"]', ns if prefix else {})
-                    if isbn_elem is None:
-                        isbn_elem = root.find(f'.//{prefix}identifier', ns if prefix else {})
-                    if isbn_elem is not None:
-                        metadata['isbn'] = isbn_elem.text
-                
                 # Extract all subject elements
                 if not metadata['subjects']:
                     subject_elems = root.findall(f'.//{prefix}subject', ns if prefix else {})
@@ -191,6 +190,10 @@ class EbookCatalog:
                         if subject_elem.text:
                             metadata['subjects'].append(subject_elem.text.strip())
             
+            # Every identifier, not just the first: Calibre lists its own id before the ISBN
+            metadata['identifiers'] = opf_identifiers(root)
+            metadata['isbn'] = first_isbn(metadata['identifiers'])
+            
             # Extract series information from meta tags (OUTSIDE the prefix loop)
             series_elem = root.find('.//meta[@name="calibre:series"]')
             if series_elem is None:
@@ -561,6 +564,8 @@ class EbookCatalog:
                     if metadata.get('series'):
                         self.link_book_series(book_id, metadata['series'], metadata.get('series_index'))
                     
+                    store_identifiers(self.cursor, book_id, metadata.get('identifiers', []))
+                    
                     for book_file in book_files:
                         file_size = book_file.stat().st_size
                         self.cursor.execute('''
@@ -590,6 +595,20 @@ class EbookCatalog:
         print(f"Successfully added {books_added} books to the database!")
         if books_skipped > 0:
             print(f"Skipped {books_skipped} books (already in database)")
+        
+        identified = refresh_identifiers(self.conn)
+        if identified:
+            print(f"Stored identifiers for {identified} previously catalogued books")
+        mosaics_built = refresh_mosaics(self.conn)
+        if mosaics_built:
+            print(f"Rendered {mosaics_built} author/series cover mosaics")
+        thumbnails_built = refresh_thumbnails(self.conn)
+        if thumbnails_built:
+            print(f"Rendered {thumbnails_built} cover thumbnails")
+        # Last, after the steps above have logged their changes
+        compacted = compact_catalog_changes(self.conn)
+        if compacted:
+            print(f"Compacted {compacted} superseded catalog change log rows")
     
     def search_books(self, query):
         """Search for books by title, author, subject, or series"""
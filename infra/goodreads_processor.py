@@ -0,0 +1,78 @@
+"""Import a Goodreads library export into the reading history.
+
+Goodreads exports one row per book on any shelf (Settings > Import and export >
+Export Library). Rows go through the same bulk_import engine as StoryGraph
+exports and land in the same tables, keyed by Goodreads book id.
+
+    python goodreads_processor.py [path/to/goodreads_library_export.csv]
+"""
+import sys
+from pathlib import Path
+
+from bulk_import import ImportAdapter, parse_int
+from storygraph_processor import StoryGraphImporter
+
+
+def unwrap_excel(value):
+    """Goodreads writes ISBNs as ="0439023483" so spreadsheets keep the leading zeros"""
+    value = (value or '').strip()
+    if value.startswith('="') and value.endswith('"'):
+        value = value[2:-1]
+    return value
+
+
+class GoodreadsAdapter(ImportAdapter):
+    """Maps Goodreads export columns onto the reading history"""
+    source = 'Goodreads'
+    required_columns = ('Book Id', 'Title', 'Author', 'Exclusive Shelf')
+
+    def source_key(self, row):
+        return f"goodreads:{row['Book Id'].strip()}"
+
+    def map_row(self, row):
+        authors = [row.get('Author', '')] + (row.get('Additional Authors') or '').split(',')
+        rating = parse_int(row.get('My Rating'))
+        return {
+            'title': row.get('Title', ''),
+            'authors': ', '.join(author.strip() for author in authors if author.strip()),
+            'isbn': unwrap_excel(row.get('ISBN13')) or unwrap_excel(row.get('ISBN')),
+            'format': row.get('Binding', ''),
+            # read, currently-reading and to-read, like StoryGraph; custom exclusive shelves pass through
+            'read_status': row.get('Exclusive Shelf', ''),
+            'date_added': row.get('Date Added', ''),
+            'last_date_read': row.get('Date Read', ''),
+            # Goodreads keeps only the last finish date, a one-day session
+            'dates_read': row.get('Date Read', ''),
+            'read_count': parse_int(row.get('Read Count')),
+            # 0 means not rated
+            'star_rating': float(rating) if rating else None,
+            'review': row.get('My Review', ''),
+            'owned': 'Yes' if parse_int(row.get('Owned Copies')) else 'No',
+            'moods': '',
+            'pace': '',
+            'character_or_plot': '',
+            'strong_character_dev': '',
+            'loveable_characters': '',
+            'diverse_characters': '',
+            'flawed_characters': '',
+            'warning_text': '',
+            'warning_description': '',
+        }
+
+
+def main():
+    print("="*60)
+    print("Goodreads Reading History Importer")
+    print("="*60)
+
+    csv_path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent / 'data' / 'goodreads_library_export.csv'
+    importer = StoryGraphImporter()
+    importer.connect()
+    importer.create_reading_tables()
+    print(f"\nImporting from: {csv_path}")
+    importer.import_export(csv_path, GoodreadsAdapter())
+    importer.close()
+
+
+if __name__ == "__main__":
+    main()
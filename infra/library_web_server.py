@@ -1,7 +1,19 @@
-from flask import Flask, render_template, jsonify, send_file
+from flask import Flask, render_template, jsonify, send_file, send_from_directory, Response, stream_with_context, request, g
+import json
 import sqlite3
 import os
 from pathlib import Path
+from urllib.parse import quote
+import time
+import metrics
+import sql_profiler
+import cover_mosaics
+import opds
+import reading_tags
+import zip_stream
+import thumbnails
+import thumbnail_pack
+from catalog_schema import ensure_serving_schema, get_catalog_version
 
 # Get the directory where this script is located
 BASE_DIR = Path(__file__).parent
@@ -12,54 +24,172 @@ app = Flask(__name__,
 
 DB_PATH = BASE_DIR / '..' / 'infra' / 'data' / 'tt_db_ebook_lib.db'
 
-def get_all_books():
+# Set LIBRARY_SQL_PROFILE=1 to record every statement, add Server-Timing headers
+# and enable /debug/slow-queries. Costs a little per statement, so it is off by default.
+SQL_PROFILE = os.environ.get('LIBRARY_SQL_PROFILE') == '1'
+
+def connect_db():
+    factory = sql_profiler.ProfilingConnection if SQL_PROFILE else metrics.TimedConnection
+    return sqlite3.connect(str(DB_PATH), factory=factory)
+
+def init_db():
     conn = sqlite3.connect(str(DB_PATH))
+    ensure_serving_schema(conn)
+    conn.close()
+
+# Restricts BOOK_ROW_SQL to books with at least one author of the given sex
+GENDER_FILTER_SQL = ' WHERE b.id IN (SELECT ba.book_id FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE a.sex = ?)'
+
+# One row per book with its authors, first series, first four subjects and cover
+# placeholder colours folded in, so listing the catalog is a single pass over a cursor
+# instead of 3 queries per book. The series name and index come from the same link row.
+# Multi-valued columns are joined with the ASCII unit separator.
+BOOK_ROW_SQL = """
+    SELECT b.id, b.title, b.cover_path,
+        (SELECT GROUP_CONCAT(a.author_name, char(31)) FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE ba.book_id = b.id),
+        (SELECT a.author_sort FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE ba.book_id = b.id LIMIT 1),
+        (SELECT ser.series_name || COALESCE(' #' || bser.series_index, '') FROM series ser JOIN book_series bser ON ser.id = bser.series_id WHERE bser.book_id = b.id LIMIT 1),
+        (SELECT GROUP_CONCAT(subject_name, char(31)) FROM (SELECT s.subject_name FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id WHERE bs.book_id = b.id LIMIT 4)),
+        (SELECT cc.dominant_color || char(31) || cc.placeholder FROM cover_sources cs JOIN cover_colors cc ON cc.content_hash = cs.content_hash WHERE cs.cover_path = b.cover_path)
+    FROM books b
+"""
+
+# Rows pulled from the cursor per chunk when streaming the catalog
+EXPORT_BATCH_SIZE = 500
+
+def book_from_row(row):
+    """Build the book list payload from a BOOK_ROW_SQL row"""
+    book_id, title, cover_path, authors, author_sort, series, subjects, colors = row
+    authors = authors.split('\x1f') if authors else []
+    if not author_sort:
+        author_sort = authors[0] if authors else 'Unknown'
+    subjects = subjects.split('\x1f') if subjects else []
+    has_cover = cover_path is not None and os.path.exists(cover_path)
+    color, placeholder = colors.split('\x1f') if colors and has_cover else (None, None)
+    return {'id': book_id, 'title': title, 'authors': ', '.join(authors) if authors else 'Unknown', 'author_sort': author_sort, 'series': series, 'subjects': subjects, 'has_cover': has_cover, 'color': color, 'placeholder': placeholder}
+
+def get_all_books(gender=None):
+    conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, title, cover_path FROM books ORDER BY title')
-    books = cursor.fetchall()
-    result = []
-    for book_id, title, cover_path in books:
-        cursor.execute('SELECT a.author_name, a.author_sort FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE ba.book_id = ?', (book_id,))
-        author_data = cursor.fetchall()
-        authors = [row[0] for row in author_data]
-        author_sort = author_data[0][1] if author_data and author_data[0][1] else (authors[0] if authors else 'Unknown')
-        cursor.execute('SELECT ser.series_name, bser.series_index FROM series ser JOIN book_series bser ON ser.id = bser.series_id WHERE bser.book_id = ?', (book_id,))
-        series_result = cursor.fetchone()
-        series = f"{series_result[0]} #{series_result[1]}" if series_result else None
-        cursor.execute('SELECT s.subject_name FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id WHERE bs.book_id = ? LIMIT 4', (book_id,))
-        subjects = [row[0] for row in cursor.fetchall()]
-        has_cover = cover_path is not None and os.path.exists(cover_path)
-        result.append({'id': book_id, 'title': title, 'authors': ', '.join(authors) if authors else 'Unknown', 'author_sort': author_sort, 'series': series, 'subjects': subjects, 'has_cover': has_cover})
+    if gender:
+        cursor.execute(BOOK_ROW_SQL + GENDER_FILTER_SQL + ' ORDER BY b.title', (gender,))
+    else:
+        cursor.execute(BOOK_ROW_SQL + ' ORDER BY b.title')
+    result = [book_from_row(row) for row in cursor.fetchall()]
     conn.close()
     return result
 
-def get_book_details(book_id):
-    conn = sqlite3.connect(str(DB_PATH))
+def get_book_ids(gender):
+    """Ids of the books with at least one author of the given gender"""
+    conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM books WHERE id = ?', (book_id,))
-    book_row = cursor.fetchone()
-    if not book_row:
+    cursor.execute('SELECT DISTINCT ba.book_id FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE a.sex = ? ORDER BY ba.book_id', (gender,))
+    result = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return result
+
+def iter_books_ndjson(gender=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the catalog as NDJSON, one chunk of at most batch_size books at a time"""
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        if gender:
+            cursor.execute(BOOK_ROW_SQL + GENDER_FILTER_SQL + ' ORDER BY b.id', (gender,))
+        else:
+            cursor.execute(BOOK_ROW_SQL + ' ORDER BY b.id')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(book_from_row(row)) + '\n' for row in rows)
+    finally:
         conn.close()
-        return None
-    cursor.execute('SELECT a.author_name FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE ba.book_id = ?', (book_id,))
-    authors = [row[0] for row in cursor.fetchall()]
-    cursor.execute('SELECT ser.series_name, bser.series_index FROM series ser JOIN book_series bser ON ser.id = bser.series_id WHERE bser.book_id = ?', (book_id,))
-    series_result = cursor.fetchone()
-    series = f"{series_result[0]} #{series_result[1]}" if series_result else None
-    cursor.execute('SELECT s.subject_name FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id WHERE bs.book_id = ?', (book_id,))
-    subjects = [row[0] for row in cursor.fetchall()]
-    cursor.execute('SELECT id, file_path, file_format FROM book_files WHERE book_id = ?', (book_id,))
-    files = [{'id': row[0], 'path': row[1], 'format': row[2].replace('.', '')} for row in cursor.fetchall()]
+
+# Keeps IN (...) lists well under SQLite's bound parameter limit
+ID_CHUNK_SIZE = 500
+
+def get_books_by_ids(cursor, book_ids):
+    """Return list payloads for the given ids (missing ids are skipped)"""
+    books = []
+    for start in range(0, len(book_ids), ID_CHUNK_SIZE):
+        chunk = book_ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(BOOK_ROW_SQL + f' WHERE b.id IN ({placeholders})', chunk)
+        books.extend(book_from_row(row) for row in cursor.fetchall())
+    return books
+
+def get_version():
+    conn = connect_db()
+    catalog_id, generation = get_catalog_version(conn.cursor())
     conn.close()
-    return {
-        'id': book_row[0], 'title': book_row[1], 'authors': ', '.join(authors) if authors else 'Unknown',
-        'isbn': book_row[3], 'publisher': book_row[4], 'publish_date': book_row[5],
-        'description': book_row[7], 'cover_path': book_row[8], 'series': series,
-        'subjects': subjects, 'files': files
-    }
+    return {'catalog_id': catalog_id, 'generation': generation}
+
+def get_changes(since, catalog_id=None):
+    """Books upserted and deleted after generation `since`.
+
+    Returns reset=True when the client's generation does not belong to this
+    database (rebuilt catalog) so it knows to reload the full list instead.
+    """
+    conn = connect_db()
+    cursor = conn.cursor()
+    # One read transaction so the generation matches the rows returned
+    cursor.execute('BEGIN')
+    current_id, generation = get_catalog_version(cursor)
+    result = {'catalog_id': current_id, 'generation': generation}
+    if (catalog_id and catalog_id != current_id) or since > generation:
+        result['reset'] = True
+        conn.close()
+        return result
+    cursor.execute('SELECT DISTINCT book_id FROM catalog_changes WHERE generation > ?', (since,))
+    changed_ids = [row[0] for row in cursor.fetchall()]
+    upserted = get_books_by_ids(cursor, changed_ids)
+    present = {book['id'] for book in upserted}
+    conn.close()
+    result['upserted'] = upserted
+    result['deleted'] = [book_id for book_id in changed_ids if book_id not in present]
+    return result
+
+# Largest ids= list accepted by /api/books/details
+DETAILS_BATCH_LIMIT = 200
+
+def get_books_details(book_ids):
+    """Details for many books keyed by id, with one query per relation for each chunk of ids"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    details = {}
+    for start in range(0, len(book_ids), ID_CHUNK_SIZE):
+        chunk = book_ids[start:start + ID_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT id, title, isbn, publisher, publish_date, description, cover_path FROM books WHERE id IN ({placeholders})', chunk)
+        books = {row[0]: row for row in cursor.fetchall()}
+        authors, series, subjects, files = {}, {}, {}, {}
+        cursor.execute(f'SELECT ba.book_id, a.author_name FROM authors a JOIN book_authors ba ON a.id = ba.author_id WHERE ba.book_id IN ({placeholders}) ORDER BY ba.book_id, ba.author_id', chunk)
+        for book_id, name in cursor.fetchall():
+            authors.setdefault(book_id, []).append(name)
+        cursor.execute(f'SELECT bser.book_id, ser.series_name, bser.series_index FROM series ser JOIN book_series bser ON ser.id = bser.series_id WHERE bser.book_id IN ({placeholders}) ORDER BY bser.book_id, bser.series_id', chunk)
+        for book_id, name, index in cursor.fetchall():
+            series.setdefault(book_id, f"{name} #{index}")
+        cursor.execute(f'SELECT bs.book_id, s.subject_name FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id WHERE bs.book_id IN ({placeholders}) ORDER BY bs.book_id, bs.subject_id', chunk)
+        for book_id, name in cursor.fetchall():
+            subjects.setdefault(book_id, []).append(name)
+        cursor.execute(f'SELECT book_id, id, file_path, file_format FROM book_files WHERE book_id IN ({placeholders}) ORDER BY id', chunk)
+        for book_id, file_id, path, file_format in cursor.fetchall():
+            files.setdefault(book_id, []).append({'id': file_id, 'path': path, 'format': file_format.replace('.', '')})
+        for book_id, title, isbn, publisher, publish_date, description, cover_path in books.values():
+            details[book_id] = {
+                'id': book_id, 'title': title, 'authors': ', '.join(authors[book_id]) if book_id in authors else 'Unknown',
+                'isbn': isbn, 'publisher': publisher, 'publish_date': publish_date,
+                'description': description, 'cover_path': cover_path, 'series': series.get(book_id),
+                'subjects': subjects.get(book_id, []), 'files': files.get(book_id, [])
+            }
+    conn.close()
+    return details
+
+def get_book_details(book_id):
+    return get_books_details([book_id]).get(book_id)
 
 def get_stats():
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     cursor = conn.cursor()
     cursor.execute('SELECT COUNT(*) FROM books')
     total_books = cursor.fetchone()[0]
@@ -72,71 +202,314 @@ def get_stats():
     conn.close()
     return {'total_books': total_books, 'total_authors': total_authors, 'total_series': total_series, 'total_subjects': total_subjects}
 
-def get_all_authors_with_counts():
-    conn = sqlite3.connect(str(DB_PATH))
+# Set LIBRARY_THUMBNAIL_PACK=1 to serve thumbnails from the packed store (see thumbnail_pack.py)
+thumbnail_pack_reader = thumbnail_pack.PackReader() if os.environ.get('LIBRARY_THUMBNAIL_PACK') == '1' else None
+
+# Byte budget for covers the browser's service worker keeps for offline use
+COVER_CACHE_BUDGET_MB = int(os.environ.get('LIBRARY_COVER_CACHE_MB', '50'))
+
+# Long-lived caching is safe for mosaics requested with their current ?v= key
+MOSAIC_MAX_AGE = 365 * 24 * 3600
+
+def get_list_row_covers(cursor, kind, entity_id):
+    """Return the cover list and mosaic URL for one author or series row"""
+    cursor.execute(cover_mosaics.MEMBERS_SQL[kind], (entity_id,))
+    covers = []
+    members = []
+    for book_id, title, cover_path in cursor.fetchall():
+        mtime = cover_mosaics.cover_mtime(cover_path)
+        covers.append({'book_id': book_id, 'title': title, 'has_cover': mtime is not None})
+        members.append((book_id, cover_path, mtime))
+    return covers, cover_mosaics.mosaic_url(kind, entity_id, members)
+
+def get_all_authors_with_counts(gender=None):
+    conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT a.author_name, COUNT(DISTINCT ba.book_id) as book_count FROM authors a JOIN book_authors ba ON a.id = ba.author_id GROUP BY a.author_name ORDER BY a.author_name')
+    where = 'WHERE a.sex = ? ' if gender else ''
+    cursor.execute('SELECT a.id, a.author_name, COUNT(DISTINCT ba.book_id) as book_count FROM authors a JOIN book_authors ba ON a.id = ba.author_id ' + where + 'GROUP BY a.id ORDER BY a.author_name', (gender,) if gender else ())
     authors = cursor.fetchall()
     result = []
-    for author_name, book_count in authors:
-        cursor.execute('SELECT b.id, b.title, b.cover_path FROM books b JOIN book_authors ba ON b.id = ba.book_id JOIN authors a ON ba.author_id = a.id WHERE a.author_name = ? LIMIT 4', (author_name,))
-        covers = []
-        for book_id, title, cover_path in cursor.fetchall():
-            has_cover = cover_path is not None and os.path.exists(cover_path)
-            covers.append({'book_id': book_id, 'title': title, 'has_cover': has_cover})
-        result.append({'name': author_name, 'book_count': book_count, 'covers': covers})
+    for author_id, author_name, book_count in authors:
+        covers, mosaic = get_list_row_covers(cursor, 'author', author_id)
+        result.append({'id': author_id, 'name': author_name, 'book_count': book_count, 'covers': covers, 'mosaic': mosaic})
     conn.close()
     return result
 
-def get_all_series_with_counts():
-    conn = sqlite3.connect(str(DB_PATH))
+def get_all_series_with_counts(gender=None):
+    conn = connect_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT s.series_name, COUNT(DISTINCT bs.book_id) as book_count FROM series s JOIN book_series bs ON s.id = bs.series_id GROUP BY s.series_name ORDER BY s.series_name')
+    # A series matches when any of its books has an author of the given sex
+    where = 'WHERE s.id IN (SELECT gbs.series_id FROM authors a JOIN book_authors ba ON a.id = ba.author_id JOIN book_series gbs ON gbs.book_id = ba.book_id WHERE a.sex = ?) ' if gender else ''
+    cursor.execute('SELECT s.id, s.series_name, COUNT(DISTINCT bs.book_id) as book_count FROM series s JOIN book_series bs ON s.id = bs.series_id ' + where + 'GROUP BY s.id ORDER BY s.series_name', (gender,) if gender else ())
     series_list = cursor.fetchall()
     result = []
-    for series_name, book_count in series_list:
-        cursor.execute('SELECT b.id, b.title, b.cover_path FROM books b JOIN book_series bs ON b.id = bs.book_id JOIN series s ON bs.series_id = s.id WHERE s.series_name = ? ORDER BY bs.series_index LIMIT 4', (series_name,))
-        covers = []
-        for book_id, title, cover_path in cursor.fetchall():
-            has_cover = cover_path is not None and os.path.exists(cover_path)
-            covers.append({'book_id': book_id, 'title': title, 'has_cover': has_cover})
-        result.append({'name': series_name, 'book_count': book_count, 'covers': covers})
+    for series_id, series_name, book_count in series_list:
+        covers, mosaic = get_list_row_covers(cursor, 'series', series_id)
+        result.append({'id': series_id, 'name': series_name, 'book_count': book_count, 'covers': covers, 'mosaic': mosaic})
     conn.close()
     return result
 
+# Book files of a whole series or author, in reading order, for the ZIP download
+BUNDLE_SQL = {
+    'series': (
+        'SELECT series_name FROM series WHERE id = ?',
+        '''SELECT b.title, bs.series_index, bf.file_path, bf.file_format FROM book_series bs
+           JOIN books b ON b.id = bs.book_id JOIN book_files bf ON bf.book_id = b.id
+           WHERE bs.series_id = ? ORDER BY bs.series_index, b.id, bf.id''',
+    ),
+    'author': (
+        'SELECT author_name FROM authors WHERE id = ?',
+        '''SELECT b.title, NULL, bf.file_path, bf.file_format FROM book_authors ba
+           JOIN books b ON b.id = ba.book_id JOIN book_files bf ON bf.book_id = b.id
+           WHERE ba.author_id = ? ORDER BY b.title, b.id, bf.id''',
+    ),
+}
+
+def safe_file_name(name):
+    return ''.join('_' if char in '/\\:*?"<>|' or ord(char) < 32 else char for char in name).strip(' .') or 'untitled'
+
+def get_download_bundle(kind, entity_id):
+    """Return (archive name, [ZipEntry]) for a series or author, or None if it does not exist"""
+    name_sql, files_sql = BUNDLE_SQL[kind]
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(name_sql, (entity_id,))
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        return None
+    folder = safe_file_name(row[0])
+    cursor.execute(files_sql, (entity_id,))
+    rows = cursor.fetchall()
+    conn.close()
+    entries = []
+    used = set()
+    for title, series_index, file_path, file_format in rows:
+        stem = safe_file_name(title or 'untitled')
+        if series_index is not None:
+            stem = f'{series_index:g} - {stem}'
+        extension = (file_format or os.path.splitext(file_path)[1]).lstrip('.').lower()
+        name = f'{folder}/{stem}.{extension}'
+        copy = 2
+        while name in used:
+            name = f'{folder}/{stem} ({copy}).{extension}'
+            copy += 1
+        try:
+            entries.append(zip_stream.make_entry(name, file_path))
+        except OSError:
+            continue
+        used.add(name)
+    return folder, entries
+
+def count_download_bytes(chunks):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.record_bytes('download', sent)
+
+# Rendered OPDS pages, keyed on the catalog generation so any catalog change retires them
+opds_cache = opds.FeedCache()
+
+def get_opds_feed(path, after=None):
+    """Return (xml, content type) for an OPDS feed, or None if the path is unknown; raises ValueError for a bad cursor"""
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        catalog_id, generation = get_catalog_version(cursor)
+        key = (path, after or '', catalog_id, generation)
+        feed = opds_cache.get(key)
+        metrics.record_cache('opds', feed is not None)
+        if feed is None:
+            feed = opds.render_feed(cursor, path, after)
+            if feed is not None:
+                opds_cache.put(key, feed)
+    finally:
+        conn.close()
+    return feed
+
+# Mood, pace and warning bitsets over the reading history, rebuilt when an import bumps its generation
+reading_tag_cache = reading_tags.TagIndexCache()
+
+# Reading history entries returned per /api/reading/filter request
+READING_FILTER_LIMIT = 100
+
+def get_reading_generation(cursor):
+    """The reading history generation, or None before the first StoryGraph import"""
+    try:
+        cursor.execute("SELECT value FROM reading_meta WHERE key = 'generation'")
+    except sqlite3.OperationalError:
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def filter_reading_history(all_of, any_of, none_of, limit):
+    """Count, first entries and tag counts of the reading history matching a tag filter"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    generation = get_reading_generation(cursor)
+    if generation is None:
+        conn.close()
+        return None
+    index, hit = reading_tag_cache.get(cursor, generation)
+    metrics.record_cache('reading_tags', hit)
+    mask = index.query(all_of, any_of, none_of)
+    ids = index.ids(mask, limit)
+    entries = []
+    if ids:
+        cursor.execute(f'''
+            SELECT id, book_id, title, authors, read_status, star_rating
+            FROM reading_history WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id
+        ''', ids)
+        entries = [{'id': row[0], 'book_id': row[1], 'title': row[2], 'authors': row[3], 'read_status': row[4], 'star_rating': row[5]}
+                   for row in cursor.fetchall()]
+    conn.close()
+    return {
+        'count': index.count(mask),
+        'entries': entries,
+        'tags': {f'{kind}:{name}': count for (kind, name), count in sorted(index.tag_counts(mask).items())},
+    }
+
+# Most entries /api/reading/top-rated returns; the importer precomputes the top 50
+TOP_RATED_LIMIT = 50
+
+# The reading endpoints below read summary tables the StoryGraph importer refreshes,
+# so each is a single-row or index-range read however long the history is.
+SUMMARY_COLUMNS = ('total', 'books_read', 'currently_reading', 'to_read', 'did_not_finish',
+                   'books_rated', 'avg_rating', 'sessions', 'first_year', 'last_year')
+
+def query_reading_summaries(sql, params=()):
+    """Rows of a query on the reading summary tables, or None if no import has created them yet"""
+    conn = connect_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+def get_reading_summary():
+    rows = query_reading_summaries(f'''
+        SELECT {', '.join(SUMMARY_COLUMNS)}, (SELECT value FROM reading_meta WHERE key = 'generation')
+        FROM reading_summary WHERE id = 1
+    ''')
+    if not rows:
+        return None
+    return dict(zip(SUMMARY_COLUMNS + ('generation',), rows[0]))
+
+def get_reading_timeline(by, first_year, last_year):
+    """Finished books per year or per month between first_year and last_year"""
+    if by == 'month':
+        rows = query_reading_summaries('''
+            SELECT year, month, books_finished, books_rated, avg_rating FROM reading_monthly
+            WHERE year BETWEEN ? AND ? ORDER BY year, month
+        ''', (first_year, last_year))
+        columns = ('year', 'month', 'books_finished', 'books_rated', 'avg_rating')
+    else:
+        rows = query_reading_summaries('''
+            SELECT year, books_finished, books_rated, avg_rating FROM reading_yearly
+            WHERE year BETWEEN ? AND ? ORDER BY year
+        ''', (first_year, last_year))
+        columns = ('year', 'books_finished', 'books_rated', 'avg_rating')
+    return None if rows is None else [dict(zip(columns, row)) for row in rows]
+
+def get_top_rated(limit):
+    rows = query_reading_summaries('''
+        SELECT rank, reading_history_id, book_id, title, authors, star_rating, last_date_read
+        FROM reading_top_rated ORDER BY rank LIMIT ?
+    ''', (limit,))
+    columns = ('rank', 'id', 'book_id', 'title', 'authors', 'star_rating', 'last_date_read')
+    return None if rows is None else [dict(zip(columns, row)) for row in rows]
+
 def get_all_subjects_with_counts():
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     cursor = conn.cursor()
     cursor.execute('SELECT s.subject_name, COUNT(DISTINCT bs.book_id) as book_count FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id GROUP BY s.subject_name ORDER BY s.subject_name')
     result = [{'name': row[0], 'book_count': row[1]} for row in cursor.fetchall()]
     conn.close()
     return result
 
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+    if SQL_PROFILE:
+        g.request_started = time.perf_counter()
+        sql_profiler.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    size = None if response.is_streamed else response.content_length
+    metrics.finish_request(route, request.method, response.status_code, size)
+    if SQL_PROFILE and 'request_started' in g:
+        queries = sql_profiler.finish_request()
+        response.headers['Server-Timing'] = sql_profiler.server_timing_header(queries, time.perf_counter() - g.request_started)
+    return response
+
+@app.route('/metrics')
+def api_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/slow-queries')
+def api_slow_queries():
+    if not SQL_PROFILE:
+        return jsonify({'error': 'SQL profiling is disabled (set LIBRARY_SQL_PROFILE=1)'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(sql_profiler.slowest_statements(DB_PATH, limit))
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', cover_cache_budget_mb=COVER_CACHE_BUDGET_MB)
+
+# Served from the root so the worker's scope covers the whole site
+@app.route('/service-worker.js')
+def service_worker():
+    response = send_from_directory(app.static_folder, 'js/service_worker.js', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/books')
 def api_books():
-    books = get_all_books()
+    # Read the version first: a change landing mid-request is then re-sent by /api/changes, never missed
+    version = get_version()
+    books = get_all_books(request.args.get('gender'))
     stats = get_stats()
-    return jsonify({'books': books, 'stats': stats})
+    return jsonify({'books': books, 'stats': stats, **version})
+
+@app.route('/api/books/ids')
+def api_book_ids():
+    # Just the ids, so the client can filter the catalog it already holds
+    return jsonify(get_book_ids(request.args.get('gender')))
+
+@app.route('/api/changes')
+def api_changes():
+    since = request.args.get('since', 0, type=int)
+    changes = get_changes(since, request.args.get('catalog'))
+    if not changes.get('reset'):
+        changes['stats'] = get_stats()
+    return jsonify(changes)
+
+@app.route('/api/books.ndjson')
+def api_books_ndjson():
+    return Response(stream_with_context(iter_books_ndjson(request.args.get('gender'))), mimetype='application/x-ndjson')
 
 @app.route('/api/authors')
 def api_authors():
-    return jsonify(get_all_authors_with_counts())
+    return jsonify(get_all_authors_with_counts(request.args.get('gender')))
 
 @app.route('/api/authors-with-covers')
 def api_authors_with_covers():
-    return jsonify(get_all_authors_with_counts())
+    return jsonify(get_all_authors_with_counts(request.args.get('gender')))
 
 @app.route('/api/series')
 def api_series():
-    return jsonify(get_all_series_with_counts())
+    return jsonify(get_all_series_with_counts(request.args.get('gender')))
 
 @app.route('/api/series-with-covers')
 def api_series_with_covers():
-    return jsonify(get_all_series_with_counts())
+    return jsonify(get_all_series_with_counts(request.args.get('gender')))
 
 @app.route('/api/subjects')
 def api_subjects():
@@ -144,13 +517,24 @@ def api_subjects():
     
 @app.route('/api/authors-by-gender/<gender>')
 def api_authors_by_gender(gender):
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     cursor = conn.cursor()
     cursor.execute('SELECT author_name FROM authors WHERE sex = ? ORDER BY author_name', (gender,))
     authors = [{'author_name': row[0]} for row in cursor.fetchall()]
     conn.close()
     return jsonify(authors)
 
+@app.route('/api/books/details')
+def api_books_details():
+    try:
+        book_ids = list(dict.fromkeys(int(part) for part in request.args.get('ids', '').split(',') if part))
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of book ids'}), 400
+    if len(book_ids) > DETAILS_BATCH_LIMIT:
+        return jsonify({'error': f'At most {DETAILS_BATCH_LIMIT} ids per request'}), 400
+    details = get_books_details(book_ids)
+    return jsonify({'books': [details[book_id] for book_id in book_ids if book_id in details]})
+
 @app.route('/api/book/<int:book_id>')
 def api_book_details(book_id):
     book = get_book_details(book_id)
@@ -158,33 +542,189 @@ def api_book_details(book_id):
         return jsonify(book)
     return jsonify({'error': 'Book not found'}), 404
 
+def get_packed_thumbnail(conn, cover_path, width, fmt):
+    """Response for a thumbnail in the pack, or None if it has not been packed"""
+    content_hash = thumbnails.source_hash(conn, cover_path)
+    if content_hash is None:
+        return None
+    name = thumbnails.cache_path(content_hash, thumbnails.snap_width(width), fmt).name
+    data = thumbnail_pack_reader.get(name)
+    if data is None:
+        return None
+    response = Response(data, mimetype=thumbnails.FORMATS[fmt][1])
+    # Names are content hashes, so they make exact ETags
+    response.set_etag(name)
+    response.vary.add('Accept')
+    response.make_conditional(request)
+    metrics.record_cache('cover_http', response.status_code == 304)
+    if response.status_code == 200:
+        metrics.record_bytes('cover', len(data))
+    return response
+
 @app.route('/api/cover/<int:book_id>')
 def api_cover(book_id):
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     cursor = conn.cursor()
     cursor.execute('SELECT cover_path FROM books WHERE id = ?', (book_id,))
     result = cursor.fetchone()
+    if not (result and result[0] and os.path.exists(result[0])):
+        conn.close()
+        return '', 404
+    # ?w= sends the precomputed thumbnail nearest that width, as WebP when the browser takes it;
+    # ?format=jpeg|webp pins the format for links that declare it, like the OPDS feeds
+    width = request.args.get('w', type=int)
+    thumbnail = None
+    if width:
+        formats = thumbnails.supported_formats()
+        fmt = request.args.get('format')
+        if fmt not in formats:
+            fmt = 'webp' if 'webp' in formats and 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+        if thumbnail_pack_reader:
+            packed = get_packed_thumbnail(conn, result[0], width, fmt)
+            if packed is not None:
+                conn.close()
+                return packed
+        thumbnail = thumbnails.get_thumbnail(conn, result[0], width, fmt)
     conn.close()
-    if result and result[0] and os.path.exists(result[0]):
-        return send_file(result[0])
-    return '', 404
+    if thumbnail:
+        response = send_file(thumbnail, mimetype=thumbnails.FORMATS[fmt][1])
+        response.vary.add('Accept')
+    else:
+        response = send_file(result[0])
+    metrics.record_cache('cover_http', response.status_code == 304)
+    if response.status_code in (200, 206):
+        metrics.record_bytes('cover', response.content_length)
+    return response
+
+@app.route('/api/mosaic/<kind>/<int:entity_id>')
+def api_mosaic(kind, entity_id):
+    if kind not in cover_mosaics.MEMBERS_SQL:
+        return '', 404
+    conn = connect_db()
+    members = cover_mosaics.load_members(conn.cursor(), kind, entity_id)
+    conn.close()
+    key = cover_mosaics.mosaic_key(members)
+    path = cover_mosaics.mosaic_path(kind, entity_id, key)
+    hit = path.exists()
+    metrics.record_cache('mosaic', hit)
+    if not hit:
+        path = cover_mosaics.build_mosaic(kind, entity_id, members)
+        if path is None:
+            return '', 404
+    versioned = request.args.get('v') == key
+    response = send_file(path, max_age=MOSAIC_MAX_AGE if versioned else 0)
+    if versioned:
+        response.cache_control.immutable = True
+    if response.status_code == 200:
+        metrics.record_bytes('mosaic', response.content_length)
+    return response
 
 @app.route('/api/download/<int:file_id>')
 def api_download(file_id):
-    conn = sqlite3.connect(str(DB_PATH))
+    conn = connect_db()
     cursor = conn.cursor()
     cursor.execute('SELECT file_path FROM book_files WHERE id = ?', (file_id,))
     result = cursor.fetchone()
     conn.close()
     if result and result[0] and os.path.exists(result[0]):
-        return send_file(result[0], as_attachment=True)
+        response = send_file(result[0], as_attachment=True)
+        if response.status_code in (200, 206):
+            metrics.record_bytes('download', response.content_length)
+        return response
     return jsonify({'error': 'File not found'}), 404
 
+@app.route('/api/download/<kind>/<int:entity_id>')
+def api_download_bundle(kind, entity_id):
+    bundle = get_download_bundle(kind, entity_id) if kind in BUNDLE_SQL else None
+    if not bundle or not bundle[1]:
+        return jsonify({'error': 'No files to download'}), 404
+    name, entries = bundle
+    etag = zip_stream.archive_etag(entries)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Content-Disposition': f"attachment; filename=\"{name.encode('ascii', 'replace').decode()}.zip\"; filename*=UTF-8''{quote(name)}.zip",
+    }
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    # Ranges need the exact length up front, which only all-stored archives have
+    length = zip_stream.archive_length(entries)
+    if length is None:
+        headers['Accept-Ranges'] = 'none'
+        return Response(stream_with_context(count_download_bytes(zip_stream.iter_zip(entries))), mimetype='application/zip', headers=headers)
+
+    headers['Accept-Ranges'] = 'bytes'
+    start, stop, status = 0, length, 200
+    # A resume whose If-Range no longer matches gets the whole new archive
+    if request.range and request.if_range.date is None and request.if_range.etag in (None, etag):
+        span = request.range.range_for_length(length)
+        if span is None:
+            headers['Content-Range'] = f'bytes */{length}'
+            return Response(status=416, headers=headers)
+        start, stop, status = span[0], span[1], 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    headers['Content-Length'] = str(stop - start)
+    body = count_download_bytes(zip_stream.iter_zip(entries, start, stop))
+    return Response(stream_with_context(body), status=status, mimetype='application/zip', headers=headers)
+
+@app.route('/api/reading/filter')
+def api_reading_filter():
+    # e.g. ?all=mood:dark,pace:fast&none=warning:violence
+    try:
+        all_of, any_of, none_of = (reading_tags.parse_tag_list(request.args.get(name)) for name in ('all', 'any', 'none'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(max(request.args.get('limit', READING_FILTER_LIMIT, type=int), 0), READING_FILTER_LIMIT)
+    result = filter_reading_history(all_of, any_of, none_of, limit)
+    if result is None:
+        return jsonify({'error': 'No reading history imported'}), 404
+    return jsonify(result)
+
+@app.route('/api/reading/stats')
+def api_reading_stats():
+    summary = get_reading_summary()
+    if summary is None:
+        return jsonify({'error': 'No reading history imported'}), 404
+    return jsonify(summary)
+
+@app.route('/api/reading/timeline')
+def api_reading_timeline():
+    by = request.args.get('by', 'year')
+    if by not in ('year', 'month'):
+        return jsonify({'error': "by must be 'year' or 'month'"}), 400
+    first_year = request.args.get('from', 0, type=int)
+    last_year = request.args.get('to', 9999, type=int)
+    periods = get_reading_timeline(by, first_year, last_year)
+    if periods is None:
+        return jsonify({'error': 'No reading history imported'}), 404
+    return jsonify({'by': by, 'periods': periods})
+
+@app.route('/api/reading/top-rated')
+def api_reading_top_rated():
+    limit = min(max(request.args.get('limit', 10, type=int), 1), TOP_RATED_LIMIT)
+    books = get_top_rated(limit)
+    if books is None:
+        return jsonify({'error': 'No reading history imported'}), 404
+    return jsonify({'books': books})
+
+@app.route('/opds')
+@app.route('/opds/<path:feed_path>')
+def api_opds(feed_path=''):
+    try:
+        feed = get_opds_feed(feed_path, request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if feed is None:
+        return jsonify({'error': 'Feed not found'}), 404
+    body, content_type = feed
+    return Response(body, mimetype=content_type)
+
 if __name__ == '__main__':
     if not DB_PATH.exists():
         print(f"Error: Database file not found: {DB_PATH}")
         print("Make sure tt_db_ebook_lib.db is in the ../infra/data/ folder.")
     else:
+        init_db()
         print("="*60)
         print("Family Library Web Catalog")
         print("="*60)
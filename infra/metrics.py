@@ -0,0 +1,201 @@
+"""In-process server metrics rendered in the Prometheus text exposition format.
+
+Everything is kept in plain dicts behind one lock, so recording a request costs a
+few dict updates and a bisect per histogram. SQLite work is counted through
+TimedConnection, which the web server uses for every connection it opens.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+_lock = threading.Lock()
+_metrics = []
+_request = threading.local()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by label values"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", _format_value(bound)))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+REQUESTS = Counter('library_http_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('library_http_request_duration_seconds', 'Time to build the response, per route.', ('route',))
+RESPONSE_BYTES = Histogram('library_http_response_size_bytes', 'Response body size when known up front, per route.', ('route',), SIZE_BUCKETS)
+QUERIES_PER_REQUEST = Histogram('library_sqlite_queries_per_request', 'SQLite statements executed per request.', ('route',), QUERY_COUNT_BUCKETS)
+QUERY_SECONDS_PER_REQUEST = Histogram('library_sqlite_query_seconds_per_request', 'Time spent executing SQLite statements per request.', ('route',))
+BYTES_SERVED = Counter('library_bytes_served_total', 'Cover and book file bytes sent to clients.', ('kind',))
+CACHE_REQUESTS = Counter('library_cache_requests_total', 'Cache lookups by cache and result (hit/miss).', ('cache', 'result'))
+
+
+def record_query(seconds, statement=True):
+    """Add SQLite time (and one statement, unless it was a fetch) to the current request"""
+    if getattr(_request, 'active', False):
+        if statement:
+            _request.queries += 1
+        _request.query_seconds += seconds
+
+
+def start_request():
+    _request.active = True
+    _request.started = time.perf_counter()
+    _request.queries = 0
+    _request.query_seconds = 0.0
+
+
+def finish_request(route, method, status, size=None):
+    """Record the request that start_request() opened on this thread"""
+    if not getattr(_request, 'active', False):
+        return
+    _request.active = False
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_SECONDS.observe(time.perf_counter() - _request.started, route=route)
+    if size is not None:
+        RESPONSE_BYTES.observe(size, route=route)
+    QUERIES_PER_REQUEST.observe(_request.queries, route=route)
+    QUERY_SECONDS_PER_REQUEST.observe(_request.query_seconds, route=route)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_bytes(kind, size):
+    if size:
+        BYTES_SERVED.inc(size, kind=kind)
+
+
+def render():
+    """Return every metric in the Prometheus text format"""
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statement and fetch time to the current request.
+
+    Iterating the cursor directly is not timed; use the fetch methods.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_query(time.perf_counter() - started, statement=False)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            record_query(time.perf_counter() - started, statement=False)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_query(time.perf_counter() - started, statement=False)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors are TimedCursors; pass as sqlite3.connect(factory=...)"""
+
+    cursor_class = TimedCursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_class)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
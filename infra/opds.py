@@ -0,0 +1,292 @@
+"""OPDS 1.2 catalog feeds (Atom XML) for e-reader apps such as KOReader.
+
+render_feed() turns a feed path like 'authors/12' into XML using the given
+cursor. Every list is paged with keyset pagination: the 'after' token carries
+the sort key of the last entry on the page, so each page is an index range scan
+no matter how deep the reader has paged. The web server caches the rendered XML
+in a FeedCache keyed on the catalog generation, so repeat requests do no SQL work
+until the catalog changes.
+"""
+import base64
+import json
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+OPDS_NS = 'http://opds-spec.org/2010/catalog'
+DC_NS = 'http://purl.org/dc/terms/'
+ET.register_namespace('', ATOM_NS)
+ET.register_namespace('opds', OPDS_NS)
+ET.register_namespace('dc', DC_NS)
+
+NAVIGATION_TYPE = 'application/atom+xml;profile=opds-catalog;kind=navigation'
+ACQUISITION_TYPE = 'application/atom+xml;profile=opds-catalog;kind=acquisition'
+PAGE_SIZE = 50
+
+FILE_TYPES = {
+    'epub': 'application/epub+zip',
+    'mobi': 'application/x-mobipocket-ebook',
+    'azw': 'application/vnd.amazon.ebook',
+    'azw3': 'application/vnd.amazon.ebook',
+    'pdf': 'application/pdf',
+    'txt': 'text/plain',
+}
+
+# Keyset queries per list. Each selects (sort key, id, ...) with rows after the cursor.
+NAVIGATION_LISTS = {
+    'authors': ('Authors', '''
+        SELECT a.author_name, a.id, COUNT(ba.book_id) FROM authors a JOIN book_authors ba ON a.id = ba.author_id
+        WHERE (a.author_name, a.id) > (?, ?) GROUP BY a.id ORDER BY a.author_name, a.id LIMIT ?
+    '''),
+    'series': ('Series', '''
+        SELECT s.series_name, s.id, COUNT(bs.book_id) FROM series s JOIN book_series bs ON s.id = bs.series_id
+        WHERE (s.series_name, s.id) > (?, ?) GROUP BY s.id ORDER BY s.series_name, s.id LIMIT ?
+    '''),
+    'subjects': ('Subjects', '''
+        SELECT s.subject_name, s.id, COUNT(bs.book_id) FROM subjects s JOIN book_subjects bs ON s.id = bs.subject_id
+        WHERE (s.subject_name, s.id) > (?, ?) GROUP BY s.id ORDER BY s.subject_name, s.id LIMIT ?
+    '''),
+}
+
+NAME_QUERIES = {
+    'authors': 'SELECT author_name FROM authors WHERE id = ?',
+    'series': 'SELECT series_name FROM series WHERE id = ?',
+    'subjects': 'SELECT subject_name FROM subjects WHERE id = ?',
+}
+
+# Title lists sort on COALESCE(b.title, '') so books without a title are listed too; the
+# separate >= bound lets SQLite range-scan idx_books_title_key, which the row value alone does not
+BOOK_LISTS = {
+    'books': '''
+        SELECT COALESCE(b.title, ''), b.id FROM books b
+        WHERE COALESCE(b.title, '') >= ?1 AND (COALESCE(b.title, ''), b.id) > (?1, ?2)
+        ORDER BY COALESCE(b.title, ''), b.id LIMIT ?3
+    ''',
+    'authors': '''
+        SELECT COALESCE(b.title, ''), b.id FROM books b JOIN book_authors ba ON b.id = ba.book_id
+        WHERE ba.author_id = ?1 AND COALESCE(b.title, '') >= ?2 AND (COALESCE(b.title, ''), b.id) > (?2, ?3)
+        ORDER BY COALESCE(b.title, ''), b.id LIMIT ?4
+    ''',
+    'series': '''
+        SELECT COALESCE(bs.series_index, -1), b.id FROM books b JOIN book_series bs ON b.id = bs.book_id
+        WHERE bs.series_id = ? AND (COALESCE(bs.series_index, -1), b.id) > (?, ?) ORDER BY 1, b.id LIMIT ?
+    ''',
+    'subjects': '''
+        SELECT COALESCE(b.title, ''), b.id FROM books b JOIN book_subjects bs ON b.id = bs.book_id
+        WHERE bs.subject_id = ?1 AND COALESCE(b.title, '') >= ?2 AND (COALESCE(b.title, ''), b.id) > (?2, ?3)
+        ORDER BY COALESCE(b.title, ''), b.id LIMIT ?4
+    ''',
+    # Newest first; the sort key is the id itself
+    'recent': '''
+        SELECT b.id, b.id FROM books b
+        WHERE b.id < ? ORDER BY b.id DESC LIMIT ?
+    ''',
+}
+
+
+class FeedCache:
+    """Small thread-safe LRU of rendered feeds"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def encode_cursor(sort_key, row_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_key, row_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, default):
+    """Return (sort_key, id) from an 'after' token, or default when absent; raises ValueError when malformed"""
+    if not token:
+        return default
+    try:
+        sort_key, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        row_id = int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Malformed 'after' cursor: {token}") from e
+    # The sort key goes to sqlite as a bind parameter, so only scalars are accepted
+    if sort_key is not None and (isinstance(sort_key, bool) or not isinstance(sort_key, (str, int, float))):
+        raise ValueError(f"Malformed 'after' cursor: {token}")
+    return sort_key, row_id
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _sub(parent, tag, text=None, ns=ATOM_NS, **attrs):
+    elem = ET.SubElement(parent, f'{{{ns}}}{tag}', {k.rstrip('_'): v for k, v in attrs.items()})
+    if text is not None:
+        elem.text = str(text)
+    return elem
+
+
+def _feed(feed_id, title, self_href, kind_type, next_href=None, up_href='/opds'):
+    feed = ET.Element(f'{{{ATOM_NS}}}feed')
+    _sub(feed, 'id', feed_id)
+    _sub(feed, 'title', title)
+    _sub(feed, 'updated', _now())
+    author = _sub(feed, 'author')
+    _sub(author, 'name', 'Family Library')
+    _sub(feed, 'link', rel='self', href=self_href, type=kind_type)
+    _sub(feed, 'link', rel='start', href='/opds', type=NAVIGATION_TYPE)
+    if up_href:
+        _sub(feed, 'link', rel='up', href=up_href, type=NAVIGATION_TYPE)
+    if next_href:
+        _sub(feed, 'link', rel='next', href=next_href, type=kind_type)
+    return feed
+
+
+def _nav_entry(feed, entry_id, title, href, content=None, kind_type=ACQUISITION_TYPE):
+    entry = _sub(feed, 'entry')
+    _sub(entry, 'id', entry_id)
+    _sub(entry, 'title', title)
+    _sub(entry, 'updated', _now())
+    if content:
+        _sub(entry, 'content', content, type='text')
+    _sub(entry, 'link', rel='subsection', href=href, type=kind_type)
+
+
+def _to_xml(feed):
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(feed, encoding='utf-8')
+
+
+def _page_href(base, rows, page_size):
+    """Link to the next page when this one came back full"""
+    if len(rows) < page_size:
+        return None
+    sort_key, row_id = rows[-1][0], rows[-1][1]
+    return f'{base}?after={encode_cursor(sort_key, row_id)}'
+
+
+def render_root():
+    feed = _feed('urn:library:root', 'Family Library', '/opds', NAVIGATION_TYPE, up_href=None)
+    _nav_entry(feed, 'urn:library:recent', 'Recently Added', '/opds/recent', 'Newest books first')
+    _nav_entry(feed, 'urn:library:books', 'All Books', '/opds/books', 'Every book by title')
+    _nav_entry(feed, 'urn:library:authors', 'Authors', '/opds/authors', 'Browse by author', NAVIGATION_TYPE)
+    _nav_entry(feed, 'urn:library:series', 'Series', '/opds/series', 'Browse by series', NAVIGATION_TYPE)
+    _nav_entry(feed, 'urn:library:subjects', 'Subjects', '/opds/subjects', 'Browse by subject', NAVIGATION_TYPE)
+    return _to_xml(feed), NAVIGATION_TYPE
+
+
+def render_navigation(cursor, kind, after, page_size=PAGE_SIZE):
+    title, sql = NAVIGATION_LISTS[kind]
+    sort_key, row_id = decode_cursor(after, ('', 0))
+    cursor.execute(sql, (sort_key, row_id, page_size))
+    rows = cursor.fetchall()
+    base = f'/opds/{kind}'
+    feed = _feed(f'urn:library:{kind}', title, base + (f'?after={after}' if after else ''), NAVIGATION_TYPE, _page_href(base, rows, page_size))
+    for name, entity_id, book_count in rows:
+        _nav_entry(feed, f'urn:library:{kind}:{entity_id}', name, f'{base}/{entity_id}', f"{book_count} book{'s' if book_count != 1 else ''}")
+    return _to_xml(feed), NAVIGATION_TYPE
+
+
+def _add_book_entries(cursor, feed, book_ids):
+    """Append acquisition entries, loading each relation with one query for the whole page"""
+    if not book_ids:
+        return
+    placeholders = ','.join('?' * len(book_ids))
+    cursor.execute(f'SELECT id, title, description, publisher, publish_date, language, cover_path, created_at FROM books WHERE id IN ({placeholders})', book_ids)
+    books = {row[0]: row for row in cursor.fetchall()}
+    authors = {}
+    cursor.execute(f'SELECT ba.book_id, a.author_name FROM book_authors ba JOIN authors a ON a.id = ba.author_id WHERE ba.book_id IN ({placeholders})', book_ids)
+    for book_id, name in cursor.fetchall():
+        authors.setdefault(book_id, []).append(name)
+    subjects = {}
+    cursor.execute(f'SELECT bs.book_id, s.subject_name FROM book_subjects bs JOIN subjects s ON s.id = bs.subject_id WHERE bs.book_id IN ({placeholders})', book_ids)
+    for book_id, name in cursor.fetchall():
+        subjects.setdefault(book_id, []).append(name)
+    files = {}
+    cursor.execute(f'SELECT book_id, id, file_format, file_size FROM book_files WHERE book_id IN ({placeholders}) ORDER BY id', book_ids)
+    for book_id, file_id, file_format, file_size in cursor.fetchall():
+        files.setdefault(book_id, []).append((file_id, (file_format or '').lstrip('.').lower(), file_size))
+
+    for book_id in book_ids:
+        if book_id not in books:
+            continue
+        _, title, description, publisher, publish_date, language, cover_path, created_at = books[book_id]
+        entry = _sub(feed, 'entry')
+        _sub(entry, 'id', f'urn:library:book:{book_id}')
+        _sub(entry, 'title', title)
+        _sub(entry, 'updated', (created_at or '').replace(' ', 'T') + 'Z' if created_at else _now())
+        for name in authors.get(book_id, []):
+            author = _sub(entry, 'author')
+            _sub(author, 'name', name)
+        for name in subjects.get(book_id, []):
+            _sub(entry, 'category', term=name, label=name)
+        if publisher:
+            _sub(entry, 'publisher', publisher, ns=DC_NS)
+        if publish_date:
+            _sub(entry, 'issued', publish_date[:10], ns=DC_NS)
+        if language:
+            _sub(entry, 'language', language, ns=DC_NS)
+        if description:
+            # Descriptions from OPF files are usually HTML fragments
+            _sub(entry, 'summary', description, type='html')
+        if cover_path:
+            _sub(entry, 'link', rel='http://opds-spec.org/image', href=f'/api/cover/{book_id}?w=800&format=jpeg', type='image/jpeg')
+            _sub(entry, 'link', rel='http://opds-spec.org/image/thumbnail', href=f'/api/cover/{book_id}?w=240&format=jpeg', type='image/jpeg')
+        for file_id, file_format, file_size in files.get(book_id, []):
+            attrs = {'rel': 'http://opds-spec.org/acquisition', 'href': f'/api/download/{file_id}',
+                     'type': FILE_TYPES.get(file_format, 'application/octet-stream'), 'title': file_format.upper()}
+            if file_size:
+                attrs['length'] = str(file_size)
+            _sub(entry, 'link', **attrs)
+
+
+def render_books(cursor, kind, entity_id, after, page_size=PAGE_SIZE):
+    """Acquisition feed for one author/series/subject, all books, or recent additions"""
+    if kind == 'recent':
+        _, row_id = decode_cursor(after, (None, 2 ** 62))
+        params = (row_id, page_size)
+        title, base, up = 'Recently Added', '/opds/recent', '/opds'
+    elif kind == 'books':
+        sort_key, row_id = decode_cursor(after, ('', 0))
+        params = (sort_key, row_id, page_size)
+        title, base, up = 'All Books', '/opds/books', '/opds'
+    else:
+        cursor.execute(NAME_QUERIES[kind], (entity_id,))
+        name = cursor.fetchone()
+        if not name:
+            return None
+        sort_key, row_id = decode_cursor(after, (-2, 0) if kind == 'series' else ('', 0))
+        params = (entity_id, sort_key, row_id, page_size)
+        title, base, up = name[0], f'/opds/{kind}/{entity_id}', f'/opds/{kind}'
+    cursor.execute(BOOK_LISTS[kind], params)
+    rows = cursor.fetchall()
+    feed = _feed(f'urn:library:{kind}' + (f':{entity_id}' if entity_id else ''), title,
+                 base + (f'?after={after}' if after else ''), ACQUISITION_TYPE, _page_href(base, rows, page_size), up)
+    _add_book_entries(cursor, feed, [row[1] for row in rows])
+    return _to_xml(feed), ACQUISITION_TYPE
+
+
+def render_feed(cursor, path, after=None):
+    """Return (xml bytes, content type) for an OPDS path below /opds, or None if unknown"""
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        return render_root()
+    if len(parts) == 1 and parts[0] in NAVIGATION_LISTS:
+        return render_navigation(cursor, parts[0], after)
+    if len(parts) == 1 and parts[0] in ('books', 'recent'):
+        return render_books(cursor, parts[0], None, after)
+    if len(parts) == 2 and parts[0] in NAVIGATION_LISTS and parts[1].isdigit():
+        return render_books(cursor, parts[0], int(parts[1]), after)
+    return None
@@ -0,0 +1,122 @@
+"""Mood, pace and content-warning tags of the reading history, indexed as bitsets.
+
+The StoryGraph importer splits the comma-joined Moods, Pace and Content Warnings
+columns into a tag dictionary (reading_tags) and a link table
+(reading_history_tags). TagIndex loads those once and keeps one Python int per
+tag, with bit i set when the i-th reading history row carries the tag. A filter
+such as "dark AND fast AND NOT graphic violence" is then a couple of ANDs over
+ints, and counts are popcounts, with no LIKE scans.
+
+Tags are written "kind:name", e.g. mood:dark, pace:fast, warning:violence.
+"""
+import threading
+
+TAG_KINDS = ('mood', 'pace', 'warning')
+
+
+def normalize_tag(name):
+    return ' '.join(name.casefold().split())
+
+
+def parse_tags(moods, pace, warnings):
+    """(kind, name) tags of one export row's Moods, Pace and Content Warnings values"""
+    tags = [('mood', normalize_tag(mood)) for mood in (moods or '').split(',')]
+    tags.append(('pace', normalize_tag(pace or '')))
+    # Warnings come grouped by severity: "Graphic: Violence, Gore; Moderate: Death; "
+    for group in (warnings or '').split(';'):
+        names = group.split(':', 1)[-1]
+        tags.extend(('warning', normalize_tag(name)) for name in names.split(','))
+    return list(dict.fromkeys(tag for tag in tags if tag[1]))
+
+
+def parse_tag_list(text):
+    """Split 'mood:dark,pace:fast' into [('mood', 'dark'), ('pace', 'fast')]; raises ValueError on bad kinds"""
+    tags = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        kind, _, name = part.partition(':')
+        kind = kind.strip().lower()
+        if kind not in TAG_KINDS or not name.strip():
+            raise ValueError(f"Tags look like kind:name with kind one of {', '.join(TAG_KINDS)}, got '{part.strip()}'")
+        tags.append((kind, normalize_tag(name)))
+    return tags
+
+
+class TagIndex:
+    """Per-tag bitsets over the reading history rows"""
+
+    def __init__(self, row_ids, memberships):
+        """row_ids: reading_history ids in bit order; memberships: (kind, name, reading_history_id) rows"""
+        self.row_ids = list(row_ids)
+        position = {row_id: i for i, row_id in enumerate(self.row_ids)}
+        self.all_rows = (1 << len(self.row_ids)) - 1
+        self.bits = {}
+        for kind, name, row_id in memberships:
+            if row_id in position:
+                self.bits[(kind, name)] = self.bits.get((kind, name), 0) | (1 << position[row_id])
+
+    @classmethod
+    def from_db(cls, cursor):
+        cursor.execute('SELECT id FROM reading_history ORDER BY id')
+        row_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('''
+            SELECT t.kind, t.name, rht.reading_history_id
+            FROM reading_history_tags rht
+            JOIN reading_tags t ON t.id = rht.tag_id
+        ''')
+        return cls(row_ids, cursor.fetchall())
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """Bitset of rows with every tag in all_of, at least one in any_of (if given) and none in none_of"""
+        mask = self.all_rows
+        for tag in all_of:
+            mask &= self.bits.get(tag, 0)
+        if any_of:
+            either = 0
+            for tag in any_of:
+                either |= self.bits.get(tag, 0)
+            mask &= either
+        for tag in none_of:
+            mask &= ~self.bits.get(tag, 0)
+        return mask
+
+    def ids(self, mask, limit=None):
+        """reading_history ids in a bitset, lowest first"""
+        ids = []
+        while mask and (limit is None or len(ids) < limit):
+            low = mask & -mask
+            ids.append(self.row_ids[low.bit_length() - 1])
+            mask ^= low
+        return ids
+
+    def count(self, mask):
+        return mask.bit_count()
+
+    def tag_counts(self, mask):
+        """{(kind, name): rows in mask with that tag} for every tag present in mask"""
+        counts = {}
+        for tag, bits in self.bits.items():
+            count = (bits & mask).bit_count()
+            if count:
+                counts[tag] = count
+        return counts
+
+
+class TagIndexCache:
+    """Holds one TagIndex, rebuilt when the reading history generation changes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = None
+        self.index = None
+
+    def get(self, cursor, generation):
+        """(index, hit) for the given generation, building the index on a miss"""
+        with self.lock:
+            if self.index is not None and self.generation == generation:
+                return self.index, True
+        index = TagIndex.from_db(cursor)
+        with self.lock:
+            self.index, self.generation = index, generation
+        return index, False
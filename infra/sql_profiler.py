@@ -0,0 +1,145 @@
+"""Opt-in per-statement SQLite profiling for the web server.
+
+ProfilingConnection records the text, parameters, duration and row count of each
+statement run during a request. The server turns the request's statements into a
+Server-Timing header, and keeps the slowest statement of each distinct SQL text
+so /debug/slow-queries can show them alongside EXPLAIN QUERY PLAN.
+"""
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Distinct SQL texts remembered for the slow query report
+MAX_TRACKED_STATEMENTS = 500
+# Individual statements named in each Server-Timing header
+SERVER_TIMING_STATEMENTS = 3
+
+_lock = threading.Lock()
+_statements = {}
+_request = threading.local()
+
+
+class QueryRecord:
+    __slots__ = ('sql', 'parameters', 'seconds', 'rows')
+
+    def __init__(self, sql, parameters):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = 0.0
+        self.rows = 0
+
+
+def start_request():
+    _request.queries = []
+
+
+def finish_request():
+    """Fold the current request's statements into the slow query report and return them"""
+    queries = getattr(_request, 'queries', None) or []
+    _request.queries = None
+    with _lock:
+        for query in queries:
+            stats = _statements.get(query.sql)
+            if stats is None:
+                if len(_statements) >= MAX_TRACKED_STATEMENTS:
+                    continue
+                stats = _statements[query.sql] = {'sql': query.sql, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'parameters': ()}
+            ms = query.seconds * 1000
+            stats['count'] += 1
+            stats['total_ms'] += ms
+            stats['rows'] += query.rows
+            if ms >= stats['max_ms']:
+                stats['max_ms'] = ms
+                stats['parameters'] = query.parameters
+    return queries
+
+
+def _quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def server_timing_header(queries, total_seconds):
+    """Build a Server-Timing value: overall time, total SQLite time and the slowest statements"""
+    db_ms = sum(q.seconds for q in queries) * 1000
+    parts = [f'app;dur={total_seconds * 1000:.2f}', f'db;dur={db_ms:.2f};desc={_quote(f"{len(queries)} queries")}']
+    slowest = sorted(queries, key=lambda q: q.seconds, reverse=True)[:SERVER_TIMING_STATEMENTS]
+    for position, query in enumerate(slowest, 1):
+        summary = ' '.join(query.sql.split())[:80]
+        parts.append(f'sql{position};dur={query.seconds * 1000:.2f};desc={_quote(f"{query.rows} rows: {summary}")}')
+    return ', '.join(parts)
+
+
+def slowest_statements(db_path, limit=20):
+    """Return the slowest distinct statements seen so far, each with its query plan"""
+    with _lock:
+        report = sorted((dict(stats) for stats in _statements.values()), key=lambda s: s['max_ms'], reverse=True)[:limit]
+    conn = sqlite3.connect(str(db_path))
+    cursor = conn.cursor()
+    for stats in report:
+        stats['avg_ms'] = round(stats['total_ms'] / stats['count'], 3)
+        stats['total_ms'] = round(stats['total_ms'], 3)
+        stats['max_ms'] = round(stats['max_ms'], 3)
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + stats['sql'], stats['parameters'])
+            stats['query_plan'] = [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            stats['query_plan'] = [f'unavailable: {e}']
+        stats['parameters'] = list(stats['parameters'])
+    conn.close()
+    return report
+
+
+class ProfilingCursor(metrics.TimedCursor):
+    """TimedCursor that also keeps a QueryRecord per statement for the current request"""
+
+    def _begin(self, sql, parameters):
+        queries = getattr(_request, 'queries', None)
+        self._record = None
+        if queries is not None:
+            self._record = QueryRecord(sql, tuple(parameters) if isinstance(parameters, (list, tuple)) else parameters)
+            queries.append(self._record)
+        return time.perf_counter()
+
+    def _add(self, started, rows=0):
+        record = getattr(self, '_record', None)
+        if record is not None:
+            record.seconds += time.perf_counter() - started
+            record.rows += rows
+
+    def execute(self, sql, parameters=()):
+        started = self._begin(sql, parameters)
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add(started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = self._begin(sql, ())
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(started, max(self.rowcount, 0))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add(started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add(started, len(rows))
+        return rows
+
+
+class ProfilingConnection(metrics.TimedConnection):
+    cursor_class = ProfilingCursor
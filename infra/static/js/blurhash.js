@@ -0,0 +1,86 @@
+// Decodes BlurHash strings (https://blurha.sh) into tiny data URLs used as cover placeholders.
+// The server computes the hashes when it renders thumbnails (see thumbnails.py).
+
+const BLURHASH_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~';
+const BLURHASH_WIDTH = 8;
+const BLURHASH_HEIGHT = 12;
+const blurhashUrls = new Map();
+
+function decode83(text) {
+    let value = 0;
+    for (const character of text) value = value * 83 + BLURHASH_CHARACTERS.indexOf(character);
+    return value;
+}
+
+function srgbToLinear(value) {
+    const v = value / 255;
+    return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+}
+
+function linearToSrgb(value) {
+    const v = Math.max(0, Math.min(1, value));
+    return v <= 0.0031308 ? Math.round(v * 12.92 * 255) : Math.round((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255);
+}
+
+function decodeBlurhash(hash, width, height) {
+    const sizeFlag = decode83(hash[0]);
+    const componentsY = Math.floor(sizeFlag / 9) + 1;
+    const componentsX = (sizeFlag % 9) + 1;
+    const maxValue = (decode83(hash[1]) + 1) / 166;
+    const dc = decode83(hash.slice(2, 6));
+    const colors = [[srgbToLinear(dc >> 16), srgbToLinear((dc >> 8) & 255), srgbToLinear(dc & 255)]];
+    for (let i = 1; i < componentsX * componentsY; i++) {
+        const value = decode83(hash.slice(4 + i * 2, 6 + i * 2));
+        colors.push([Math.floor(value / 361), Math.floor(value / 19) % 19, value % 19].map(q => {
+            const v = (q - 9) / 9;
+            return Math.sign(v) * v * v * maxValue;
+        }));
+    }
+
+    const pixels = new Uint8ClampedArray(width * height * 4);
+    for (let y = 0; y < height; y++) {
+        for (let x = 0; x < width; x++) {
+            let r = 0, g = 0, b = 0;
+            for (let j = 0; j < componentsY; j++) {
+                for (let i = 0; i < componentsX; i++) {
+                    const basis = Math.cos(Math.PI * x * i / width) * Math.cos(Math.PI * y * j / height);
+                    const color = colors[i + j * componentsX];
+                    r += color[0] * basis;
+                    g += color[1] * basis;
+                    b += color[2] * basis;
+                }
+            }
+            const offset = (y * width + x) * 4;
+            pixels[offset] = linearToSrgb(r);
+            pixels[offset + 1] = linearToSrgb(g);
+            pixels[offset + 2] = linearToSrgb(b);
+            pixels[offset + 3] = 255;
+        }
+    }
+    return pixels;
+}
+
+// Decoded once per hash; the grid re-renders cards on every scroll
+function blurhashUrl(hash) {
+    if (!hash) return null;
+    if (!blurhashUrls.has(hash)) {
+        let url = null;
+        try {
+            const canvas = document.createElement('canvas');
+            canvas.width = BLURHASH_WIDTH;
+            canvas.height = BLURHASH_HEIGHT;
+            const pixels = decodeBlurhash(hash, BLURHASH_WIDTH, BLURHASH_HEIGHT);
+            canvas.getContext('2d').putImageData(new ImageData(pixels, BLURHASH_WIDTH, BLURHASH_HEIGHT), 0, 0);
+            url = canvas.toDataURL();
+        } catch (error) { console.error('Bad placeholder hash:', hash, error); }
+        blurhashUrls.set(hash, url);
+    }
+    return blurhashUrls.get(hash);
+}
+
+// Inline style that paints a book's placeholder behind its cover <img> until the image loads
+function coverPlaceholderStyle(book) {
+    if (!book.color) return '';
+    const url = blurhashUrl(book.placeholder);
+    return `background: ${book.color}${url ? ` url(${url}) center / cover no-repeat` : ''};`;
+}
@@ -0,0 +1,67 @@
+// Filters and sorts the catalog off the main thread so typing in the search box stays responsive.
+// Messages in:  {type: 'books', books}, {type: 'gender', filterType, ids},
+//               {type: 'query', requestId, searchTerm, filterType, sort}
+// Messages out: {requestId, indices} where indices point into the posted books array.
+
+let books = [];
+let searchText = [];
+let orders = {};
+const genderIds = {};
+
+function buildOrder(sortType) {
+    const indices = books.map((_, i) => i);
+    switch(sortType) {
+        case 'title-asc':
+            return indices.sort((a, b) => books[a].title.localeCompare(books[b].title));
+        case 'title-desc':
+            return indices.sort((a, b) => books[b].title.localeCompare(books[a].title));
+        case 'author-asc':
+            return indices.sort((a, b) => books[a].author_sort.localeCompare(books[b].author_sort));
+        case 'author-desc':
+            return indices.sort((a, b) => books[b].author_sort.localeCompare(books[a].author_sort));
+        case 'recent':
+            // Ids are assigned in ingest order, so the highest ids were added last
+            return indices.sort((a, b) => books[b].id - books[a].id);
+        default:
+            return indices;
+    }
+}
+
+// Each sort order is computed once per catalog, then every query is a single linear pass
+function getOrder(sortType) {
+    if (!orders[sortType]) orders[sortType] = buildOrder(sortType);
+    return orders[sortType];
+}
+
+function matchesFilter(book, filterType) {
+    if (filterType === 'series') return book.series !== null;
+    if (filterType === 'standalone') return book.series === null;
+    if (genderIds[filterType]) return genderIds[filterType].has(book.id);
+    return true;
+}
+
+function query(searchTerm, filterType, sortType) {
+    const term = searchTerm ? searchTerm.toLowerCase() : '';
+    const result = [];
+    for (const i of getOrder(sortType)) {
+        if (!matchesFilter(books[i], filterType)) continue;
+        if (term && !searchText[i].includes(term)) continue;
+        result.push(i);
+    }
+    return Int32Array.from(result);
+}
+
+self.onmessage = (event) => {
+    const message = event.data;
+    if (message.type === 'books') {
+        books = message.books;
+        // Title, authors, subjects and series joined by a separator a search term cannot span
+        searchText = books.map(book => [book.title, book.authors, ...book.subjects, book.series || ''].join('\u0000').toLowerCase());
+        orders = {};
+    } else if (message.type === 'gender') {
+        genderIds[message.filterType] = new Set(message.ids);
+    } else if (message.type === 'query') {
+        const indices = query(message.searchTerm, message.filterType, message.sort);
+        self.postMessage({ requestId: message.requestId, indices }, [indices.buffer]);
+    }
+};
@@ -1,58 +1,217 @@
 let allBooks = [];
 let currentFilter = 'all';
 let currentSort = 'title-asc';
-let maleAuthors = [];
-let femaleAuthors = [];
+// Book ids per gender filter, fetched from the server on first use
+const genderBookIds = {};
+const GENDER_CODES = { male: 'M', female: 'F' };
+
+// Filtering and sorting run in a worker; only the newest query's answer is rendered
+const filterWorker = new Worker('/static/js/filter_worker.js');
+let latestQueryId = 0;
+const SEARCH_DEBOUNCE_MS = 150;
+
+// Virtualized grid: only rows near the viewport exist in the DOM.
+// Keep these in step with .books-grid and .book-card in style.css.
+const GRID_MIN_CARD_WIDTH = 300;
+const GRID_GAP = 20;
+const GRID_OVERSCAN_ROWS = 3;
+let gridBooks = [];
+let gridColumns = 1;
+let gridRowHeight = 170;
+let gridRenderedRange = '';
+let gridFramePending = false;
+
+const coverObserver = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+    entries.forEach(entry => {
+        if (!entry.isIntersecting) return;
+        const img = entry.target;
+        img.src = img.dataset.src;
+        coverObserver.unobserve(img);
+    });
+}, { rootMargin: '300px 0px' }) : null;
+
+// Book details are fetched before the click: visible cards in batches once scrolling
+// settles, a hovered card right away. Values are promises so a click joins a fetch in flight.
+const DETAILS_BATCH_SIZE = 50;
+const DETAILS_PREFETCH_DELAY_MS = 200;
+const DETAILS_CACHE_LIMIT = 1000;
+const bookDetails = new Map();
+const detailsQueue = new Set();
+let detailsTimer = null;
+
+function fetchDetailsBatch(ids) {
+    const batch = fetch(`/api/books/details?ids=${ids.join(',')}`)
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => new Map(data.books.map(book => [book.id, book])));
+    ids.forEach(id => {
+        const details = batch.then(found => found.get(id) || null);
+        // Forget failures so the next click or hover tries again
+        details.catch(() => bookDetails.delete(id));
+        bookDetails.set(id, details);
+    });
+    // Oldest entries go first; Map keeps insertion order
+    for (const id of bookDetails.keys()) {
+        if (bookDetails.size <= DETAILS_CACHE_LIMIT) break;
+        bookDetails.delete(id);
+    }
+}
+
+function flushDetailsQueue() {
+    clearTimeout(detailsTimer);
+    detailsTimer = null;
+    const ids = Array.from(detailsQueue).filter(id => !bookDetails.has(id));
+    detailsQueue.clear();
+    for (let i = 0; i < ids.length; i += DETAILS_BATCH_SIZE) {
+        fetchDetailsBatch(ids.slice(i, i + DETAILS_BATCH_SIZE));
+    }
+}
+
+function prefetchDetails(ids, delay = DETAILS_PREFETCH_DELAY_MS) {
+    ids.forEach(id => { if (!bookDetails.has(id)) detailsQueue.add(id); });
+    if (detailsQueue.size === 0) return;
+    clearTimeout(detailsTimer);
+    detailsTimer = setTimeout(flushDetailsQueue, delay);
+}
+
+function getBookDetails(bookId) {
+    if (!bookDetails.has(bookId)) {
+        detailsQueue.add(bookId);
+        flushDetailsQueue();
+    }
+    return bookDetails.get(bookId);
+}
+
+filterWorker.onmessage = (event) => {
+    if (event.data.requestId !== latestQueryId) return;
+    displayBooks(Array.from(event.data.indices, i => allBooks[i]));
+};
+
+// The catalog is cached in IndexedDB and kept current with /api/changes, so a warm
+// start needs one small request instead of the full /api/books download.
+const CATALOG_DB_NAME = 'library-catalog';
+const CATALOG_DB_VERSION = 1;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function idbTransactionDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = tx.onabort = () => reject(tx.error);
+    });
+}
+
+async function openCatalogDb() {
+    if (!('indexedDB' in window)) return null;
+    const request = indexedDB.open(CATALOG_DB_NAME, CATALOG_DB_VERSION);
+    request.onupgradeneeded = () => {
+        const db = request.result;
+        db.createObjectStore('books', { keyPath: 'id' });
+        db.createObjectStore('meta');
+    };
+    return idbRequest(request);
+}
+
+async function readCachedCatalog(db) {
+    const tx = db.transaction(['books', 'meta'], 'readonly');
+    const [books, sync] = await Promise.all([
+        idbRequest(tx.objectStore('books').getAll()),
+        idbRequest(tx.objectStore('meta').get('sync')),
+    ]);
+    return sync ? { books, sync } : null;
+}
+
+// Replace the whole cache (clear=true) or apply upserts/deletes, then store the new sync point
+async function writeCachedCatalog(db, { upserted = [], deleted = [], sync, clear = false }) {
+    const tx = db.transaction(['books', 'meta'], 'readwrite');
+    const store = tx.objectStore('books');
+    if (clear) store.clear();
+    upserted.forEach(book => store.put(book));
+    deleted.forEach(id => store.delete(id));
+    tx.objectStore('meta').put(sync, 'sync');
+    return idbTransactionDone(tx);
+}
+
+function setCatalog(books, stats) {
+    allBooks = books;
+    // Details fetched before a catalog change may be stale
+    bookDetails.clear();
+    filterWorker.postMessage({ type: 'books', books: allBooks });
+    filterBooks(document.getElementById('searchInput').value, currentFilter);
+    updateStats(stats);
+}
+
+async function loadFullCatalog(db) {
+    const response = await fetch('/api/books');
+    const data = await response.json();
+    setCatalog(data.books, data.stats);
+    if (db) {
+        const sync = { catalogId: data.catalog_id, generation: data.generation, stats: data.stats };
+        await writeCachedCatalog(db, { upserted: data.books, sync, clear: true });
+    }
+}
 
 async function loadBooks() {
+    let db = null;
+    let cached = null;
     try {
-        const response = await fetch('/api/books');
-        const data = await response.json();
-        allBooks = data.books;
-        displayBooks(allBooks);
-        updateStats(data.stats);
-        
-        // Load gender data
-        const maleResponse = await fetch('/api/authors-by-gender/M');
-        const maleData = await maleResponse.json();
-        maleAuthors = maleData.map(a => a.author_name);
-        
-        const femaleResponse = await fetch('/api/authors-by-gender/F');
-        const femaleData = await femaleResponse.json();
-        femaleAuthors = femaleData.map(a => a.author_name);
+        db = await openCatalogDb();
+        cached = db ? await readCachedCatalog(db) : null;
+    } catch (error) { console.error('Catalog cache unavailable:', error); }
+
+    try {
+        if (!cached) {
+            await loadFullCatalog(db);
+            return;
+        }
+        // Show the cached catalog right away, then catch up
+        setCatalog(cached.books, cached.sync.stats);
+        const response = await fetch(`/api/changes?since=${cached.sync.generation}&catalog=${encodeURIComponent(cached.sync.catalogId)}`);
+        const changes = await response.json();
+        if (changes.reset) {
+            await loadFullCatalog(db);
+            return;
+        }
+        const sync = { catalogId: changes.catalog_id, generation: changes.generation, stats: changes.stats };
+        if (changes.upserted.length === 0 && changes.deleted.length === 0) {
+            if (changes.generation !== cached.sync.generation) await writeCachedCatalog(db, { sync });
+            updateStats(changes.stats);
+            return;
+        }
+        const byId = new Map(allBooks.map(book => [book.id, book]));
+        changes.upserted.forEach(book => byId.set(book.id, book));
+        changes.deleted.forEach(id => byId.delete(id));
+        // Gender id lists may now be stale; refetch the active one
+        Object.keys(genderBookIds).forEach(key => delete genderBookIds[key]);
+        await loadGenderBookIds(currentFilter);
+        setCatalog(Array.from(byId.values()), changes.stats);
+        await writeCachedCatalog(db, { upserted: changes.upserted, deleted: changes.deleted, sync });
     } catch (error) {
-        document.getElementById('booksContainer').innerHTML = '<div class="no-results">Error loading books</div>';
+        if (allBooks.length === 0) {
+            document.getElementById('booksContainer').innerHTML = '<div class="no-results">Error loading books</div>';
+        }
     }
 }
 
-function sortBooks(books, sortType) {
-    const sorted = [...books];
-    switch(sortType) {
-        case 'title-asc':
-            return sorted.sort((a, b) => a.title.localeCompare(b.title));
-        case 'title-desc':
-            return sorted.sort((a, b) => b.title.localeCompare(a.title));
-        case 'author-asc':
-            return sorted.sort((a, b) => a.author_sort.localeCompare(b.author_sort));
-        case 'author-desc':
-            return sorted.sort((a, b) => b.author_sort.localeCompare(a.author_sort));
-        case 'recent':
-            return sorted.reverse();
-        default:
-            return sorted;
-    }
+async function loadGenderBookIds(filterType) {
+    const gender = GENDER_CODES[filterType];
+    if (!gender || genderBookIds[filterType]) return;
+    const response = await fetch(`/api/books/ids?gender=${gender}`);
+    genderBookIds[filterType] = await response.json();
+    filterWorker.postMessage({ type: 'gender', filterType, ids: genderBookIds[filterType] });
 }
 
-function displayBooks(books) {
-    const container = document.getElementById('booksContainer');
-    if (books.length === 0) {
-        container.innerHTML = '<div class="no-results">No books found</div>';
-        return;
-    }
-    const sortedBooks = sortBooks(books, currentSort);
-    container.innerHTML = '<div class="books-grid">' + sortedBooks.map(book => `
-        <div class="book-card" onclick="showBookDetails(${book.id})">
-            ${book.has_cover ? `<img src="/api/cover/${book.id}" class="book-card-cover">` : `<div class="book-card-cover-placeholder">📚</div>`}
+function bookCardHtml(book) {
+    return `
+        <div class="book-card" onclick="showBookDetails(${book.id})" onmouseenter="prefetchDetails([${book.id}], 0)">
+            ${book.has_cover ? `<img data-src="/api/cover/${book.id}?w=160" class="book-card-cover" style="${coverPlaceholderStyle(book)}" alt="">` : `<div class="book-card-cover-placeholder">📚</div>`}
             <div class="book-card-info">
                 <div class="book-title">${book.title}</div>
                 <div class="book-author">by ${book.authors}</div>
@@ -60,9 +219,77 @@ function displayBooks(books) {
                 ${book.subjects.length > 0 ? `<div class="book-subjects">${book.subjects.map(s => `<span class="subject-tag">${s}</span>`).join('')}</div>` : ''}
             </div>
         </div>
-    `).join('') + '</div>';
+    `;
+}
+
+// books arrive already filtered and sorted by the worker
+function displayBooks(books) {
+    const container = document.getElementById('booksContainer');
+    gridBooks = books;
+    gridRenderedRange = '';
+    if (books.length === 0) {
+        container.innerHTML = '<div class="no-results">No books found</div>';
+        return;
+    }
+    if (!document.getElementById('booksGrid')) {
+        container.innerHTML = '<div class="books-grid-window" id="booksGridWindow"><div class="books-grid" id="booksGrid"></div></div>';
+    }
+    layoutGrid();
+}
+
+function layoutGrid() {
+    const gridWindow = document.getElementById('booksGridWindow');
+    if (!gridWindow) return;
+    gridColumns = Math.max(1, Math.floor((gridWindow.clientWidth + GRID_GAP) / (GRID_MIN_CARD_WIDTH + GRID_GAP)));
+    const rows = Math.ceil(gridBooks.length / gridColumns);
+    gridWindow.style.height = `${Math.max(0, rows * gridRowHeight - GRID_GAP)}px`;
+    gridRenderedRange = '';
+    renderVisibleRows();
+}
+
+function renderVisibleRows() {
+    const gridWindow = document.getElementById('booksGridWindow');
+    const grid = document.getElementById('booksGrid');
+    if (!gridWindow || !grid || gridWindow.offsetParent === null) return;
+
+    const top = gridWindow.getBoundingClientRect().top;
+    const rows = Math.ceil(gridBooks.length / gridColumns);
+    const firstRow = Math.max(0, Math.floor(-top / gridRowHeight) - GRID_OVERSCAN_ROWS);
+    const lastRow = Math.min(rows - 1, Math.ceil((window.innerHeight - top) / gridRowHeight) + GRID_OVERSCAN_ROWS);
+    const range = `${firstRow}:${lastRow}:${gridColumns}`;
+    if (range === gridRenderedRange) return;
+    gridRenderedRange = range;
+
+    grid.style.transform = `translateY(${firstRow * gridRowHeight}px)`;
+    grid.innerHTML = gridBooks.slice(firstRow * gridColumns, (lastRow + 1) * gridColumns).map(bookCardHtml).join('');
+    grid.querySelectorAll('img[data-src]').forEach(img => {
+        if (coverObserver) coverObserver.observe(img);
+        else img.src = img.dataset.src;
+    });
+    const firstVisible = Math.max(0, Math.floor(-top / gridRowHeight)) * gridColumns;
+    const lastVisible = (Math.ceil((window.innerHeight - top) / gridRowHeight)) * gridColumns;
+    prefetchDetails(gridBooks.slice(firstVisible, lastVisible).map(book => book.id));
+
+    // Cards have a fixed height in CSS; pick it up once in case fonts or zoom changed it
+    const card = grid.firstElementChild;
+    if (card && card.offsetHeight + GRID_GAP !== gridRowHeight) {
+        gridRowHeight = card.offsetHeight + GRID_GAP;
+        layoutGrid();
+    }
 }
 
+function scheduleGridRender() {
+    if (gridFramePending) return;
+    gridFramePending = true;
+    requestAnimationFrame(() => {
+        gridFramePending = false;
+        renderVisibleRows();
+    });
+}
+
+window.addEventListener('scroll', scheduleGridRender, { passive: true });
+window.addEventListener('resize', () => requestAnimationFrame(layoutGrid));
+
 async function showBookDetails(bookId) {
     const modal = document.getElementById('bookModal');
     const modalBody = document.getElementById('modalBody');
@@ -70,11 +297,11 @@ async function showBookDetails(bookId) {
     modalBody.innerHTML = '<div class="loading">Loading book details...</div>';
     
     try {
-        const response = await fetch(`/api/book/${bookId}`);
-        const book = await response.json();
+        const book = await getBookDetails(bookId);
+        if (!book) throw new Error(`Book ${bookId} not found`);
         modalBody.innerHTML = `
             <div class="book-detail-grid">
-                <div>${book.cover_path ? `<img src="/api/cover/${bookId}" class="book-cover">` : `<div class="book-cover-placeholder">📚</div>`}</div>
+                <div>${book.cover_path ? `<img src="/api/cover/${bookId}?w=500" class="book-cover">` : `<div class="book-cover-placeholder">📚</div>`}</div>
                 <div class="book-info">
                     <h2>${book.title}</h2>
                     <div class="author">${book.authors}</div>
@@ -102,52 +329,32 @@ window.onclick = function(event) {
 }
 
 function filterBooks(searchTerm, filterType) {
-    let filtered = allBooks;
-    
-    // Apply filter type
-    if (filterType === 'series') {
-        filtered = filtered.filter(book => book.series !== null);
-    } else if (filterType === 'standalone') {
-        filtered = filtered.filter(book => book.series === null);
-    } else if (filterType === 'male') {
-        filtered = filtered.filter(book => 
-            maleAuthors.some(author => book.authors.includes(author))
-        );
-    } else if (filterType === 'female') {
-        filtered = filtered.filter(book => 
-            femaleAuthors.some(author => book.authors.includes(author))
-        );
-    }
-    
-    // Apply search term
-    if (searchTerm) {
-        const term = searchTerm.toLowerCase();
-        filtered = filtered.filter(book => 
-            book.title.toLowerCase().includes(term) ||
-            book.authors.toLowerCase().includes(term) ||
-            book.subjects.some(s => s.toLowerCase().includes(term)) ||
-            (book.series && book.series.toLowerCase().includes(term))
-        );
-    }
-    displayBooks(filtered);
+    latestQueryId += 1;
+    filterWorker.postMessage({ type: 'query', requestId: latestQueryId, searchTerm, filterType, sort: currentSort });
+}
+
+function debounce(fn, delay) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), delay);
+    };
 }
 
 function updateStats(stats) {
     document.getElementById('totalBooksBadge').textContent = `📖 ${stats.total_books} Books`;
 }
 
+// One mosaic image per row when the server can draw it, otherwise up to four covers
+function listItemCovers(item) {
+    if (item.mosaic) return `<img src="${item.mosaic}" class="list-item-mosaic" loading="lazy" alt="">`;
+    return item.covers.slice(0, 4).map(cover => cover.has_cover ? `<img src="/api/cover/${cover.book_id}?w=120" class="list-item-cover-thumb">` : `<div class="list-item-cover-placeholder">📚</div>`).join('');
+}
+
 async function showAuthors(genderFilter = null) {
     try {
-        const response = await fetch('/api/authors-with-covers');
-        const allAuthors = await response.json();
-        
-        // Filter by gender if specified
-        let filteredAuthors = allAuthors;
-        if (genderFilter === 'M') {
-            filteredAuthors = allAuthors.filter(author => maleAuthors.includes(author.name));
-        } else if (genderFilter === 'F') {
-            filteredAuthors = allAuthors.filter(author => femaleAuthors.includes(author.name));
-        }
+        const response = await fetch('/api/authors-with-covers' + (genderFilter ? `?gender=${genderFilter}` : ''));
+        const filteredAuthors = await response.json();
         
         document.getElementById('mainView').style.display = 'none';
         document.getElementById('listView').style.display = 'block';
@@ -166,13 +373,12 @@ async function showAuthors(genderFilter = null) {
         
         document.getElementById('listContainer').innerHTML = filterButtons + filteredAuthors.map(author => `
             <div class="list-item" onclick="filterByAuthor('${author.name.replace(/'/g, "\\'")}')">
-                <div class="list-item-covers">
-                    ${author.covers.slice(0, 4).map(cover => cover.has_cover ? `<img src="/api/cover/${cover.book_id}" class="list-item-cover-thumb">` : `<div class="list-item-cover-placeholder">📚</div>`).join('')}
-                </div>
+                <div class="list-item-covers">${listItemCovers(author)}</div>
                 <div class="list-item-info">
                     <div class="list-item-name">${author.name}</div>
                     <div class="list-item-count">${author.book_count} book${author.book_count !== 1 ? 's' : ''}</div>
                 </div>
+                <a class="list-item-download" href="/api/download/author/${author.id}" onclick="event.stopPropagation()" title="Download every book as one ZIP">⬇ ZIP</a>
             </div>
         `).join('');
     } catch (error) { console.error('Error loading authors:', error); }
@@ -180,28 +386,9 @@ async function showAuthors(genderFilter = null) {
 
 async function showSeries(genderFilter = null) {
     try {
-        const response = await fetch('/api/series-with-covers');
-        const allSeriesData = await response.json();
-        
-        // For series, we need to check if any author in the series matches the gender
-        let filteredSeries = allSeriesData;
-        if (genderFilter) {
-            const genderAuthorsList = genderFilter === 'M' ? maleAuthors : femaleAuthors;
-            filteredSeries = [];
-            
-            for (const series of allSeriesData) {
-                // Check books we already have loaded for this series
-                const seriesBooks = allBooks.filter(book => book.series && book.series.includes(series.name));
-                
-                const hasGenderAuthor = seriesBooks.some(book => 
-                    genderAuthorsList.some(author => book.authors.includes(author))
-                );
-                
-                if (hasGenderAuthor) {
-                    filteredSeries.push(series);
-                }
-            }
-        }
+        // The server keeps series with at least one book by an author of that gender
+        const response = await fetch('/api/series-with-covers' + (genderFilter ? `?gender=${genderFilter}` : ''));
+        const filteredSeries = await response.json();
         
         document.getElementById('mainView').style.display = 'none';
         document.getElementById('listView').style.display = 'block';
@@ -220,13 +407,12 @@ async function showSeries(genderFilter = null) {
         
         document.getElementById('listContainer').innerHTML = filterButtons + filteredSeries.map(series => `
             <div class="list-item" onclick="filterBySeries('${series.name.replace(/'/g, "\\'")}')">
-                <div class="list-item-covers">
-                    ${series.covers.slice(0, 4).map(cover => cover.has_cover ? `<img src="/api/cover/${cover.book_id}" class="list-item-cover-thumb">` : `<div class="list-item-cover-placeholder">📚</div>`).join('')}
-                </div>
+                <div class="list-item-covers">${listItemCovers(series)}</div>
                 <div class="list-item-info">
                     <div class="list-item-name">${series.name}</div>
                     <div class="list-item-count">${series.book_count} book${series.book_count !== 1 ? 's' : ''}</div>
                 </div>
+                <a class="list-item-download" href="/api/download/series/${series.id}" onclick="event.stopPropagation()" title="Download every book as one ZIP">⬇ ZIP</a>
             </div>
         `).join('');
     } catch (error) { console.error('Error loading series:', error); }
@@ -237,6 +423,8 @@ function showMainView() {
     document.getElementById('mainView').style.display = 'block';
     document.getElementById('searchInput').value = '';
     filterBooks('', 'all');
+    // The grid could not measure itself while hidden
+    layoutGrid();
 }
 
 function showAllBooks() {
@@ -262,7 +450,8 @@ function filterBySubject(subjectName) {
     filterBooks(subjectName, currentFilter);
 }
 
-document.getElementById('searchInput').addEventListener('input', (e) => filterBooks(e.target.value, currentFilter));
+const debouncedFilter = debounce(filterBooks, SEARCH_DEBOUNCE_MS);
+document.getElementById('searchInput').addEventListener('input', (e) => debouncedFilter(e.target.value, currentFilter));
 
 document.getElementById('sortSelect').addEventListener('change', (e) => {
     currentSort = e.target.value;
@@ -270,10 +459,13 @@ document.getElementById('sortSelect').addEventListener('change', (e) => {
 });
 
 document.querySelectorAll('.filter-btn').forEach(btn => {
-    btn.addEventListener('click', () => {
+    btn.addEventListener('click', async () => {
         document.querySelectorAll('.filter-btn').forEach(b => b.classList.remove('active'));
         btn.classList.add('active');
         currentFilter = btn.dataset.filter;
+        try {
+            await loadGenderBookIds(currentFilter);
+        } catch (error) { console.error('Error loading gender filter:', error); }
         filterBooks(document.getElementById('searchInput').value, currentFilter);
     });
 });
@@ -0,0 +1,160 @@
+// Service worker: makes the library open instantly and keep working when the server is slow or unreachable.
+//  - App shell (page, CSS, JS): served from cache, refreshed in the background.
+//  - Covers and mosaics: stale-while-revalidate from Cache Storage, trimmed least-recently-used
+//    to the byte budget passed at registration (?coverBudgetMb=N).
+//  - Catalog and list API: network first with a short timeout, falling back to the last good
+//    response. Only the stable list URLs are cached, so the data cache holds one entry per list
+//    and gender; per-request URLs (/api/books/details?ids=, /api/changes?since=) go straight
+//    to the network, where the page keeps its own copies.
+// Bump CACHE_VERSION when the shell's file list changes.
+
+const CACHE_VERSION = 'v3';
+const SHELL_CACHE = `library-shell-${CACHE_VERSION}`;
+const COVER_CACHE = `library-covers-${CACHE_VERSION}`;
+const DATA_CACHE = `library-data-${CACHE_VERSION}`;
+const SHELL_URLS = ['/', '/static/css/style.css', '/static/js/blurhash.js', '/static/js/main.js', '/static/js/filter_worker.js'];
+const DATA_PATHS = ['/api/books', '/api/books/ids', '/api/authors', '/api/authors-with-covers', '/api/series', '/api/series-with-covers', '/api/subjects'];
+// Query parameters a cached list URL may carry; anything else would give it an open-ended set of keys
+const DATA_PARAMS = ['gender'];
+
+const COVER_BUDGET_BYTES = Number(new URL(self.location).searchParams.get('coverBudgetMb') || 50) * 1024 * 1024;
+// Cached covers younger than this are served without asking the server again
+const COVER_REVALIDATE_MS = 24 * 60 * 60 * 1000;
+const NETWORK_TIMEOUT_MS = 3000;
+
+// Byte ledger for the cover cache (url -> {size, usedAt, fetchedAt}), kept in IndexedDB
+const LEDGER_DB = 'library-sw';
+let ledgerPromise = null;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openLedger() {
+    if (!ledgerPromise) {
+        const request = indexedDB.open(LEDGER_DB, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore('covers', { keyPath: 'url' });
+        ledgerPromise = idbRequest(request);
+    }
+    return ledgerPromise;
+}
+
+async function ledgerGet(url) {
+    const db = await openLedger();
+    return idbRequest(db.transaction('covers').objectStore('covers').get(url));
+}
+
+async function ledgerPut(entry) {
+    const db = await openLedger();
+    return idbRequest(db.transaction('covers', 'readwrite').objectStore('covers').put(entry));
+}
+
+// Evict least recently used covers until the cache is back under budget
+async function enforceCoverBudget() {
+    const db = await openLedger();
+    const entries = await idbRequest(db.transaction('covers').objectStore('covers').getAll());
+    let total = entries.reduce((sum, entry) => sum + entry.size, 0);
+    if (total <= COVER_BUDGET_BYTES) return;
+    entries.sort((a, b) => a.usedAt - b.usedAt);
+    const victims = [];
+    for (const entry of entries) {
+        if (total <= COVER_BUDGET_BYTES * 0.9) break;
+        total -= entry.size;
+        victims.push(entry.url);
+    }
+    // Queue all ledger deletes before awaiting anything else, or the transaction auto-commits
+    const store = db.transaction('covers', 'readwrite').objectStore('covers');
+    victims.forEach(url => store.delete(url));
+    const cache = await caches.open(COVER_CACHE);
+    await Promise.all(victims.map(url => cache.delete(url)));
+}
+
+async function fetchAndCacheCover(request, cache) {
+    const response = await fetch(request);
+    if (response.ok) {
+        const body = await response.clone().blob();
+        await cache.put(request, response.clone());
+        const now = Date.now();
+        await ledgerPut({ url: request.url, size: body.size, usedAt: now, fetchedAt: now });
+        enforceCoverBudget();
+    }
+    return response;
+}
+
+async function serveCover(event) {
+    const cache = await caches.open(COVER_CACHE);
+    const cached = await cache.match(event.request);
+    if (!cached) return fetchAndCacheCover(event.request, cache);
+
+    const entry = await ledgerGet(event.request.url);
+    const now = Date.now();
+    // Versioned mosaic URLs never change content, so they are never revalidated
+    const versioned = new URL(event.request.url).searchParams.has('v');
+    if (entry) ledgerPut({ ...entry, usedAt: now });
+    if (!versioned && (!entry || now - entry.fetchedAt > COVER_REVALIDATE_MS)) {
+        event.waitUntil(fetchAndCacheCover(event.request, cache).catch(() => {}));
+    }
+    return cached;
+}
+
+function timeout(ms) {
+    return new Promise((_, reject) => setTimeout(() => reject(new Error('timeout')), ms));
+}
+
+async function serveData(request) {
+    const cache = await caches.open(DATA_CACHE);
+    const network = fetch(request).then(response => {
+        if (response.ok) cache.put(request, response.clone());
+        return response;
+    });
+    try {
+        return await Promise.race([network, timeout(NETWORK_TIMEOUT_MS)]);
+    } catch (error) {
+        // Slow or offline: use the last good answer, or keep waiting if there is none
+        const cached = await cache.match(request);
+        return cached || network;
+    }
+}
+
+async function serveShell(event) {
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(event.request, { ignoreSearch: true });
+    const refresh = fetch(event.request).then(response => {
+        if (response.ok) cache.put(event.request, response.clone());
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(SHELL_URLS)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    const keep = [SHELL_CACHE, COVER_CACHE, DATA_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => !keep.includes(name)).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (SHELL_URLS.includes(url.pathname)) {
+        event.respondWith(serveShell(event));
+    } else if (url.pathname.startsWith('/api/cover/') || url.pathname.startsWith('/api/mosaic/')) {
+        event.respondWith(serveCover(event));
+    } else if (DATA_PATHS.includes(url.pathname) && Array.from(url.searchParams.keys()).every(key => DATA_PARAMS.includes(key))) {
+        event.respondWith(serveData(event.request));
+    }
+});
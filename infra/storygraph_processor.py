@@ -1,13 +1,108 @@
 import sqlite3
-import csv
+import re
 from pathlib import Path
 from datetime import datetime
 
+from bulk_import import RECORD_FIELDS, BulkImporter, ImportAdapter, parse_float, parse_int
+from reading_tags import parse_tags
+from title_matcher import tokenize
+
+# Entries kept in the precomputed top-rated list
+TOP_RATED_SIZE = 50
+
+# The same read exported by two sources (Goodreads history moved into StoryGraph, say) is two
+# reading_history rows matched to one book. The summaries count it once: a read is a book and
+# its finish date, and a book's entry is its row marked read, else its first row. Sessions and
+# rows not matched to a library book always count on their own.
+READ_KEY_SQL = "COALESCE(rh.book_id || ':' || rs.end_date, -rs.id)"
+READING_ENTRIES_SQL = '''
+    SELECT * FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY COALESCE(book_id, -id) ORDER BY read_status = 'read' DESC, id) AS entry_rank
+        FROM reading_history
+    ) WHERE entry_rank = 1
+'''
+
+# reading_history columns filled from an export row, in the order history values are built
+HISTORY_COLUMNS = ('book_id', 'match_confidence', 'source_key', 'content_hash') + RECORD_FIELDS
+
+def storygraph_source_key(isbn, title, authors, date_added):
+    """Stable identity of an export row: its ISBN/UID, or its title, authors and date added when it has none"""
+    isbn = (isbn or '').strip()
+    if isbn:
+        return f'storygraph:{isbn}'
+    # A book listed twice without an ISBN is two entries, added on different dates
+    return 'storygraph:' + '|'.join(' '.join(tokenize(part)) for part in (title, authors, date_added))
+
+# One end of a Dates Read range: 2024/05/05, 2024/05 or 2024
+READ_DATE = re.compile(r'^(\d{4})(?:/(\d{1,2}))?(?:/(\d{1,2}))?$')
+
+def parse_read_date(text):
+    """An ISO date with the precision StoryGraph gave ('2024-05-05', '2024-05' or '2024'), or None"""
+    match = READ_DATE.match(text.strip())
+    if not match:
+        return None
+    year, month, day = match.groups()
+    return '-'.join([year] + [f'{int(part):02d}' for part in (month, day) if part])
+
+def parse_dates_read(text):
+    """Reading sessions in a Dates Read value as (start, end) ISO dates; either end may be None"""
+    # Sessions are comma separated; each is 'start-end', or a single finish date
+    sessions = []
+    for part in (text or '').split(','):
+        start, dash, end = part.partition('-')
+        session = (parse_read_date(start), parse_read_date(end)) if dash else (None, parse_read_date(start))
+        if session != (None, None):
+            sessions.append(session)
+    return sessions
+
+def session_rows(reading_history_id, dates_read):
+    """reading_sessions rows for one reading history row"""
+    rows = []
+    for start, end in parse_dates_read(dates_read):
+        year = int(end[:4]) if end else None
+        month = int(end[5:7]) if end and len(end) >= 7 else None
+        rows.append((reading_history_id, start, end, year, month))
+    return rows
+
+class StoryGraphAdapter(ImportAdapter):
+    """Maps StoryGraph export columns onto the reading history"""
+    source = 'StoryGraph'
+    required_columns = ('Title', 'Authors', 'ISBN/UID', 'Read Status')
+    
+    def source_key(self, row):
+        return storygraph_source_key(row.get('ISBN/UID'), row.get('Title', ''), row.get('Authors', ''), row.get('Date Added'))
+    
+    def map_row(self, row):
+        return {
+            'title': row.get('Title', ''),
+            'authors': row.get('Authors', ''),
+            'isbn': row.get('ISBN/UID', ''),
+            'format': row.get('Format', ''),
+            'read_status': row.get('Read Status', ''),
+            'date_added': row.get('Date Added', ''),
+            'last_date_read': row.get('Last Date Read', ''),
+            'dates_read': row.get('Dates Read', ''),
+            'read_count': parse_int(row.get('Read Count')),
+            'star_rating': parse_float(row.get('Star Rating')),
+            'review': row.get('Review', ''),
+            'owned': row.get('Owned?', ''),
+            'moods': row.get('Moods', ''),
+            'pace': row.get('Pace', ''),
+            'character_or_plot': row.get('Character- or Plot-Driven?', ''),
+            'strong_character_dev': row.get('Strong Character Development?', ''),
+            'loveable_characters': row.get('Loveable Characters?', ''),
+            'diverse_characters': row.get('Diverse Characters?', ''),
+            'flawed_characters': row.get('Flawed Characters?', ''),
+            'warning_text': row.get('Content Warnings', ''),
+            'warning_description': row.get('Content Warning Description', ''),
+        }
+
 class StoryGraphImporter:
     def __init__(self, db_path='data/tt_db_ebook_lib.db'):
         self.db_path = db_path
         self.conn = None
         self.cursor = None
+        self.tag_ids = None
     
     def connect(self):
         """Connect to SQLite database"""
@@ -35,10 +130,19 @@ class StoryGraphImporter:
                 star_rating REAL,
                 review TEXT,
                 owned TEXT,
+                match_confidence REAL,
+                source_key TEXT,
+                content_hash TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (book_id) REFERENCES books (id)
             )
         ''')
+        # Add columns that older databases lack
+        self.cursor.execute('PRAGMA table_info(reading_history)')
+        columns = {column[1] for column in self.cursor.fetchall()}
+        for column, column_type in (('match_confidence', 'REAL'), ('source_key', 'TEXT'), ('content_hash', 'TEXT')):
+            if column not in columns:
+                self.cursor.execute(f'ALTER TABLE reading_history ADD COLUMN {column} {column_type}')
         
         # Book attributes table
         self.cursor.execute('''
@@ -67,162 +171,368 @@ class StoryGraphImporter:
             )
         ''')
         
+        # One row per Dates Read session; year and month are when it ended
+        backfill_sessions = not self.table_exists('reading_sessions')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                reading_history_id INTEGER NOT NULL,
+                start_date TEXT,
+                end_date TEXT,
+                year INTEGER,
+                month INTEGER,
+                FOREIGN KEY (reading_history_id) REFERENCES reading_history (id) ON DELETE CASCADE
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reading_sessions_history ON reading_sessions (reading_history_id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reading_sessions_start ON reading_sessions (start_date)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reading_sessions_end ON reading_sessions (end_date)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_reading_sessions_period ON reading_sessions (year, month)')
+        
+        # Finished sessions per month and per year, kept current by each import.
+        # Sessions known only to the year count in the yearly rollup alone.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_monthly (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                books_finished INTEGER NOT NULL,
+                books_rated INTEGER NOT NULL,
+                avg_rating REAL,
+                PRIMARY KEY (year, month)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_yearly (
+                year INTEGER PRIMARY KEY,
+                books_finished INTEGER NOT NULL,
+                books_rated INTEGER NOT NULL,
+                avg_rating REAL
+            )
+        ''')
+        
+        # Moods, pace and content warnings split into a tag dictionary (see reading_tags.py)
+        backfill_tags = not self.table_exists('reading_history_tags')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_tags (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                name TEXT NOT NULL,
+                UNIQUE (kind, name)
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_history_tags (
+                reading_history_id INTEGER NOT NULL,
+                tag_id INTEGER NOT NULL,
+                PRIMARY KEY (reading_history_id, tag_id),
+                FOREIGN KEY (reading_history_id) REFERENCES reading_history (id) ON DELETE CASCADE,
+                FOREIGN KEY (tag_id) REFERENCES reading_tags (id)
+            )
+        ''')
+        
+        # generation goes up with every import that writes anything, so readers know when to reload
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        ''')
+        self.cursor.execute("INSERT OR IGNORE INTO reading_meta (key, value) VALUES ('generation', 0)")
+        
+        # Summaries the stats API reads as is, refreshed after every import that writes anything
+        backfill_summaries = not self.table_exists('reading_summary')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_summary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total INTEGER NOT NULL,
+                books_read INTEGER NOT NULL,
+                currently_reading INTEGER NOT NULL,
+                to_read INTEGER NOT NULL,
+                did_not_finish INTEGER NOT NULL,
+                books_rated INTEGER NOT NULL,
+                avg_rating REAL,
+                sessions INTEGER NOT NULL,
+                first_year INTEGER,
+                last_year INTEGER
+            )
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reading_top_rated (
+                rank INTEGER PRIMARY KEY,
+                reading_history_id INTEGER NOT NULL,
+                book_id INTEGER,
+                title TEXT,
+                authors TEXT,
+                star_rating REAL NOT NULL,
+                last_date_read TEXT
+            )
+        ''')
+        
+        migrated = self.migrate_legacy_rows()
+        if backfill_sessions:
+            self.rebuild_reading_sessions()
+        if backfill_tags:
+            self.rebuild_reading_tags()
+        if migrated or backfill_sessions or backfill_tags or backfill_summaries:
+            self.publish_changes()
+        self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_reading_history_source ON reading_history (source_key)')
+        # Changed rows have their attributes and warnings replaced by reading_history_id
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_attributes_history ON book_attributes (reading_history_id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_content_warnings_history ON content_warnings (reading_history_id)')
+        
         self.conn.commit()
         print("Reading history tables created successfully")
     
-    def match_book_by_title_author(self, title, authors):
-        """Try to match StoryGraph book to existing book in library"""
-        # Clean up title and authors
-        title_clean = title.strip().lower()
-        authors_clean = authors.strip().lower() if authors else ''
-        
-        # Try exact match first
-        self.cursor.execute('''
-            SELECT b.id 
-            FROM books b
-            JOIN book_authors ba ON b.id = ba.book_id
-            JOIN authors a ON ba.author_id = a.id
-            WHERE LOWER(b.title) = ? AND LOWER(a.author_name) = ?
-            LIMIT 1
-        ''', (title_clean, authors_clean))
+    def table_exists(self, name):
+        self.cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+        return self.cursor.fetchone()[0] > 0
+    
+    def publish_changes(self):
+        """Refresh the summary tables and bump the generation so readers pick up the new data"""
+        self.refresh_summaries()
+        self.cursor.execute("UPDATE reading_meta SET value = value + 1 WHERE key = 'generation'")
+    
+    def refresh_summaries(self):
+        """Recompute reading_summary and reading_top_rated from the reading history"""
+        self.cursor.execute('DELETE FROM reading_summary')
+        self.cursor.execute(f'''
+            INSERT INTO reading_summary (
+                id, total, books_read, currently_reading, to_read, did_not_finish,
+                books_rated, avg_rating, sessions, first_year, last_year
+            )
+            SELECT 1, COUNT(*),
+                   COUNT(CASE WHEN read_status = 'read' THEN 1 END),
+                   COUNT(CASE WHEN read_status = 'currently-reading' THEN 1 END),
+                   COUNT(CASE WHEN read_status = 'to-read' THEN 1 END),
+                   COUNT(CASE WHEN read_status = 'did-not-finish' THEN 1 END),
+                   COUNT(star_rating), AVG(star_rating),
+                   (SELECT COUNT(DISTINCT {READ_KEY_SQL}) FROM reading_sessions rs JOIN reading_history rh ON rh.id = rs.reading_history_id),
+                   (SELECT MIN(year) FROM reading_yearly),
+                   (SELECT MAX(year) FROM reading_yearly)
+            FROM ({READING_ENTRIES_SQL})
+        ''')
+        self.cursor.execute('DELETE FROM reading_top_rated')
+        self.cursor.execute(f'''
+            INSERT INTO reading_top_rated (rank, reading_history_id, book_id, title, authors, star_rating, last_date_read)
+            SELECT ROW_NUMBER() OVER (ORDER BY star_rating DESC, last_date_read DESC, id),
+                   id, book_id, title, authors, star_rating, last_date_read
+            FROM ({READING_ENTRIES_SQL})
+            WHERE star_rating IS NOT NULL
+            ORDER BY star_rating DESC, last_date_read DESC, id
+            LIMIT ?
+        ''', (TOP_RATED_SIZE,))
+    
+    def migrate_legacy_rows(self):
+        """Key rows imported before re-imports were idempotent, dropping the duplicates repeated imports left"""
+        self.cursor.execute('SELECT id, isbn, title, authors, date_added FROM reading_history WHERE source_key IS NULL ORDER BY id DESC')
+        legacy = self.cursor.fetchall()
+        if not legacy:
+            return False
+        self.cursor.execute('SELECT source_key FROM reading_history WHERE source_key IS NOT NULL')
+        taken = {row[0] for row in self.cursor.fetchall()}
         
-        result = self.cursor.fetchone()
-        if result:
-            return result[0]
+        # The newest copy of a row came from the latest import, so it is the one kept
+        keep, duplicates = {}, []
+        for row_id, isbn, title, authors, date_added in legacy:
+            key = storygraph_source_key(isbn, title, authors, date_added)
+            if key in taken or key in keep:
+                duplicates.append((row_id,))
+            else:
+                keep[key] = row_id
         
-        # Try title-only match
+        periods = self.session_periods(duplicates)
+        self.cursor.executemany('DELETE FROM reading_sessions WHERE reading_history_id = ?', duplicates)
+        self.cursor.executemany('DELETE FROM reading_history_tags WHERE reading_history_id = ?', duplicates)
+        self.cursor.executemany('DELETE FROM content_warnings WHERE reading_history_id = ?', duplicates)
+        self.cursor.executemany('DELETE FROM book_attributes WHERE reading_history_id = ?', duplicates)
+        self.cursor.executemany('DELETE FROM reading_history WHERE id = ?', duplicates)
+        self.refresh_rollups(periods)
+        # content_hash stays NULL, so the next import refreshes these rows in place
+        self.cursor.executemany('UPDATE reading_history SET source_key = ? WHERE id = ?', keep.items())
+        print(f"Keyed {len(keep)} existing reading history row(s), removed {len(duplicates)} duplicate(s)")
+        return True
+    
+    def rebuild_reading_sessions(self):
+        """Parse every row's Dates Read into reading_sessions and rebuild the rollups from scratch"""
+        self.cursor.execute('DELETE FROM reading_sessions')
+        self.cursor.execute('SELECT id, dates_read FROM reading_history')
+        rows = [session for row_id, dates_read in self.cursor.fetchall() for session in session_rows(row_id, dates_read)]
+        self.cursor.executemany('''
+            INSERT INTO reading_sessions (reading_history_id, start_date, end_date, year, month) VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        self.refresh_rollups()
+    
+    def rebuild_reading_tags(self):
+        """Tag every reading history row from its stored moods, pace and content warnings"""
+        self.cursor.execute('DELETE FROM reading_history_tags')
         self.cursor.execute('''
-            SELECT id FROM books 
-            WHERE LOWER(title) = ?
-            LIMIT 1
-        ''', (title_clean,))
+            SELECT rh.id, ba.moods, ba.pace, cw.warning_text
+            FROM reading_history rh
+            LEFT JOIN book_attributes ba ON ba.reading_history_id = rh.id
+            LEFT JOIN content_warnings cw ON cw.reading_history_id = rh.id
+        ''')
+        self.insert_tags([(row_id, parse_tags(moods, pace, warnings)) for row_id, moods, pace, warnings in self.cursor.fetchall()])
+    
+    def insert_tags(self, tagged_rows):
+        """Link [(reading_history_id, [(kind, name)])] rows to their tags, adding new tags to the dictionary"""
+        if self.tag_ids is None:
+            self.cursor.execute('SELECT kind, name, id FROM reading_tags')
+            self.tag_ids = {(kind, name): tag_id for kind, name, tag_id in self.cursor.fetchall()}
+        links = []
+        for row_id, tags in tagged_rows:
+            for tag in tags:
+                if tag not in self.tag_ids:
+                    self.cursor.execute('INSERT INTO reading_tags (kind, name) VALUES (?, ?)', tag)
+                    self.tag_ids[tag] = self.cursor.lastrowid
+                links.append((row_id, self.tag_ids[tag]))
+        self.cursor.executemany('INSERT OR IGNORE INTO reading_history_tags (reading_history_id, tag_id) VALUES (?, ?)', links)
+    
+    def session_periods(self, id_rows):
+        """(year, month) of every finished session of the given [(reading_history_id,)] rows"""
+        periods = set()
+        for row in id_rows:
+            self.cursor.execute('SELECT year, month FROM reading_sessions WHERE reading_history_id = ? AND year IS NOT NULL', row)
+            periods.update(self.cursor.fetchall())
+        return periods
+    
+    def refresh_rollups(self, periods=None):
+        """Recompute the monthly and yearly rollups for the given (year, month) periods, or all of them"""
+        if periods is None:
+            self.cursor.execute('DELETE FROM reading_monthly')
+            self.cursor.execute('DELETE FROM reading_yearly')
+            self.cursor.execute('SELECT DISTINCT year, month FROM reading_sessions WHERE year IS NOT NULL')
+            periods = self.cursor.fetchall()
+        months = sorted({period for period in periods if period[1] is not None})
+        years = sorted({(year,) for year, _ in periods})
         
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        # Each touched period is rebuilt from its sessions with one (year, month) index range,
+        # one row per read so a read imported from two sources counts once
+        self.cursor.executemany('DELETE FROM reading_monthly WHERE year = ? AND month = ?', months)
+        self.cursor.executemany(f'''
+            INSERT INTO reading_monthly (year, month, books_finished, books_rated, avg_rating)
+            SELECT year, month, COUNT(*), COUNT(star_rating), AVG(star_rating)
+            FROM (
+                SELECT rs.year, rs.month, MAX(rh.star_rating) AS star_rating
+                FROM reading_sessions rs
+                JOIN reading_history rh ON rh.id = rs.reading_history_id
+                WHERE rs.year = ? AND rs.month = ?
+                GROUP BY {READ_KEY_SQL}
+            )
+            GROUP BY year, month
+        ''', months)
+        self.cursor.executemany('DELETE FROM reading_yearly WHERE year = ?', years)
+        self.cursor.executemany(f'''
+            INSERT INTO reading_yearly (year, books_finished, books_rated, avg_rating)
+            SELECT year, COUNT(*), COUNT(star_rating), AVG(star_rating)
+            FROM (
+                SELECT rs.year, MAX(rh.star_rating) AS star_rating
+                FROM reading_sessions rs
+                JOIN reading_history rh ON rh.id = rs.reading_history_id
+                WHERE rs.year = ?
+                GROUP BY {READ_KEY_SQL}
+            )
+            GROUP BY year
+        ''', years)
     
-    def import_storygraph_csv(self, csv_path):
-        """Import StoryGraph CSV data"""
-        csv_path = Path(csv_path)
+    def existing_sources(self):
+        """{source_key: (reading_history_id, content_hash, book_id)} of every imported row"""
+        self.cursor.execute('SELECT source_key, id, content_hash, book_id FROM reading_history WHERE source_key IS NOT NULL')
+        return {key: (row_id, content_hash, book_id) for key, row_id, content_hash, book_id in self.cursor.fetchall()}
+    
+    def next_reading_history_id(self):
+        """First id after every reading_history id ever handed out"""
+        self.cursor.execute('''
+            SELECT MAX(COALESCE((SELECT MAX(id) FROM reading_history), 0),
+                       COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'reading_history'), 0))
+        ''')
+        return self.cursor.fetchone()[0] + 1
+    
+    def write_batch(self, new_records, changed_records):
+        """Write one batch of parsed CSV rows: inserts for new rows, in-place updates for changed ones.
+        
+        Returns the (year, month) periods whose rollups the batch made stale.
+        """
+        # A record is (reading_history_id, history values, attribute values, warning values or None)
+        self.cursor.executemany(f'''
+            INSERT INTO reading_history (id, {', '.join(HISTORY_COLUMNS)})
+            VALUES ({', '.join('?' * (len(HISTORY_COLUMNS) + 1))})
+        ''', [(record[0],) + record[1] for record in new_records])
+        self.cursor.executemany(f'''
+            UPDATE reading_history SET {', '.join(f'{column} = ?' for column in HISTORY_COLUMNS)}
+            WHERE id = ?
+        ''', [record[1] + (record[0],) for record in changed_records])
+        changed_ids = [(record[0],) for record in changed_records]
+        periods = self.session_periods(changed_ids)
+        self.cursor.executemany('DELETE FROM book_attributes WHERE reading_history_id = ?', changed_ids)
+        self.cursor.executemany('DELETE FROM content_warnings WHERE reading_history_id = ?', changed_ids)
+        self.cursor.executemany('DELETE FROM reading_sessions WHERE reading_history_id = ?', changed_ids)
+        self.cursor.executemany('DELETE FROM reading_history_tags WHERE reading_history_id = ?', changed_ids)
         
-        if not csv_path.exists():
-            print(f"Error: CSV file not found: {csv_path}")
-            return
+        records = new_records + changed_records
+        self.cursor.executemany('''
+            INSERT INTO book_attributes (
+                reading_history_id, moods, pace, character_or_plot,
+                strong_character_dev, loveable_characters, 
+                diverse_characters, flawed_characters
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(record[0],) + record[2] for record in records])
+        self.cursor.executemany('''
+            INSERT INTO content_warnings (
+                reading_history_id, warning_text, warning_description
+            ) VALUES (?, ?, ?)
+        ''', [(record[0],) + record[3] for record in records if record[3]])
         
-        imported = 0
-        matched = 0
-        print(csv_path, csv_path.exists())
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            
-            for row in reader:
-                title = row.get('Title', '')
-                authors = row.get('Authors', '')
-                
-                # Try to match with existing book
-                book_id = self.match_book_by_title_author(title, authors)
-                if book_id:
-                    matched += 1
-                
-                # Insert reading history
-                self.cursor.execute('''
-                    INSERT INTO reading_history (
-                        book_id, title, authors, isbn, format, read_status,
-                        date_added, last_date_read, dates_read, read_count,
-                        star_rating, review, owned
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    book_id,
-                    title,
-                    authors,
-                    row.get('ISBN/UID', ''),
-                    row.get('Format', ''),
-                    row.get('Read Status', ''),
-                    row.get('Date Added', ''),
-                    row.get('Last Date Read', ''),
-                    row.get('Dates Read', ''),
-                    int(row.get('Read Count', 0)) if row.get('Read Count') else 0,
-                    float(row.get('Star Rating', 0)) if row.get('Star Rating') else None,
-                    row.get('Review', ''),
-                    row.get('Owned?', '')
-                ))
-                
-                reading_history_id = self.cursor.lastrowid
-                
-                # Insert book attributes
-                self.cursor.execute('''
-                    INSERT INTO book_attributes (
-                        reading_history_id, moods, pace, character_or_plot,
-                        strong_character_dev, loveable_characters, 
-                        diverse_characters, flawed_characters
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    reading_history_id,
-                    row.get('Moods', ''),
-                    row.get('Pace', ''),
-                    row.get('Character- or Plot-Driven?', ''),
-                    row.get('Strong Character Development?', ''),
-                    row.get('Loveable Characters?', ''),
-                    row.get('Diverse Characters?', ''),
-                    row.get('Flawed Characters?', '')
-                ))
-                
-                # Insert content warnings if present
-                warnings = row.get('Content Warnings', '')
-                if warnings:
-                    self.cursor.execute('''
-                        INSERT INTO content_warnings (
-                            reading_history_id, warning_text, warning_description
-                        ) VALUES (?, ?, ?)
-                    ''', (
-                        reading_history_id,
-                        warnings,
-                        row.get('Content Warning Description', '')
-                    ))
-                
-                imported += 1
-                
-                if imported % 50 == 0:
-                    print(f"Imported {imported} books...")
+        dates_read = HISTORY_COLUMNS.index('dates_read')
+        sessions = [session for record in records for session in session_rows(record[0], record[1][dates_read])]
+        self.cursor.executemany('''
+            INSERT INTO reading_sessions (reading_history_id, start_date, end_date, year, month) VALUES (?, ?, ?, ?, ?)
+        ''', sessions)
+        periods.update((year, month) for _, _, _, year, month in sessions if year is not None)
         
+        # Attribute values start with moods and pace
+        self.insert_tags([(record[0], parse_tags(record[2][0], record[2][1], record[3] and record[3][0])) for record in records])
+        return periods
+    
+    def relink_rows(self, relinks):
+        """Point unmatched rows at the books found for them since; relinks are (book_id, confidence, id)"""
+        self.cursor.executemany('UPDATE reading_history SET book_id = ?, match_confidence = ? WHERE id = ?', relinks)
+        return len(relinks)
+    
+    def finish_import(self, stale_periods, wrote):
+        """Refresh the rollups an import made stale, publish if it wrote anything, and commit"""
+        self.refresh_rollups(stale_periods)
+        if wrote:
+            self.publish_changes()
         self.conn.commit()
-        print(f"\n{'='*60}")
-        print(f"Import complete!")
-        print(f"Total books imported: {imported}")
-        print(f"Matched to library: {matched}")
-        print(f"New books: {imported - matched}")
-        print(f"{'='*60}")
+    
+    def import_export(self, csv_path, adapter):
+        """Import an export through a bulk_import adapter, writing only rows that are new or changed since the last import"""
+        return BulkImporter(self, adapter).run(csv_path)
+    
+    def import_storygraph_csv(self, csv_path):
+        """Import StoryGraph CSV data, writing only rows that are new or changed since the last import"""
+        return self.import_export(csv_path, StoryGraphAdapter())
     
     def get_reading_stats(self):
         """Get reading statistics"""
         stats = {}
         
-        # Total books read
-        self.cursor.execute("SELECT COUNT(*) FROM reading_history WHERE read_status = 'read'")
-        stats['books_read'] = self.cursor.fetchone()[0]
-        
-        # Currently reading
-        self.cursor.execute("SELECT COUNT(*) FROM reading_history WHERE read_status = 'currently-reading'")
-        stats['currently_reading'] = self.cursor.fetchone()[0]
-        
-        # To read
-        self.cursor.execute("SELECT COUNT(*) FROM reading_history WHERE read_status = 'to-read'")
-        stats['to_read'] = self.cursor.fetchone()[0]
-        
-        # Average rating
-        self.cursor.execute("SELECT AVG(star_rating) FROM reading_history WHERE star_rating IS NOT NULL")
-        avg_rating = self.cursor.fetchone()[0]
+        # Counts and average rating, precomputed by refresh_summaries
+        self.cursor.execute('SELECT books_read, currently_reading, to_read, avg_rating FROM reading_summary')
+        books_read, currently_reading, to_read, avg_rating = self.cursor.fetchone() or (0, 0, 0, None)
+        stats['books_read'] = books_read
+        stats['currently_reading'] = currently_reading
+        stats['to_read'] = to_read
         stats['avg_rating'] = round(avg_rating, 2) if avg_rating else 0
         
         # Top rated books
-        self.cursor.execute('''
-            SELECT title, authors, star_rating 
-            FROM reading_history 
-            WHERE star_rating IS NOT NULL 
-            ORDER BY star_rating DESC 
-            LIMIT 5
-        ''')
+        self.cursor.execute('SELECT title, authors, star_rating FROM reading_top_rated ORDER BY rank LIMIT 5')
         stats['top_rated'] = self.cursor.fetchall()
         
+        # Books finished per year, straight from the rollup
+        self.cursor.execute('SELECT year, books_finished, avg_rating FROM reading_yearly ORDER BY year')
+        stats['by_year'] = self.cursor.fetchall()
+        
         return stats
     
     def close(self):
@@ -265,6 +575,11 @@ def main():
         for title, authors, rating in stats['top_rated']:
             print(f"  ⭐ {rating} - {title} by {authors}")
     
+    if stats['by_year']:
+        print(f"\nBooks Finished by Year:")
+        for year, books_finished, avg_rating in stats['by_year']:
+            print(f"  {year}: {books_finished}" + (f" (avg ⭐ {avg_rating:.2f})" if avg_rating else ""))
+    
     importer.close()
     print("\nDone!")
 
@@ -0,0 +1,173 @@
+"""Packed thumbnail store: all thumbnails in one append-only file plus an offset index.
+
+Serving tens of thousands of small files costs an open, stat and close per
+request, and small files fragment badly on NAS volumes. The pack keeps every
+thumbnail in data/thumbnail_pack/thumbnails.pack. thumbnails.idx has one
+"<name>\t<offset>\t<length>" line per entry, and a later line for the same name
+wins. The web server maps the pack into memory once (LIBRARY_THUMBNAIL_PACK=1)
+and answers from slices of it. Thumbnails not packed yet are served from the
+loose files in data/thumbnails as before.
+
+    python thumbnail_pack.py pack [--remove-loose]   append new thumbnails
+    python thumbnail_pack.py compact                 drop thumbnails no cover uses
+
+Packing only appends: data is written and synced before its index lines, so an
+interrupted run never indexes bytes that are not there. Compaction rewrites both
+files and must run while the server is stopped.
+"""
+import argparse
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent / 'data'
+THUMBNAIL_DIR = DATA_DIR / 'thumbnails'
+PACK_DIR = DATA_DIR / 'thumbnail_pack'
+PACK_NAME = 'thumbnails.pack'
+INDEX_NAME = 'thumbnails.idx'
+
+
+def read_index(pack_dir=PACK_DIR):
+    """Return {name: (offset, length)} for every packed thumbnail"""
+    index = {}
+    try:
+        with open(Path(pack_dir) / INDEX_NAME, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == 3:
+                    index[parts[0]] = (int(parts[1]), int(parts[2]))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+class PackReader:
+    """Memory-mapped, read-only view of the pack that picks up newly appended entries"""
+
+    def __init__(self, pack_dir=PACK_DIR, reload_interval=2.0):
+        self.pack_dir = Path(pack_dir)
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.signature = None
+        self.checked_at = 0.0
+        self.mm = None
+        self.index = {}
+
+    def _signature(self):
+        try:
+            pack = os.stat(self.pack_dir / PACK_NAME)
+            index = os.stat(self.pack_dir / INDEX_NAME)
+        except OSError:
+            return None
+        return (pack.st_ino, pack.st_size, index.st_ino, index.st_size, index.st_mtime_ns)
+
+    def _reload(self, signature):
+        if self.mm is not None:
+            self.mm.close()
+        self.mm, self.index = None, {}
+        if signature and signature[1] > 0:
+            with open(self.pack_dir / PACK_NAME, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Ignore entries past the end of the mapping
+            self.index = {name: loc for name, loc in read_index(self.pack_dir).items() if loc[0] + loc[1] <= len(self.mm)}
+        self.signature = signature
+
+    def get(self, name):
+        """Bytes of a packed thumbnail, or None if it is not in the pack"""
+        with self.lock:
+            now = time.monotonic()
+            # Checking for a grown pack costs two stats, so do it at most every reload_interval
+            if now - self.checked_at >= self.reload_interval:
+                self.checked_at = now
+                signature = self._signature()
+                if signature != self.signature:
+                    self._reload(signature)
+            location = self.index.get(name)
+            if location is None or self.mm is None:
+                return None
+            offset, length = location
+            return self.mm[offset:offset + length]
+
+
+def pack_thumbnails(thumbnail_dir=THUMBNAIL_DIR, pack_dir=PACK_DIR, remove_loose=False):
+    """Append loose thumbnails that are not in the pack yet; returns how many were added"""
+    pack_dir = Path(pack_dir)
+    pack_dir.mkdir(parents=True, exist_ok=True)
+    index = read_index(pack_dir)
+    loose = sorted(path for path in Path(thumbnail_dir).rglob('*') if path.is_file() and not path.name.endswith('.tmp'))
+    new = [path for path in loose if path.name not in index]
+
+    if new:
+        lines = []
+        with open(pack_dir / PACK_NAME, 'ab') as pack_file:
+            offset = pack_file.seek(0, os.SEEK_END)
+            for path in new:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                pack_file.write(data)
+                lines.append(f'{path.name}\t{offset}\t{len(data)}\n')
+                offset += len(data)
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+        with open(pack_dir / INDEX_NAME, 'a', encoding='utf-8') as index_file:
+            index_file.write(''.join(lines))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+    # Every loose file is in the pack by now
+    if remove_loose:
+        for path in loose:
+            path.unlink()
+    return len(new)
+
+
+def compact(live_hashes, pack_dir=PACK_DIR):
+    """Rewrite the pack with only thumbnails of the given content hashes; returns (kept, bytes freed)"""
+    pack_dir = Path(pack_dir)
+    pack_path = pack_dir / PACK_NAME
+    index_path = pack_dir / INDEX_NAME
+    if not pack_path.exists():
+        return 0, 0
+    index = read_index(pack_dir)
+    keep = sorted((loc[0], name, loc[1]) for name, loc in index.items() if name.split('-')[0] in live_hashes)
+    old_size = pack_path.stat().st_size
+
+    new_pack = pack_dir / (PACK_NAME + '.tmp')
+    new_index = pack_dir / (INDEX_NAME + '.tmp')
+    with open(pack_path, 'rb') as source, open(new_pack, 'wb') as pack_file, open(new_index, 'w', encoding='utf-8') as index_file:
+        offset = 0
+        for old_offset, name, length in keep:
+            source.seek(old_offset)
+            pack_file.write(source.read(length))
+            index_file.write(f'{name}\t{offset}\t{length}\n')
+            offset += length
+        for f in (pack_file, index_file):
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(new_pack, pack_path)
+    os.replace(new_index, index_path)
+    return len(keep), old_size - offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack cover thumbnails into one file, or compact the pack.')
+    parser.add_argument('command', choices=['pack', 'compact'])
+    parser.add_argument('--remove-loose', action='store_true', help='Delete loose thumbnail files once they are packed')
+    parser.add_argument('--db', default=str(DATA_DIR / 'tt_db_ebook_lib.db'), help='Catalog database (for compact)')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        print(f"Packed {pack_thumbnails(remove_loose=args.remove_loose)} thumbnail(s) into {PACK_DIR / PACK_NAME}")
+    else:
+        conn = sqlite3.connect(args.db)
+        live_hashes = {row[0] for row in conn.execute('SELECT DISTINCT content_hash FROM cover_sources')}
+        conn.close()
+        kept, freed = compact(live_hashes)
+        print(f"Kept {kept} thumbnail(s), freed {freed / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Cover thumbnails at a fixed set of widths, in WebP and JPEG, plus placeholder colours.
+
+Thumbnails live in a content-addressed cache, data/thumbnails/<hh>/<sha1>-<width>.<ext>,
+where sha1 is the hash of the source cover's bytes. Books sharing a cover image
+share its thumbnails, and a cover that changes gets a new hash and so new files;
+nothing in the cache is ever overwritten or invalidated.
+
+The cover_sources table remembers each cover path's size, mtime and hash, so
+serving a thumbnail costs a stat of the source rather than reading it. Only
+refresh_thumbnails() writes it; requests never do, so serving a cover never
+adds to the catalog change log. refresh_thumbnails() fills the cache for the
+whole catalog in a process pool (hash the changed sources, then render each
+distinct image once) and deletes files no image uses any more. It runs at the
+end of a library scan and can be run on its own:
+
+    python thumbnails.py
+
+While an image is open for rendering, its dominant colour, a BlurHash string
+and a colour sort key are stored in cover_colors. The list payloads carry them
+so the grid can paint a placeholder before the cover arrives. Anything still
+missing at request time is rendered on demand. Thumbnails can also be packed
+into a single file; see thumbnail_pack.py.
+
+Pillow is optional: without it get_thumbnail() returns None and callers serve
+the original cover.
+"""
+import colorsys
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import thumbnail_pack
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+THUMBNAIL_DIR = Path(__file__).parent / 'data' / 'thumbnails'
+
+WIDTHS = (120, 240, 360, 500, 800)
+# Cover wall modes, drawn at 2x their smallest column width for high-DPI screens
+SIZES = {'small': 240, 'medium': 360, 'large': 500}
+
+# format -> (file extension, mimetype, Pillow format, save options)
+FORMATS = {
+    'webp': ('webp', 'image/webp', 'WEBP', {'quality': 78, 'method': 4}),
+    'jpeg': ('jpg', 'image/jpeg', 'JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+
+def supported_formats():
+    if Image is None:
+        return []
+    return [fmt for fmt in FORMATS if fmt != 'webp' or features.check('webp')]
+
+
+def snap_width(width):
+    """Smallest precomputed width that is at least `width` (or the largest there is)"""
+    for candidate in WIDTHS:
+        if candidate >= width:
+            return candidate
+    return WIDTHS[-1]
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(content_hash, width, fmt):
+    return THUMBNAIL_DIR / content_hash[:2] / f'{content_hash}-{width}.{FORMATS[fmt][0]}'
+
+
+BLURHASH_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+# Covers are portrait, so use more vertical than horizontal components
+BLURHASH_COMPONENTS = (3, 4)
+
+
+def _base83(value, length):
+    return ''.join(BLURHASH_CHARACTERS[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value):
+    value = value / 255
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, components=BLURHASH_COMPONENTS):
+    """BlurHash (https://blurha.sh) of an RGB image, computed on a 32x48 copy"""
+    x_components, y_components = components
+    small = image.resize((32, 48), Image.BILINEAR)
+    width, height = small.size
+    pixels = [tuple(_srgb_to_linear(channel) for channel in pixel) for pixel in small.getdata()]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            x_basis = [math.cos(math.pi * i * x / width) for x in range(width)]
+            y_basis = [math.cos(math.pi * j * y / height) for y in range(height)]
+            r = g = b = 0.0
+            for y in range(height):
+                for x in range(width):
+                    basis = x_basis[x] * y_basis[y]
+                    pixel = pixels[y * width + x]
+                    r += basis * pixel[0]
+                    g += basis * pixel[1]
+                    b += basis * pixel[2]
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for factor in ac for c in factor) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _base83(0, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, int(math.floor(math.copysign(abs(c / max_value) ** 0.5, c) * 9 + 9.5)))) for c in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def dominant_color(image):
+    """Most common colour after reducing the cover to a five-colour palette, as (r, g, b)"""
+    quantized = image.resize((64, 96), Image.BILINEAR).quantize(colors=5, method=Image.Quantize.FASTOCTREE)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    return tuple(palette[index * 3:index * 3 + 3])
+
+
+def color_sort_key(rgb):
+    """Integer that orders colours by hue in 10 degree bands, then lightness; greys sort last"""
+    hue, lightness, saturation = colorsys.rgb_to_hls(*(channel / 255 for channel in rgb))
+    band = 36 if saturation < 0.15 or lightness < 0.08 or lightness > 0.95 else int(hue * 36) % 36
+    return band * 1000 + int(lightness * 999)
+
+
+def analyze_cover(image):
+    """(dominant colour as #rrggbb, BlurHash, colour sort key) for an RGB image"""
+    rgb = dominant_color(image)
+    return '#%02x%02x%02x' % rgb, blurhash(image), color_sort_key(rgb)
+
+
+def render_thumbnails(job):
+    """Render one source image's missing thumbnails and optionally analyze its colours.
+
+    job is (source_path, content_hash, [(width, format)], analyze); returns
+    (number rendered, analyze_cover() result or None).
+    """
+    source_path, content_hash, outputs, analyze = job
+    try:
+        with Image.open(source_path) as cover:
+            image = ImageOps.exif_transpose(cover).convert('RGB')
+    except OSError:
+        return 0, None
+    analysis = analyze_cover(image) if analyze else None
+    rendered = 0
+    for width, fmt in outputs:
+        thumbnail = image
+        if image.width > width:
+            thumbnail = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS, reducing_gap=3.0)
+        path = cache_path(content_hash, width, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _, _, pil_format, options = FORMATS[fmt]
+        # Write then rename so a concurrent request never serves a half-written file
+        temp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        thumbnail.save(temp_path, pil_format, **options)
+        os.replace(temp_path, path)
+        rendered += 1
+    return rendered, analysis
+
+
+# cover path -> (size, mtime, hash) for covers hashed at request time, until a refresh stores them;
+# one entry per cover at most, dropped once cover_sources agrees
+_unrecorded_hashes = {}
+_unrecorded_lock = threading.Lock()
+
+
+def source_hash(conn, cover_path):
+    """Content hash of a cover, re-hashing only when its size or mtime changed; None if it is missing.
+
+    A cover that changed since the last refresh is hashed here and remembered in
+    memory until refresh_thumbnails() records it.
+    """
+    try:
+        stat = os.stat(cover_path)
+    except (OSError, TypeError):
+        return None
+    cursor = conn.cursor()
+    cursor.execute('SELECT file_size, mtime_ns, content_hash FROM cover_sources WHERE cover_path = ?', (cover_path,))
+    row = cursor.fetchone()
+    with _unrecorded_lock:
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            _unrecorded_hashes.pop(cover_path, None)
+            return row[2]
+        size, mtime_ns, content_hash = _unrecorded_hashes.get(cover_path, (None, None, None))
+    if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        content_hash = hash_file(cover_path)
+        with _unrecorded_lock:
+            _unrecorded_hashes[cover_path] = (stat.st_size, stat.st_mtime_ns, content_hash)
+    return content_hash
+
+
+def get_thumbnail(conn, cover_path, width, fmt='jpeg'):
+    """Return the cached thumbnail for a cover at the snapped width, rendering it if needed"""
+    if fmt not in supported_formats():
+        return None
+    content_hash = source_hash(conn, cover_path)
+    if content_hash is None:
+        return None
+    width = snap_width(width)
+    path = cache_path(content_hash, width, fmt)
+    if not path.exists():
+        render_thumbnails((cover_path, content_hash, [(width, fmt)], False))
+    return path if path.exists() else None
+
+
+def refresh_thumbnails(conn, workers=None):
+    """Render every missing thumbnail for the catalog's covers and drop unused ones; returns files rendered"""
+    if Image is None:
+        print("Pillow is not installed; skipping cover thumbnails")
+        return 0
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT cover_path FROM books WHERE cover_path IS NOT NULL')
+    cover_paths = [row[0] for row in cursor.fetchall()]
+    cursor.execute('SELECT cover_path, file_size, mtime_ns, content_hash FROM cover_sources')
+    known = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    hashes = {}
+    changed = []
+    for cover_path in cover_paths:
+        try:
+            stat = os.stat(cover_path)
+        except OSError:
+            continue
+        record = known.get(cover_path)
+        if record and record[0] == stat.st_size and record[1] == stat.st_mtime_ns:
+            hashes[cover_path] = record[2]
+        else:
+            changed.append((cover_path, stat.st_size, stat.st_mtime_ns))
+
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = []
+        for (cover_path, size, mtime_ns), content_hash in zip(changed, pool.map(hash_file, [c[0] for c in changed], chunksize=16)):
+            hashes[cover_path] = content_hash
+            rows.append((cover_path, size, mtime_ns, content_hash))
+        # An upsert, so a touched but unchanged cover does not look like a new one to the change log
+        cursor.executemany('''
+            INSERT INTO cover_sources (cover_path, file_size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)
+            ON CONFLICT (cover_path) DO UPDATE SET
+                file_size = excluded.file_size, mtime_ns = excluded.mtime_ns, content_hash = excluded.content_hash
+        ''', rows)
+        cursor.execute('DELETE FROM cover_sources WHERE cover_path NOT IN (SELECT cover_path FROM books WHERE cover_path IS NOT NULL)')
+        conn.commit()
+
+        # Each distinct image is rendered once, however many books or paths share it
+        sources = {}
+        for cover_path, content_hash in hashes.items():
+            sources.setdefault(content_hash, cover_path)
+        formats = supported_formats()
+        packed = thumbnail_pack.read_index()
+        cursor.execute('SELECT content_hash FROM cover_colors')
+        analyzed = {row[0] for row in cursor.fetchall()}
+        jobs = []
+        for content_hash, cover_path in sources.items():
+            missing = [(width, fmt) for width in WIDTHS for fmt in formats
+                       if cache_path(content_hash, width, fmt).name not in packed and not cache_path(content_hash, width, fmt).exists()]
+            if missing or content_hash not in analyzed:
+                jobs.append((cover_path, content_hash, missing, content_hash not in analyzed))
+        colors = []
+        for (_, content_hash, _, _), (count, analysis) in zip(jobs, pool.map(render_thumbnails, jobs, chunksize=4)):
+            rendered += count
+            if analysis:
+                colors.append((content_hash,) + analysis)
+        cursor.executemany('INSERT OR REPLACE INTO cover_colors (content_hash, dominant_color, placeholder, color_sort) VALUES (?, ?, ?, ?)', colors)
+        cursor.execute('DELETE FROM cover_colors WHERE content_hash NOT IN (SELECT content_hash FROM cover_sources)')
+        conn.commit()
+
+    if THUMBNAIL_DIR.exists():
+        for path in THUMBNAIL_DIR.rglob('*'):
+            if path.is_file() and path.name.split('-')[0] not in sources:
+                path.unlink()
+    return rendered
+
+
+if __name__ == '__main__':
+    db_path = Path(__file__).parent / 'data' / 'tt_db_ebook_lib.db'
+    from catalog_schema import ensure_serving_schema
+    conn = sqlite3.connect(str(db_path))
+    ensure_serving_schema(conn)
+    print(f"Rendered {refresh_thumbnails(conn)} thumbnail(s) into {THUMBNAIL_DIR}")
+    conn.close()
@@ -0,0 +1,194 @@
+"""Fuzzy matching of reading-history rows to library books by title and author.
+
+Reading trackers spell titles differently from the ebook metadata: subtitles,
+"(Series, #3)" suffixes, punctuation, accents and leading articles. Both sides
+are normalized to word tokens. Library titles are indexed by token, and a row is
+only scored against books that share a reasonably rare token with it (blocking).
+That keeps matching fast on large libraries.
+
+Confidence is in [0, 1]. It is the title similarity (Dice coefficient of the
+token sets), scaled down unless the authors agree. An exact title scores
+UNKNOWN_AUTHOR_SCALE when either side has no author, enough to match like the
+old title-only fallback, and CONFLICTING_AUTHOR_SCALE when the authors share no
+name, which is not. Matches below MIN_CONFIDENCE are rejected.
+
+Two rules keep similar titles of different books apart:
+
+- numbers (digits, roman numerals, one to twelve) must agree, so "Volume II"
+  never matches "Volume I";
+- a subtitle is ignored only when the rest of the title is exactly the other
+  side's whole title and the authors agree, so "Dune: A Novel" by Frank Herbert
+  matches "Dune", but "Dune: The Butlerian Jihad" does not.
+"""
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+MIN_CONFIDENCE = 0.75
+UNKNOWN_AUTHOR_SCALE = 0.8
+CONFLICTING_AUTHOR_SCALE = 0.6
+# Tokens in more library titles than this are too common to block on alone
+MAX_BLOCK_SIZE = 200
+# Books scored per row, most shared tokens first
+MAX_CANDIDATES = 40
+
+ARTICLES = {'the', 'a', 'an'}
+# Ignored for blocking; they still count when scoring
+STOPWORDS = ARTICLES | {'of', 'and', 'in', 'to', 'on', 'for', 'with', 'at', 'by', 'from', 'or', 'is'}
+
+NUMBER_WORDS = {word: n for n, word in enumerate(
+    ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve'], 1)}
+ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10}
+
+PARENTHETICAL = re.compile(r'[(\[][^)\]]*[)\]]')
+# I to XXXIX; larger numerals are rare in titles and collide with words like "mix"
+ROMAN_NUMERAL = re.compile(r'^x{0,3}(?:ix|iv|v?i{0,3})$')
+APOSTROPHES = re.compile(r"['’]")
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def tokenize(text):
+    """Accent-free, casefolded word tokens of text"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = APOSTROPHES.sub('', text.replace('&', ' and '))
+    return NON_WORD.sub(' ', text).split()
+
+
+def roman_value(numeral):
+    total = 0
+    for i, c in enumerate(numeral):
+        value = ROMAN_VALUES[c]
+        # A smaller numeral before a larger one is subtracted: IV, IX
+        total += -value if i + 1 < len(numeral) and ROMAN_VALUES[numeral[i + 1]] > value else value
+    return total
+
+
+def number_token(token):
+    """Digits of a number token ("ii", "two" and "2" all give "2"), or the token unchanged"""
+    if token.isdigit():
+        return str(int(token))
+    if token in NUMBER_WORDS:
+        return str(NUMBER_WORDS[token])
+    if ROMAN_NUMERAL.match(token):
+        return str(roman_value(token))
+    return token
+
+
+def title_tokens(text):
+    tokens = [number_token(token) for token in tokenize(text)]
+    # "The Hobbit" and "Hobbit" are the same book
+    if len(tokens) > 1 and tokens[0] in ARTICLES:
+        tokens = tokens[1:]
+    return frozenset(tokens)
+
+
+def title_variants(title):
+    """(whole title tokens, tokens before the subtitle or None), or None for a title with no words"""
+    title = PARENTHETICAL.sub(' ', title or '')
+    full = title_tokens(title)
+    if not full:
+        return None
+    prefix = title_tokens(title.split(':')[0]) if ':' in title else None
+    return full, (prefix if prefix and prefix != full else None)
+
+
+def author_tokens(authors):
+    """Name tokens of one or more authors, without initials"""
+    # "George R.R. Martin" and "George R. R. Martin" both reduce to {george, martin}
+    return frozenset(token for token in tokenize(authors) if len(token) > 1)
+
+
+def dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def numbers(tokens):
+    return {token for token in tokens if token.isdigit()}
+
+
+def title_score(query_variants, book_variants, authors_agree):
+    """Similarity of two title_variants; 0 when their numbers differ"""
+    (query_full, query_prefix), (book_full, book_prefix) = query_variants, book_variants
+    # Only the same author's book drops its subtitle
+    if authors_agree and (query_prefix == book_full or book_prefix == query_full):
+        return 1.0
+    if numbers(query_full) != numbers(book_full):
+        return 0.0
+    return dice(query_full, book_full)
+
+
+def author_overlap(query_authors, book_authors):
+    """Share of the shorter author token set found in the other, or None when either side has no author"""
+    if not query_authors or not book_authors:
+        return None
+    # The shorter set, so co-authors and middle names do not count against a match
+    return len(query_authors & book_authors) / min(len(query_authors), len(book_authors))
+
+
+def author_scale(overlap):
+    """Factor in [CONFLICTING_AUTHOR_SCALE, 1] for an author_overlap"""
+    if overlap is None:
+        return UNKNOWN_AUTHOR_SCALE
+    return CONFLICTING_AUTHOR_SCALE + (1 - CONFLICTING_AUTHOR_SCALE) * overlap
+
+
+class TitleMatcher:
+    """Token index over library titles that matches (title, authors) rows to book ids"""
+
+    def __init__(self, books):
+        """books: iterable of (book_id, title, author names joined by any separator)"""
+        self.books = {}
+        self.index = defaultdict(list)
+        for book_id, title, authors in books:
+            variants = title_variants(title)
+            if not variants:
+                continue
+            self.books[book_id] = (variants, author_tokens(authors))
+            # The whole title holds every token of the part before the subtitle
+            for token in variants[0]:
+                self.index[token].append(book_id)
+
+    @classmethod
+    def from_db(cls, cursor):
+        cursor.execute('''
+            SELECT b.id, b.title, GROUP_CONCAT(a.author_name, ' ')
+            FROM books b
+            LEFT JOIN book_authors ba ON b.id = ba.book_id
+            LEFT JOIN authors a ON ba.author_id = a.id
+            GROUP BY b.id
+            ORDER BY b.id
+        ''')
+        return cls(cursor.fetchall())
+
+    def candidates(self, tokens):
+        """Book ids sharing a blocking token with the title tokens, most shared tokens first"""
+        keys = [token for token in tokens if token not in STOPWORDS] or list(tokens)
+        postings = sorted((self.index[token] for token in keys if token in self.index), key=len)
+        if not postings:
+            return []
+        # Fall back to the rarest token when every token is common
+        usable = [ids for ids in postings if len(ids) <= MAX_BLOCK_SIZE] or postings[:1]
+        shared = Counter()
+        for ids in usable:
+            shared.update(ids)
+        ranked = sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+        return [book_id for book_id, _ in ranked[:MAX_CANDIDATES]]
+
+    def match(self, title, authors):
+        """Return (book_id, confidence) for the best match, or (None, None) below MIN_CONFIDENCE"""
+        variants = title_variants(title)
+        if not variants:
+            return None, None
+        query_authors = author_tokens(authors)
+        best_id, best_confidence = None, 0.0
+        for book_id in self.candidates(variants[0]):
+            book_variants, book_authors = self.books[book_id]
+            overlap = author_overlap(query_authors, book_authors)
+            confidence = title_score(variants, book_variants, overlap == 1) * author_scale(overlap)
+            # Ties go to the lowest id
+            if confidence > best_confidence or (confidence == best_confidence and best_id is not None and book_id < best_id):
+                best_id, best_confidence = book_id, confidence
+        if best_confidence < MIN_CONFIDENCE:
+            return None, None
+        return best_id, round(best_confidence, 3)
@@ -0,0 +1,121 @@
+"""ZIP archives of many book files, streamed as they are built.
+
+zipfile writes into a sink that only collects bytes, and iter_zip() hands them
+on after every chunk it copies, so memory use is one chunk no matter how large
+the archive is. The sink cannot seek, so zipfile puts each entry's sizes and
+CRC in a data descriptor after the entry instead of going back to patch them in.
+
+Already-compressed formats (EPUB and CBZ are ZIPs themselves, MOBI/AZW are
+compressed, PDF streams are deflated) are stored as-is; deflating them again
+costs CPU and saves almost nothing.
+
+The output is deterministic: the same entries always give the same bytes, so
+archive_etag() works from file metadata alone. When every entry is stored and
+the archive needs no ZIP64 records, archive_length() gives the exact size up
+front, which is what lets the server answer Range requests for resumed downloads.
+"""
+import hashlib
+import os
+import time
+import zipfile
+from collections import namedtuple
+
+STORED_FORMATS = {'epub', 'mobi', 'azw', 'azw3', 'pdf', 'cbz', 'cbr', 'zip', 'jpg', 'jpeg', 'png'}
+CHUNK_SIZE = 64 * 1024
+# Earliest timestamp a ZIP entry can carry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+ZipEntry = namedtuple('ZipEntry', 'name path size mtime_ns compress_type')
+
+
+def make_entry(name, path):
+    """Describe a file to add under `name`; raises OSError if it is missing"""
+    stat = os.stat(path)
+    file_format = os.path.splitext(path)[1].lstrip('.').lower()
+    compress_type = zipfile.ZIP_STORED if file_format in STORED_FORMATS else zipfile.ZIP_DEFLATED
+    return ZipEntry(name, path, stat.st_size, stat.st_mtime_ns, compress_type)
+
+
+class _Sink:
+    """Write-only file object whose bytes are collected by drain()"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _zip_info(entry):
+    # Everything that ends up in a header comes from the entry, never from the clock or platform
+    info = zipfile.ZipInfo(entry.name, max(ZIP_EPOCH, time.gmtime(entry.mtime_ns // 1_000_000_000)[:6]))
+    info.create_system = 3
+    info.external_attr = 0o644 << 16
+    info.compress_type = entry.compress_type
+    info.file_size = entry.size
+    return info
+
+
+def _write_archive(entries, sink, copy_data=True):
+    """Write the archive into sink, yielding whenever there are new bytes to collect"""
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for entry in entries:
+            with archive.open(_zip_info(entry), 'w') as dest:
+                if copy_data:
+                    with open(entry.path, 'rb') as source:
+                        while True:
+                            chunk = source.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            yield
+            yield
+    yield
+
+
+def iter_zip(entries, start=0, stop=None):
+    """Yield the archive's bytes in [start, stop), building it as it goes"""
+    sink = _Sink()
+    position = 0
+    for _ in _write_archive(entries, sink):
+        data = sink.drain()
+        chunk_start, position = position, position + len(data)
+        if position <= start:
+            continue
+        if stop is not None and chunk_start >= stop:
+            return
+        yield data[max(0, start - chunk_start):None if stop is None else stop - chunk_start]
+
+
+def archive_length(entries):
+    """Exact archive size, or None when it cannot be known without compressing.
+
+    With only stored entries and no ZIP64 records, the archive is its headers,
+    descriptors and central directory plus the raw file bytes. The headers are
+    measured by writing the same archive with empty entries.
+    """
+    if any(entry.compress_type != zipfile.ZIP_STORED for entry in entries):
+        return None
+    sink = _Sink()
+    for _ in _write_archive(entries, sink, copy_data=False):
+        sink.drain()
+    length = sink.size + sum(entry.size for entry in entries)
+    return length if length < zipfile.ZIP64_LIMIT else None
+
+
+def archive_etag(entries):
+    digest = hashlib.sha1(b'zip-stream-1\n')
+    for entry in entries:
+        digest.update(f'{entry.name}|{entry.size}|{entry.mtime_ns}|{entry.compress_type}\n'.encode('utf-8'))
+    return digest.hexdigest()
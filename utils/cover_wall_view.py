@@ -1,12 +1,27 @@
-from flask import Flask, render_template_string
+from flask import Flask, render_template_string, request
 import sqlite3
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'infra'))
+import thumbnails
+from catalog_schema import ensure_serving_schema
 
 app = Flask(__name__)
 
 # Database is in ../infra/data/tt_db_ebook_lib.db
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'infra', 'data', 'tt_db_ebook_lib.db')
 
+# Covers per /api/books-with-covers page
+PAGE_SIZE = 60
+MAX_PAGE_SIZE = 200
+
+# ?sort= orders; books whose cover has not been analyzed yet sort after every colour
+SORT_KEYS = {
+    'title': "COALESCE(b.title, '')",
+    'color': 'COALESCE(cc.color_sort, 99999)',
+}
+
 COVER_WALL_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -257,6 +272,8 @@ COVER_WALL_TEMPLATE = '''
         <button class="view-btn" onclick="setGridSize('small')">Small</button>
         <button class="view-btn active" onclick="setGridSize('medium')">Medium</button>
         <button class="view-btn" onclick="setGridSize('large')">Large</button>
+        <button class="view-btn sort-btn active" onclick="setSort('title')">By title</button>
+        <button class="view-btn sort-btn" onclick="setSort('color')">By colour</button>
     </div>
     
     <div class="stats" id="stats">Loading covers...</div>
@@ -264,6 +281,7 @@ COVER_WALL_TEMPLATE = '''
     <div class="cover-grid grid-medium" id="coverGrid">
         <div class="loading">Loading book covers...</div>
     </div>
+    <div id="pageSentinel"></div>
     
     <div class="fullscreen-modal" id="fullscreenModal">
         <button class="close-fullscreen" onclick="closeFullscreen()">&times;</button>
@@ -271,33 +289,20 @@ COVER_WALL_TEMPLATE = '''
     </div>
     
     <script>
+        // Thumbnail width requested for each grid mode
+        const COVER_WIDTHS = {{ cover_widths | tojson }};
         let allBooks = [];
-        
-        async function loadCovers() {
-            try {
-                const response = await fetch('/api/books-with-covers');
-                const data = await response.json();
-                allBooks = data.books;
-                displayCovers(allBooks);
-                updateStats(data.stats);
-            } catch (error) {
-                document.getElementById('coverGrid').innerHTML = 
-                    '<div class="loading">Error loading covers</div>';
-            }
-        }
-        
-        function displayCovers(books) {
-            const grid = document.getElementById('coverGrid');
-            
-            if (books.length === 0) {
-                grid.innerHTML = '<div class="loading">No books found</div>';
-                return;
-            }
-            
-            grid.innerHTML = books.map(book => `
-                <div class="cover-item" onclick="showFullscreen(${book.id})">
+        let gridSize = 'medium';
+        let sortOrder = 'title';
+        // Cursor for the next page; null once the last page has arrived
+        let nextPage = {sort: sortOrder};
+        let loadingPage = false;
+        
+        function coverItemHtml(book) {
+            return `
+                <div class="cover-item" onclick="showFullscreen(${book.id})"${book.color ? ` style="background: ${book.color}"` : ''}>
                     ${book.has_cover ? 
-                        `<img src="/api/cover/${book.id}" class="cover-image" alt="${book.title}">` :
+                        `<img src="/api/cover/${book.id}?w=${COVER_WIDTHS[gridSize]}" class="cover-image" loading="lazy" alt="${book.title}">` :
                         `<div class="cover-placeholder">📖</div>`
                     }
                     <div class="cover-overlay">
@@ -305,19 +310,64 @@ COVER_WALL_TEMPLATE = '''
                         <div class="cover-author">${book.authors}</div>
                     </div>
                 </div>
-            `).join('');
+            `;
         }
         
+        async function loadNextPage() {
+            if (loadingPage || !nextPage) return;
+            loadingPage = true;
+            const grid = document.getElementById('coverGrid');
+            try {
+                const response = await fetch('/api/books-with-covers?' + new URLSearchParams(nextPage));
+                const data = await response.json();
+                if (allBooks.length === 0) {
+                    grid.innerHTML = data.books.length === 0 ? '<div class="loading">No books found</div>' : '';
+                }
+                if (data.stats) updateStats(data.stats);
+                allBooks.push(...data.books);
+                grid.insertAdjacentHTML('beforeend', data.books.map(coverItemHtml).join(''));
+                nextPage = data.next;
+            } catch (error) {
+                if (allBooks.length === 0) grid.innerHTML = '<div class="loading">Error loading covers</div>';
+            }
+            loadingPage = false;
+            // Observing again re-checks the sentinel in case it is still on screen
+            pageObserver.unobserve(sentinel);
+            if (nextPage) pageObserver.observe(sentinel);
+        }
+        
+        // Infinite scroll: fetch the next page while the end of the grid is still a screen or two away
+        const sentinel = document.getElementById('pageSentinel');
+        const pageObserver = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, { rootMargin: '1500px 0px' });
+        
         function setGridSize(size) {
             const grid = document.getElementById('coverGrid');
             grid.className = 'cover-grid grid-' + size;
+            gridSize = size;
+            grid.querySelectorAll('img.cover-image').forEach(img => {
+                img.src = img.src.replace(/w=\d+/, `w=${COVER_WIDTHS[size]}`);
+            });
             
-            document.querySelectorAll('.view-btn').forEach(btn => {
+            document.querySelectorAll('.view-btn:not(.sort-btn)').forEach(btn => {
                 btn.classList.remove('active');
             });
             event.target.classList.add('active');
         }
         
+        function setSort(sort) {
+            if (sort === sortOrder) return;
+            document.querySelectorAll('.sort-btn').forEach(btn => btn.classList.remove('active'));
+            event.target.classList.add('active');
+            sortOrder = sort;
+            allBooks = [];
+            nextPage = {sort};
+            document.getElementById('coverGrid').innerHTML = '<div class="loading">Loading book covers...</div>';
+            window.scrollTo(0, 0);
+            loadNextPage();
+        }
+        
         function showFullscreen(bookId) {
             const book = allBooks.find(b => b.id === bookId);
             if (!book) return;
@@ -359,74 +409,77 @@ COVER_WALL_TEMPLATE = '''
             if (e.target.id === 'fullscreenModal') closeFullscreen();
         });
         
-        loadCovers();
+        loadNextPage();
     </script>
 </body>
 </html>
 '''
 
-def get_books_with_covers():
-    """Get all books and indicate which have covers"""
+def get_books_with_covers(sort='title', after_key=None, after_id=0, limit=PAGE_SIZE):
+    """Get one page of books in the given order, starting after (after_key, after_id)"""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    sort_key = SORT_KEYS[sort]
+    if after_key is None:
+        after_key = '' if sort == 'title' else -1
     
-    cursor.execute('SELECT id, title, cover_path FROM books ORDER BY title')
+    # Keyset pagination. Title order is a range scan of idx_books_title_key however deep the wall
+    # is scrolled (the >= bound is what lets SQLite use the expression index); colour order comes
+    # through two joins that no index covers, so each page sorts the catalog (fine at library
+    # sizes, but not a range scan).
+    # Colours come from cover_colors, filled in by thumbnails.refresh_thumbnails.
+    cursor.execute(f'''
+        SELECT b.id, b.title, b.cover_path,
+               (SELECT GROUP_CONCAT(a.author_name, ', ') FROM book_authors ba JOIN authors a ON a.id = ba.author_id WHERE ba.book_id = b.id),
+               (SELECT ser.series_name || ' #' || bser.series_index FROM book_series bser JOIN series ser ON ser.id = bser.series_id WHERE bser.book_id = b.id),
+               cc.dominant_color, {sort_key}
+        FROM books b
+        LEFT JOIN cover_sources cs ON cs.cover_path = b.cover_path
+        LEFT JOIN cover_colors cc ON cc.content_hash = cs.content_hash
+        WHERE {sort_key} >= ?1 AND ({sort_key}, b.id) > (?1, ?2)
+        ORDER BY {sort_key}, b.id
+        LIMIT ?3
+    ''', (after_key, after_id, limit))
     books = cursor.fetchall()
-    
-    result = []
-    books_with_covers = 0
-    
-    for book_id, title, cover_path in books:
-        # Get authors
-        cursor.execute('''
-            SELECT a.author_name 
-            FROM authors a
-            JOIN book_authors ba ON a.id = ba.author_id
-            WHERE ba.book_id = ?
-        ''', (book_id,))
-        authors = [row[0] for row in cursor.fetchall()]
-        
-        # Get series
-        cursor.execute('''
-            SELECT ser.series_name, bser.series_index
-            FROM series ser
-            JOIN book_series bser ON ser.id = bser.series_id
-            WHERE bser.book_id = ?
-        ''', (book_id,))
-        series_result = cursor.fetchone()
-        series = f"{series_result[0]} #{series_result[1]}" if series_result else None
-        
-        has_cover = cover_path is not None and os.path.exists(cover_path)
-        if has_cover:
-            books_with_covers += 1
-        
-        result.append({
-            'id': book_id,
-            'title': title,
-            'authors': ', '.join(authors) if authors else 'Unknown',
-            'series': series,
-            'has_cover': has_cover
-        })
-    
     conn.close()
     
-    return result, books_with_covers
+    return [{
+        'id': book_id,
+        'title': title,
+        'authors': authors or 'Unknown',
+        'series': series,
+        'color': color,
+        'sort_key': sort_value,
+        'has_cover': cover_path is not None and os.path.exists(cover_path)
+    } for book_id, title, cover_path, authors, series, color, sort_value in books]
+
+def get_cover_stats():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*), COUNT(cover_path) FROM books')
+    total_books, books_with_covers = cursor.fetchone()
+    conn.close()
+    return {'total_books': total_books, 'books_with_covers': books_with_covers}
 
 @app.route('/')
 def index():
-    return render_template_string(COVER_WALL_TEMPLATE)
+    return render_template_string(COVER_WALL_TEMPLATE, cover_widths=thumbnails.SIZES)
 
 @app.route('/api/books-with-covers')
 def api_books_with_covers():
     from flask import jsonify
-    books, books_with_covers = get_books_with_covers()
-    return jsonify({
-        'books': books,
-        'stats': {
-            'total_books': len(books),
-            'books_with_covers': books_with_covers
-        }
-    })
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    sort = request.args.get('sort', 'title')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f"Unknown sort '{sort}'"}), 400
+    after_key = request.args.get('after_key', type=str if sort == 'title' else int)
+    books = get_books_with_covers(sort, after_key, request.args.get('after_id', 0, type=int), limit)
+    # The last book on a full page is the cursor for the next one
+    next_page = {'sort': sort, 'after_key': books[-1]['sort_key'], 'after_id': books[-1]['id']} if len(books) == limit else None
+    result = {'books': books, 'next': next_page}
+    if 'after_id' not in request.args:
+        result['stats'] = get_cover_stats()
+    return jsonify(result)
 
 @app.route('/api/cover/<int:book_id>')
 def api_cover(book_id):
@@ -435,10 +488,21 @@ def api_cover(book_id):
     cursor = conn.cursor()
     cursor.execute('SELECT cover_path FROM books WHERE id = ?', (book_id,))
     result = cursor.fetchone()
-    conn.close()
     
     if result and result[0] and os.path.exists(result[0]):
+        # ?w= sends the thumbnail nearest that width, as on the main server; no width sends the original
+        width = request.args.get('w', type=int)
+        if width:
+            fmt = 'webp' if 'webp' in thumbnails.supported_formats() and 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+            thumbnail = thumbnails.get_thumbnail(conn, result[0], width, fmt)
+            conn.close()
+            if thumbnail:
+                response = send_file(thumbnail, mimetype=thumbnails.FORMATS[fmt][1])
+                response.vary.add('Accept')
+                return response
+        conn.close()
         return send_file(result[0])
+    conn.close()
     return '', 404
 
 if __name__ == '__main__':
@@ -446,6 +510,9 @@ if __name__ == '__main__':
         print(f"Error: Database file '{DB_PATH}' not found!")
         print("Make sure ebook_library.db is in the same folder as this script.")
     else:
+        conn = sqlite3.connect(DB_PATH)
+        ensure_serving_schema(conn)
+        conn.close()
         print("="*60)
         print("Book Cover Wall Display")
         print("="*60)
@@ -2,6 +2,10 @@ import sqlite3
 from pathlib import Path
 from collections import Counter
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'infra'))
+from book_identifiers import EDITION_SCHEMES
 
 class DataQualityChecker:
     def __init__(self, db_path='../infra/data/tt_db_ebook_lib.db'):
@@ -180,6 +184,30 @@ class DataQualityChecker:
             )
         return len(results)
     
+    def test_duplicate_identifiers(self):
+        """Check for books sharing an ISBN, ASIN or other edition identifier"""
+        self.cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'book_identifiers'")
+        if not self.cursor.fetchone()[0]:
+            return 0
+        self.cursor.execute(f'''
+            SELECT bi.scheme, bi.value, COUNT(*) as cnt, GROUP_CONCAT(bi.book_id), GROUP_CONCAT(b.title, ' | ')
+            FROM book_identifiers bi
+            JOIN books b ON b.id = bi.book_id
+            WHERE bi.scheme IN ({', '.join('?' * len(EDITION_SCHEMES))})
+            GROUP BY bi.scheme, bi.value
+            HAVING cnt > 1
+        ''', EDITION_SCHEMES)
+        results = self.cursor.fetchall()
+        
+        if results:
+            self.log_issue(
+                'Duplicate Identifiers',
+                'WARNING',
+                f'Found {len(results)} identifiers shared by more than one book',
+                [f"{r[0]} {r[1]}: {r[4]} (IDs: {r[3]})" for r in results[:10]]
+            )
+        return len(results)
+    
     def test_duplicate_authors(self):
         """Check for duplicate author entries with slight variations"""
         self.cursor.execute("SELECT author_name FROM authors ORDER BY author_name")
@@ -378,6 +406,7 @@ class DataQualityChecker:
         
         print("\n🔍 Running duplicate detection tests...")
         duplicate_books = self.test_duplicate_books()
+        duplicate_identifiers = self.test_duplicate_identifiers()
         duplicate_authors = self.test_duplicate_authors()
         
         print("\n🔍 Running consistency tests...")
@@ -1,14 +1,21 @@
 import os
 import shutil
+import sys
+import xml.etree.ElementTree as ET
 from pathlib import Path
 from difflib import SequenceMatcher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'infra'))
+from book_identifiers import EDITION_SCHEMES, opf_identifiers
+
 class EbookFolderCleaner:
     def __init__(self, library_path):
         self.library_path = Path(library_path)
         self.ebook_extensions = {'.epub', '.mobi', '.azw', '.azw3', '.pdf', '.txt', '.fb2', '.djvu', '.cbr'}
         self.empty_folders = []
         self.duplicate_candidates = []
+        # First folder seen with each ISBN/ASIN, across all authors
+        self.folders_by_identifier = {}
     
     def has_ebook_files(self, folder_path):
         """Check if a folder contains any ebook files"""
@@ -23,6 +30,13 @@ class EbookFolderCleaner:
         ebook_count = sum(1 for f in files if f.is_file() and f.suffix.lower() in self.ebook_extensions)
         metadata_count = sum(1 for f in files if f.suffix.lower() == '.opf')
         cover_count = sum(1 for f in files if f.suffix.lower() in ['.jpg', '.jpeg', '.png'])
+        identifiers = []
+        for f in files:
+            if f.suffix.lower() == '.opf':
+                try:
+                    identifiers += [i for i in opf_identifiers(ET.parse(f).getroot()) if i[0] in EDITION_SCHEMES]
+                except ET.ParseError:
+                    pass
         
         return {
             'path': folder_path,
@@ -30,7 +44,8 @@ class EbookFolderCleaner:
             'ebook_count': ebook_count,
             'metadata_count': metadata_count,
             'cover_count': cover_count,
-            'total_files': len(files)
+            'total_files': len(files),
+            'identifiers': identifiers
         }
     
     def similarity_ratio(self, str1, str2):
@@ -64,6 +79,8 @@ class EbookFolderCleaner:
                 # Track empty folders
                 if info['ebook_count'] == 0:
                     self.empty_folders.append(info)
+                
+                self.match_identifiers(author_name, info)
             
             # Find potential duplicates within the same author
             if len(book_folders) > 1:
@@ -73,6 +90,32 @@ class EbookFolderCleaner:
         print(f"Found {len(self.empty_folders)} folders without ebook files")
         print(f"Found {len(self.duplicate_candidates)} potential duplicate groups")
     
+    def add_candidate(self, author_name, folder1, folder2, similarity, match):
+        """Record a duplicate pair when exactly one of the two folders has ebooks"""
+        if folder1['ebook_count'] > 0 and folder2['ebook_count'] == 0:
+            keep, remove = folder1, folder2
+        elif folder2['ebook_count'] > 0 and folder1['ebook_count'] == 0:
+            keep, remove = folder2, folder1
+        else:
+            return
+        if any(dup['remove'] is remove and dup['keep'] is keep for dup in self.duplicate_candidates):
+            return
+        self.duplicate_candidates.append({
+            'author': author_name,
+            'keep': keep,
+            'remove': remove,
+            'similarity': similarity,
+            'match': match
+        })
+    
+    def match_identifiers(self, author_name, info):
+        """Pair a folder with an earlier one whose OPF has the same ISBN or ASIN, whatever either is named"""
+        for identifier in info['identifiers']:
+            other = self.folders_by_identifier.setdefault(identifier, info)
+            if other is not info:
+                self.add_candidate(author_name, other, info, 1.0, f"{identifier[0]} {identifier[1]}")
+                return
+    
     def find_duplicates_in_author(self, author_name, book_folders):
         """Find similar book folders under the same author"""
         # Compare each pair of folders
@@ -82,21 +125,7 @@ class EbookFolderCleaner:
                 
                 # If names are very similar (>70% match)
                 if similarity > 0.7:
-                    # One has ebooks, one doesn't
-                    if folder1['ebook_count'] > 0 and folder2['ebook_count'] == 0:
-                        self.duplicate_candidates.append({
-                            'author': author_name,
-                            'keep': folder1,
-                            'remove': folder2,
-                            'similarity': similarity
-                        })
-                    elif folder2['ebook_count'] > 0 and folder1['ebook_count'] == 0:
-                        self.duplicate_candidates.append({
-                            'author': author_name,
-                            'keep': folder2,
-                            'remove': folder1,
-                            'similarity': similarity
-                        })
+                    self.add_candidate(author_name, folder1, folder2, similarity, 'name')
     
     def display_empty_folders(self):
         """Display all folders without ebook files"""
@@ -125,7 +154,7 @@ class EbookFolderCleaner:
         
         for i, dup in enumerate(self.duplicate_candidates, 1):
             print(f"\n{i}. Author: {dup['author']}")
-            print(f"   Similarity: {dup['similarity']*100:.1f}%")
+            print(f"   Similarity: {dup['similarity']*100:.1f}% (matched by {dup['match']})")
             print(f"   KEEP:   {dup['keep']['name']} ({dup['keep']['ebook_count']} ebooks)")
             print(f"   DELETE: {dup['remove']['name']} ({dup['remove']['ebook_count']} ebooks)")
     
@@ -212,7 +241,7 @@ class EbookFolderCleaner:
             
             for dup in self.duplicate_candidates:
                 f.write(f"Author: {dup['author']}\n")
-                f.write(f"  Similarity: {dup['similarity']*100:.1f}%\n")
+                f.write(f"  Similarity: {dup['similarity']*100:.1f}% (matched by {dup['match']})\n")
                 f.write(f"  KEEP:   {dup['keep']['name']}\n")
                 f.write(f"  DELETE: {dup['remove']['name']}\n\n")
         
@@ -224,7 +253,7 @@ def main():
     print("="*60)
     print("\nThis tool will:")
     print("1. Find folders without any ebook files")
-    print("2. Identify potential duplicate folders")
+    print("2. Identify potential duplicate folders (similar names or the same ISBN/ASIN)")
     print("3. Allow you to safely delete empty/duplicate folders")
     print("\n" + "="*60)
     
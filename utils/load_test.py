@@ -0,0 +1,290 @@
+"""Replay recorded browse sessions against the library web server and report latency.
+
+By default a synthetic catalog is generated in a temp folder and the web server is
+started on it in-process, so runs are reproducible on any machine:
+
+    python load_test.py --books 5000 --users 8 --duration 30
+
+Use --url to point at a server that is already running instead. Sessions are read
+from load_test_sessions.json and thresholds from load_test_thresholds.json; the
+script exits with status 1 when any threshold is exceeded.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+UTILS_DIR = Path(__file__).parent
+INFRA_DIR = UTILS_DIR / '..' / 'infra'
+SESSIONS_PATH = UTILS_DIR / 'load_test_sessions.json'
+THRESHOLDS_PATH = UTILS_DIR / 'load_test_thresholds.json'
+
+FIRST_NAMES = ['Ada', 'Brandon', 'Celeste', 'Dmitri', 'Elena', 'Farah', 'George', 'Hiro', 'Ines', 'Jun', 'Kofi', 'Lena']
+LAST_NAMES = ['Abbott', 'Baptiste', 'Castillo', 'Dinniman', 'Eze', 'Fujita', 'Grant', 'Haddad', 'Ivanova', 'Jensen']
+WORDS = ['Shadow', 'River', 'Empire', 'Glass', 'Winter', 'Crown', 'Memory', 'Garden', 'Storm', 'Atlas', 'Silent', 'Iron']
+SUBJECTS = ['Fiction', 'Fantasy', 'Science Fiction', 'Mystery', 'History', 'Biography', 'Romance', 'Thriller', 'Poetry']
+
+
+def build_synthetic_catalog(root, book_count, seed=1):
+    """Create a database plus cover and book files for book_count fake books under root"""
+    sys.path.insert(0, str(INFRA_DIR))
+    from ebook_processor import EbookCatalog
+
+    rng = random.Random(seed)
+    root = Path(root)
+    db_path = root / 'synthetic.db'
+    catalog = EbookCatalog(str(db_path))
+    catalog.connect()
+    catalog.create_tables()
+
+    # Covers are shared between books and book files are hard links to one file,
+    # so generation stays fast while the server still streams a real file per request.
+    cover_bytes = bytes(rng.getrandbits(8) for _ in range(40 * 1024))
+    file_bytes = bytes(rng.getrandbits(8) for _ in range(256 * 1024))
+    covers = []
+    for i in range(8):
+        cover = root / f'cover_{i}.jpg'
+        cover.write_bytes(cover_bytes)
+        covers.append(str(cover))
+    book_file = root / 'book.epub'
+    book_file.write_bytes(file_bytes)
+    (root / 'files').mkdir()
+
+    author_count = max(1, book_count // 6)
+    authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}' for i in range(author_count)]
+    for book_id in range(1, book_count + 1):
+        title = f'{rng.choice(WORDS)} {rng.choice(WORDS)} {book_id}'
+        catalog.cursor.execute('''
+            INSERT INTO books (id, title, book_folder, cover_path, description)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (book_id, title, str(root / f'book_{book_id}'), rng.choice(covers), ' '.join(rng.choices(WORDS, k=60))))
+        catalog.link_book_authors(book_id, [{'name': rng.choice(authors), 'sort': None}])
+        catalog.link_book_subjects(book_id, rng.sample(SUBJECTS, 3))
+        if rng.random() < 0.4:
+            catalog.link_book_series(book_id, f'{rng.choice(WORDS)} Cycle {book_id % 300}', float(rng.randint(1, 12)))
+        file_path = root / 'files' / f'{book_id}.epub'
+        os.link(book_file, file_path)
+        catalog.cursor.execute('''
+            INSERT INTO book_files (book_id, file_path, file_format, file_size)
+            VALUES (?, ?, ?, ?)
+        ''', (book_id, str(file_path), '.epub', len(file_bytes)))
+    catalog.conn.commit()
+    catalog.close()
+    return db_path
+
+
+def start_local_server(db_path, port):
+    """Serve the web app on db_path from a background thread and return its base URL"""
+    sys.path.insert(0, str(INFRA_DIR))
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import library_web_server as server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server.DB_PATH = Path(db_path)
+    server.init_db()
+    httpd = make_server('127.0.0.1', port, server.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{httpd.server_port}', httpd
+
+
+class Recorder:
+    """Thread-safe store of (step name -> latencies) plus error and byte counts"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.bytes = 0
+
+    def timed_get(self, http, base_url, path, step):
+        started = time.perf_counter()
+        try:
+            response = http.get(base_url + path, timeout=30)
+            size = len(response.content)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, size, ok = None, 0, False
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[step].append(elapsed)
+            self.bytes += size
+            if not ok:
+                self.errors[step] += 1
+        return response if ok else None
+
+
+def run_session(session, http, pool, base_url, recorder, rng):
+    """Replay one session's steps; later steps pick ids from earlier responses"""
+    books = []
+    details = []
+    for step in session['steps']:
+        action = step['action']
+        if action == 'get':
+            response = recorder.timed_get(http, base_url, step['path'], step.get('name', step['path']))
+            if response is not None and step['path'] == '/api/books':
+                books = response.json().get('books', [])
+        elif action == 'covers':
+            with_covers = [b['id'] for b in books if b.get('has_cover')]
+            start = rng.randrange(max(1, len(with_covers) - step['count']))
+            chosen = with_covers[start:start + step['count']]
+            list(pool.map(lambda book_id: recorder.timed_get(http, base_url, f'/api/cover/{book_id}', 'cover'), chosen))
+        elif action == 'details':
+            for book in rng.sample(books, min(step['count'], len(books))):
+                response = recorder.timed_get(http, base_url, f"/api/book/{book['id']}", 'book_details')
+                if response is not None:
+                    details.append(response.json())
+        elif action == 'download':
+            files = [f for book in details for f in book.get('files', [])]
+            for file in rng.sample(files, min(step['count'], len(files))):
+                recorder.timed_get(http, base_url, f"/api/download/{file['id']}", 'download')
+        if step.get('think_ms'):
+            time.sleep(step['think_ms'] / 1000)
+
+
+def run_load(base_url, sessions, users, duration, seed=1):
+    """Run `users` virtual users replaying weighted sessions until `duration` seconds pass"""
+    recorder = Recorder()
+    weights = [s.get('weight', 1) for s in sessions]
+    deadline = time.perf_counter() + duration
+
+    def virtual_user(user_id):
+        rng = random.Random(seed + user_id)
+        http = requests.Session()
+        # Browsers fetch covers over ~6 parallel connections
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            while time.perf_counter() < deadline:
+                run_session(rng.choices(sessions, weights)[0], http, pool, base_url, recorder, rng)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder, elapsed):
+    """Return per-step and overall latency percentiles (ms), throughput and error rate"""
+    report = {'steps': {}}
+    all_latencies = []
+    total_errors = 0
+    for step, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        all_latencies.extend(values)
+        total_errors += recorder.errors[step]
+        report['steps'][step] = {
+            'requests': len(values),
+            'errors': recorder.errors[step],
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+    all_latencies.sort()
+    total = len(all_latencies)
+    report['overall'] = {
+        'requests': total,
+        'errors': total_errors,
+        'error_rate': round(total_errors / total, 4) if total else 0.0,
+        'throughput_rps': round(total / elapsed, 1) if elapsed else 0.0,
+        'mb_received': round(recorder.bytes / 1024 / 1024, 1),
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(all_latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 2),
+    }
+    return report
+
+
+def check_thresholds(report, thresholds):
+    """Return a list of human readable threshold violations (empty when all pass)"""
+    failures = []
+    overall = report['overall']
+    if 'min_throughput_rps' in thresholds and overall['throughput_rps'] < thresholds['min_throughput_rps']:
+        failures.append(f"throughput {overall['throughput_rps']} rps < {thresholds['min_throughput_rps']} rps")
+    if 'max_error_rate' in thresholds and overall['error_rate'] > thresholds['max_error_rate']:
+        failures.append(f"error rate {overall['error_rate']} > {thresholds['max_error_rate']}")
+    limits = [('overall', overall, thresholds.get('overall', {}))]
+    limits += [(step, report['steps'][step], limit) for step, limit in thresholds.get('steps', {}).items() if step in report['steps']]
+    for name, values, limit in limits:
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if key in limit and values[key] > limit[key]:
+                failures.append(f"{name} {key} {values[key]} > {limit[key]}")
+    return failures
+
+
+def print_report(report):
+    print("=" * 70)
+    print(f"{'step':<20}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * 70)
+    for step, values in report['steps'].items():
+        print(f"{step:<20}{values['requests']:>10}{values['errors']:>8}{values['p50_ms']:>10}{values['p95_ms']:>10}{values['p99_ms']:>10}")
+    overall = report['overall']
+    print("-" * 70)
+    print(f"{'overall':<20}{overall['requests']:>10}{overall['errors']:>8}{overall['p50_ms']:>10}{overall['p95_ms']:>10}{overall['p99_ms']:>10}")
+    print(f"\nThroughput: {overall['throughput_rps']} requests/s, {overall['mb_received']} MB received")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server (default: start one on a synthetic catalog)')
+    parser.add_argument('--books', type=int, default=2000, help='books in the synthetic catalog')
+    parser.add_argument('--users', type=int, default=4, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run')
+    parser.add_argument('--sessions', default=str(SESSIONS_PATH), help='recorded sessions JSON')
+    parser.add_argument('--thresholds', default=str(THRESHOLDS_PATH), help='regression thresholds JSON')
+    parser.add_argument('--report', help='also write the report as JSON to this path')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sessions = json.loads(Path(args.sessions).read_text())['sessions']
+    thresholds = json.loads(Path(args.thresholds).read_text()) if args.thresholds and Path(args.thresholds).exists() else {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        httpd = None
+        base_url = args.url
+        if not base_url:
+            print(f"Building synthetic catalog with {args.books} books...")
+            db_path = build_synthetic_catalog(workdir, args.books, args.seed)
+            base_url, httpd = start_local_server(db_path, 0)
+        print(f"Replaying {len(sessions)} session type(s) with {args.users} users for {args.duration}s against {base_url}")
+        recorder, elapsed = run_load(base_url, sessions, args.users, args.duration, args.seed)
+        if httpd:
+            httpd.shutdown()
+
+    report = summarize(recorder, elapsed)
+    print_report(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2))
+
+    failures = check_thresholds(report, thresholds)
+    if failures:
+        print("\n❌ Regression thresholds exceeded:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("\n✅ All thresholds met")
+
+
+if __name__ == '__main__':
+    main()
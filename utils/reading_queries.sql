@@ -47,15 +47,25 @@ LEFT JOIN reading_history rh ON b.id = rh.book_id
 WHERE rh.read_status IS NULL OR rh.read_status = 'to-read'
 ORDER BY a.author_name, s.series_name, bser.series_index;
 
--- Reading pace over time
+-- Reading pace over time (rollups kept current by storygraph_processor.py)
 SELECT 
-    strftime('%Y-%m', last_date_read) as month,
-    COUNT(*) as books_finished
-FROM reading_history
-WHERE read_status = 'read' 
-  AND last_date_read IS NOT NULL
-GROUP BY strftime('%Y-%m', last_date_read)
-ORDER BY month DESC;
+    printf('%04d-%02d', year, month) as month,
+    books_finished,
+    avg_rating
+FROM reading_monthly
+ORDER BY year DESC, month DESC;
+
+-- Books finished per year
+SELECT year, books_finished, books_rated, avg_rating
+FROM reading_yearly
+ORDER BY year DESC;
+
+-- Reading sessions that overlap 2024
+SELECT rh.title, rh.authors, rs.start_date, rs.end_date
+FROM reading_sessions rs
+JOIN reading_history rh ON rh.id = rs.reading_history_id
+WHERE rs.end_date >= '2024' AND (rs.start_date IS NULL OR rs.start_date < '2025')
+ORDER BY rs.end_date;
 
 -- Books with specific moods
 SELECT 
@@ -70,6 +80,14 @@ WHERE ba.moods LIKE '%dark%'
    OR ba.moods LIKE '%mysterious%'
 ORDER BY rh.star_rating DESC;
 
+-- Same filter through the tag dictionary (no LIKE scans)
+SELECT DISTINCT rh.title, rh.authors, rh.star_rating
+FROM reading_tags t
+JOIN reading_history_tags rht ON rht.tag_id = t.id
+JOIN reading_history rh ON rh.id = rht.reading_history_id
+WHERE t.kind = 'mood' AND t.name IN ('dark', 'mysterious')
+ORDER BY rh.star_rating DESC;
+
 -- Your highest rated series
 SELECT 
     s.series_name,
@@ -0,0 +1,347 @@
+"""Export the catalog as a static website that any plain file server can host.
+
+    python static_export.py ../site
+    python static_export.py ../site --with-files
+
+Layout of the output directory:
+
+    index.html                   search page: loads manifest.json, then the shards
+    manifest.json                shard list and stats (the only file that must not be cached)
+    data/books-<n>.<hash>.json   list rows for books with id // SHARD_SIZE == n
+    books/<id>.html              one detail page per book
+    covers/<key>-<width>.jpg     cover thumbnails
+    assets/<name>.<hash>.<ext>   style sheet and script
+    files/<file_id>/<name>       book files, only with --with-files
+
+Names with a hash in them never change content, so they can be cached forever.
+A re-export renders everything in memory but only writes files whose content
+changed (recorded in .export-state.json) and deletes files no longer used.
+Shards are id ranges, so editing a few books rewrites a few shards and pages.
+Catalog-wide numbers such as the book count live only in manifest.json and are
+filled in by script, so adding a book does not rewrite every page.
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+UTILS_DIR = Path(__file__).parent
+INFRA_DIR = UTILS_DIR / '..' / 'infra'
+sys.path.insert(0, str(INFRA_DIR))
+import library_web_server as server
+import thumbnails
+from catalog_schema import get_catalog_version
+
+DB_PATH = INFRA_DIR / 'data' / 'tt_db_ebook_lib.db'
+SHARD_SIZE = 500
+STATE_FILE = '.export-state.json'
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <link rel="stylesheet" href="{root}assets/{stylesheet}">
+    <style>
+        a.book-card, a.back-btn {{ color: inherit; text-decoration: none; }}
+        .book-card {{ content-visibility: auto; contain-intrinsic-size: auto 150px; }}
+        .static-page {{ background: rgba(255, 255, 255, 0.98); border-radius: 15px; padding: 30px; }}
+    </style>
+</head>
+<body>
+    <div class="header-sticky-container">
+        <header>
+            <div class="header-content">
+                <div class="header-ctas"></div>
+                <div class="header-center">
+                    <h1><a href="{root}index.html" style="color: inherit; text-decoration: none;">📖 TT's eLibrary 🌐</a></h1>
+                    <p class="subtitle">Browse and download the eBook collection</p>
+                </div>
+                <div class="header-right">
+                    <span class="total-books-badge" id="totalBooksBadge">📖 Books</span>
+                </div>
+            </div>
+        </header>
+    </div>
+    <div class="container">
+{body}
+    </div>
+{scripts}</body>
+</html>
+'''
+
+INDEX_BODY = '''        <div class="search-bar">
+            <div class="search-controls">
+                <input type="text" class="search-input" id="searchInput" placeholder="Search by title, author, subject, or series...">
+            </div>
+        </div>
+        <div id="booksContainer">
+            <div class="loading">Loading library...</div>
+        </div>'''
+
+# Runs in the exported index.html; everything it needs comes from manifest.json and the shards
+CATALOG_SCRIPT = r'''// Static catalog: loads the sharded index once, then searches in memory.
+const RENDER_LIMIT = 600;
+let books = [];
+
+function escapeHtml(text) {
+    return String(text).replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+}
+
+function bookCardHtml(book) {
+    return `
+        <a class="book-card" href="books/${book.id}.html">
+            ${book.cover ? `<img src="${book.cover}" class="book-card-cover" loading="lazy" alt=""${book.color ? ` style="background: ${book.color}"` : ''}>` : `<div class="book-card-cover-placeholder">📚</div>`}
+            <div class="book-card-info">
+                <div class="book-title">${escapeHtml(book.title)}</div>
+                <div class="book-author">by ${escapeHtml(book.authors)}</div>
+                ${book.series ? `<div class="book-series">${escapeHtml(book.series)}</div>` : ''}
+                ${book.subjects.length > 0 ? `<div class="book-subjects">${book.subjects.map(s => `<span class="subject-tag">${escapeHtml(s)}</span>`).join('')}</div>` : ''}
+            </div>
+        </a>`;
+}
+
+function render(term) {
+    const container = document.getElementById('booksContainer');
+    const matches = term ? books.filter(book => book.searchText.includes(term)) : books;
+    if (matches.length === 0) {
+        container.innerHTML = '<div class="no-results">No books found</div>';
+        return;
+    }
+    const more = matches.length > RENDER_LIMIT ? `<div class="no-results">Showing ${RENDER_LIMIT} of ${matches.length} books; search to narrow it down</div>` : '';
+    container.innerHTML = `<div class="books-grid">${matches.slice(0, RENDER_LIMIT).map(bookCardHtml).join('')}</div>${more}`;
+}
+
+async function loadCatalog() {
+    const manifest = await (await fetch('manifest.json', { cache: 'no-cache' })).json();
+    document.getElementById('totalBooksBadge').textContent = `📖 ${manifest.stats.total_books} Books`;
+    const shards = await Promise.all(manifest.shards.map(shard => fetch(shard.file).then(response => response.json())));
+    books = shards.flat().sort((a, b) => a.title.localeCompare(b.title));
+    books.forEach(book => {
+        book.searchText = [book.title, book.authors, ...book.subjects, book.series || ''].join('\u0000').toLowerCase();
+    });
+    render('');
+}
+
+let searchTimer = null;
+document.getElementById('searchInput').addEventListener('input', event => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => render(event.target.value.toLowerCase()), 150);
+});
+
+loadCatalog().catch(() => {
+    document.getElementById('booksContainer').innerHTML = '<div class="no-results">Error loading books</div>';
+});
+'''
+
+
+# Runs in the book pages: the book count comes from manifest.json, which sits one level above assets/
+BADGE_SCRIPT = r'''fetch(new URL('../manifest.json', document.currentScript.src), { cache: 'no-cache' })
+    .then(response => response.json())
+    .then(manifest => { document.getElementById('totalBooksBadge').textContent = `📖 ${manifest.stats.total_books} Books`; })
+    .catch(() => {});
+'''
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def hashed_name(stem, extension, data):
+    return f'{stem}.{content_hash(data)[:12]}.{extension}'
+
+
+class SiteWriter:
+    """Writes files under root only when their content changed, and removes files no longer written"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.previous = {}
+        state_path = self.root / STATE_FILE
+        if state_path.exists():
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.previous = json.load(f)
+        self.current = {}
+        self.written = 0
+
+    def _unchanged(self, rel_path, fingerprint):
+        self.current[rel_path] = fingerprint
+        return self.previous.get(rel_path) == fingerprint and (self.root / rel_path).exists()
+
+    def write(self, rel_path, data):
+        if self._unchanged(rel_path, content_hash(data)):
+            return
+        target = self.root / rel_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target.with_name(target.name + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, target)
+        self.written += 1
+
+    def copy(self, rel_path, source, link=False):
+        """Copy (or hard-link) a file, comparing size and mtime rather than hashing its content"""
+        stat = os.stat(source)
+        if self._unchanged(rel_path, f'{stat.st_size}:{stat.st_mtime_ns}'):
+            return
+        target = self.root / rel_path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            target.unlink()
+        if link:
+            try:
+                os.link(source, target)
+                self.written += 1
+                return
+            except OSError:
+                pass
+        shutil.copy2(source, target)
+        self.written += 1
+
+    def finish(self):
+        """Delete stale files, save the state and return (written, removed)"""
+        removed = 0
+        for rel_path in set(self.previous) - set(self.current):
+            try:
+                (self.root / rel_path).unlink()
+                removed += 1
+            except OSError:
+                pass
+        with open(self.root / STATE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(self.current, f, indent=0, sort_keys=True)
+        return self.written, removed
+
+
+def export_cover(writer, conn, cover_path, size):
+    """Write a thumbnail (or the original, without Pillow) and return its site path"""
+    if not cover_path or not os.path.exists(cover_path):
+        return None
+    thumbnail = thumbnails.get_thumbnail(conn, cover_path, thumbnails.SIZES[size])
+    if thumbnail:
+        rel_path = f'covers/{thumbnail.name}'
+        writer.copy(rel_path, thumbnail)
+    else:
+        key = hashlib.sha1(f'{cover_path}|{os.stat(cover_path).st_mtime_ns}'.encode('utf-8')).hexdigest()[:16]
+        rel_path = f'covers/{key}{Path(cover_path).suffix.lower()}'
+        writer.copy(rel_path, cover_path)
+    return rel_path
+
+
+def render_page(title, body, stylesheet, root='', scripts=''):
+    return PAGE_TEMPLATE.format(title=html.escape(title), body=body, stylesheet=stylesheet, root=root,
+                                scripts=scripts).encode('utf-8')
+
+
+def render_book_page(book, cover, files, stylesheet, badge_script):
+    """Detail page for one book, laid out like the web app's modal"""
+    def info_row(label, value):
+        if not value:
+            return ''
+        return f'<div class="info-row"><div class="info-label">{label}</div><div class="info-value">{html.escape(str(value))}</div></div>'
+
+    cover_html = f'<img src="../{cover}" class="book-cover" alt="">' if cover else '<div class="book-cover-placeholder">📚</div>'
+    subjects = ''.join(f'<span class="subject-tag">{html.escape(s)}</span>' for s in book['subjects'])
+    downloads = ''.join(
+        f'<a href="../{path}" class="download-btn" download>Download <span class="format-badge">{html.escape(fmt.upper())}</span></a>'
+        for path, fmt in files
+    )
+    body = f'''        <div class="static-page">
+            <a class="back-btn" href="../index.html">← Back to Library</a>
+            <div class="book-detail-grid">
+                <div>{cover_html}</div>
+                <div class="book-info">
+                    <h2>{html.escape(book['title'] or '')}</h2>
+                    <div class="author">{html.escape(book['authors'])}</div>
+                    {info_row('Series', book['series'])}
+                    {info_row('Publisher', book['publisher'])}
+                    {info_row('Published', book['publish_date'])}
+                    {info_row('ISBN', book['isbn'])}
+                </div>
+            </div>
+            {f'<div class="info-row"><div class="info-label">Subjects</div><div class="book-subjects">{subjects}</div></div>' if subjects else ''}
+            {f'<div class="info-row"><div class="info-label">Description</div><div class="description">{book["description"]}</div></div>' if book['description'] else ''}
+            {f'<div class="download-section"><div class="info-label">Download Book</div>{downloads}</div>' if downloads else ''}
+        </div>'''
+    scripts = f'    <script src="../assets/{badge_script}"></script>\n'
+    return render_page(book['title'] or 'Book', body, stylesheet, root='../', scripts=scripts)
+
+
+def export_site(output_dir, db_path=DB_PATH, with_files=False):
+    server.DB_PATH = Path(db_path)
+    server.init_db()
+    writer = SiteWriter(output_dir)
+    stats = server.get_stats()
+
+    with open(INFRA_DIR / 'static' / 'css' / 'style.css', 'rb') as f:
+        style = f.read()
+    stylesheet = hashed_name('style', 'css', style)
+    writer.write(f'assets/{stylesheet}', style)
+    script = CATALOG_SCRIPT.encode('utf-8')
+    script_name = hashed_name('catalog', 'js', script)
+    writer.write(f'assets/{script_name}', script)
+    badge = BADGE_SCRIPT.encode('utf-8')
+    badge_script = hashed_name('badge', 'js', badge)
+    writer.write(f'assets/{badge_script}', badge)
+
+    conn = server.connect_db()
+    cursor = conn.cursor()
+    catalog_id, generation = get_catalog_version(cursor)
+    cursor.execute(server.BOOK_ROW_SQL + ' ORDER BY b.id')
+    shards = {}
+    for row in cursor.fetchall():
+        book = server.book_from_row(row)
+        book['cover'] = export_cover(writer, conn, row[2], 'small') if book.pop('has_cover') else None
+        # The dominant colour is enough of a placeholder here; drop the BlurHash to keep shards small
+        book.pop('placeholder')
+        shards.setdefault(book['id'] // SHARD_SIZE, []).append(book)
+
+    manifest_shards = []
+    for shard_number in sorted(shards):
+        rows = shards[shard_number]
+        data = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        rel_path = f'data/{hashed_name(f"books-{shard_number}", "json", data)}'
+        writer.write(rel_path, data)
+        manifest_shards.append({'file': rel_path, 'books': len(rows)})
+
+        # Detail pages, one shard's worth of books at a time
+        details = server.get_books_details([book['id'] for book in rows])
+        for book_id, book in details.items():
+            cover = export_cover(writer, conn, book['cover_path'], 'large')
+            files = []
+            for file in book['files']:
+                if with_files and file['path'] and os.path.exists(file['path']):
+                    path = f"files/{file['id']}/{Path(file['path']).name}"
+                    writer.copy(path, file['path'], link=True)
+                    files.append((path, file['format']))
+            writer.write(f'books/{book_id}.html', render_book_page(book, cover, files, stylesheet, badge_script))
+
+    conn.close()
+
+    manifest = {'catalog_id': catalog_id, 'generation': generation, 'stats': stats, 'shards': manifest_shards}
+    writer.write('manifest.json', json.dumps(manifest, indent=1).encode('utf-8'))
+    scripts = f'    <script src="assets/{script_name}"></script>\n'
+    writer.write('index.html', render_page("TT's eLibrary", INDEX_BODY, stylesheet, scripts=scripts))
+    return writer.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the catalog as a static website.')
+    parser.add_argument('output_dir', help='Folder to write the site into (re-exports update it in place)')
+    parser.add_argument('--with-files', action='store_true', help='Include the book files so the site offers downloads')
+    parser.add_argument('--db', default=str(DB_PATH), help='Catalog database to export')
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        print(f"Error: Database file not found: {args.db}")
+        sys.exit(1)
+    written, removed = export_site(args.output_dir, args.db, args.with_files)
+    print(f"Exported to {args.output_dir}: {written} file(s) written, {removed} removed")
+
+
+if __name__ == '__main__':
+    main()
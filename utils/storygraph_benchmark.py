@@ -0,0 +1,221 @@
+"""Time a StoryGraph import of a synthetic export against a copy of the catalog.
+
+Half of the generated rows reuse titles and authors from the catalog, so both the
+matched and the unmatched paths are exercised; the rest are invented books. The
+catalog database itself is never modified:
+
+    python storygraph_benchmark.py --rows 10000 --runs 3
+
+--books N times the title matcher alone against a synthetic library of N books,
+with rows that spell the titles the way reading trackers do, and reports how
+many rows it matched to the right book:
+
+    python storygraph_benchmark.py --rows 10000 --books 50000
+
+--regressions checks the title matcher against titles it once matched to the
+wrong book, and exits non-zero if any of them goes wrong again:
+
+    python storygraph_benchmark.py --regressions
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+INFRA_DIR = Path(__file__).parent / '..' / 'infra'
+sys.path.insert(0, str(INFRA_DIR))
+from storygraph_processor import StoryGraphImporter
+from title_matcher import TitleMatcher
+
+DB_PATH = INFRA_DIR / 'data' / 'tt_db_ebook_lib.db'
+
+CSV_FIELDS = [
+    'Title', 'Authors', 'Contributors', 'ISBN/UID', 'Format', 'Read Status', 'Date Added', 'Last Date Read',
+    'Dates Read', 'Read Count', 'Moods', 'Pace', 'Character- or Plot-Driven?', 'Strong Character Development?',
+    'Loveable Characters?', 'Diverse Characters?', 'Flawed Characters?', 'Star Rating', 'Review',
+    'Content Warnings', 'Content Warning Description', 'Tags', 'Owned?',
+]
+WORDS = ['Shadow', 'River', 'Empire', 'Glass', 'Winter', 'Crown', 'Memory', 'Garden', 'Storm', 'Atlas', 'Silent', 'Iron']
+STATUSES = ['read', 'read', 'read', 'to-read', 'currently-reading', 'did-not-finish']
+FORMATS = ['paperback', 'hardcover', 'digital', 'audio']
+FIRST_NAMES = ['Ada', 'Brandon', 'Celeste', 'Dmitri', 'Elena', 'Farah', 'George', 'Hiro', 'Ines', 'Jun', 'Kofi', 'Lena']
+LAST_NAMES = ['Abbott', 'Baptiste', 'Castillo', 'Dinniman', 'Eze', 'Fujita', 'Grant', 'Haddad', 'Ivanova', 'Jensen']
+# How exports tend to differ from ebook metadata
+TITLE_VARIATIONS = [
+    lambda title: title,
+    lambda title: title.upper(),
+    lambda title: f'{title}: A Novel',
+    lambda title: f'{title} ({title.split()[-1]} Saga, #2)',
+    lambda title: title[4:] if title.startswith('The ') else f'The {title}',
+    lambda title: title.replace(' and ', ' & '),
+]
+
+# Library for the regression rows: (book id, title, authors)
+REGRESSION_BOOKS = [
+    (1, 'Edible Forest Gardens, Volume I', 'Dave Jacke, Eric Toensmeier'),
+    (2, 'Dune: The Butlerian Jihad', 'Brian Herbert, Kevin J. Anderson'),
+    (3, 'The Hobbit', 'J.R.R. Tolkien'),
+    (4, 'Foundation', 'Isaac Asimov'),
+]
+# (title, authors, book id the row must match, or None for no match)
+REGRESSION_ROWS = [
+    ('Edible Forest Gardens, Volume II', 'Dave Jacke, Eric Toensmeier', None),
+    ('Dune', 'Frank Herbert', None),
+    ('Dune', '', None),
+    ('Edible Forest Gardens, Volume 1', 'Dave Jacke', 1),
+    ('Dune: The Butlerian Jihad', 'Brian Herbert', 2),
+    ('The Hobbit: There and Back Again', 'J. R. R. Tolkien', 3),
+    ('HOBBIT', '', 3),
+    ('Foundation: A Novel', 'Isaac Asimov', 4),
+]
+
+
+def write_synthetic_export(csv_path, db_path, row_count, seed=1):
+    """Write a StoryGraph-style CSV with row_count rows, half of them books from db_path"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    known = conn.execute('''
+        SELECT b.title, a.author_name
+        FROM books b
+        JOIN book_authors ba ON b.id = ba.book_id
+        JOIN authors a ON ba.author_id = a.id
+    ''').fetchall()
+    conn.close()
+
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for i in range(row_count):
+            if known and i % 2 == 0:
+                title, author = rng.choice(known)
+                # Exports rarely match the catalog's casing exactly
+                title = title.upper() if i % 4 == 0 else title
+            else:
+                title = f"The {rng.choice(WORDS)} of {rng.choice(WORDS)} {i}"
+                author = f"Author {rng.randrange(2000)}"
+            year = rng.randrange(2015, 2025)
+            status = rng.choice(STATUSES)
+            writer.writerow({
+                'Title': title,
+                'Authors': author,
+                'ISBN/UID': f'978{rng.randrange(10**9, 10**10)}',
+                'Format': rng.choice(FORMATS),
+                'Read Status': status,
+                'Date Added': f'{year}/{rng.randrange(1, 13):02d}/{rng.randrange(1, 29):02d}',
+                'Dates Read': f'{year}/01/04-{year}/05/05' if status == 'read' else '',
+                'Read Count': '1' if status == 'read' else '0',
+                'Moods': 'adventurous, dark' if i % 3 == 0 else '',
+                'Pace': rng.choice(['slow', 'medium', 'fast']),
+                'Star Rating': str(rng.randrange(1, 11) / 2) if status == 'read' else '',
+                'Content Warnings': 'Graphic: Violence' if i % 5 == 0 else '',
+                'Owned?': rng.choice(['Yes', 'No']),
+            })
+
+
+def time_import(db_path, csv_path):
+    """Import csv_path into db_path twice; returns (first import s, re-import s, rows, matched rows)"""
+    importer = StoryGraphImporter(str(db_path))
+    # The importer narrates its progress; only the timing matters here
+    with contextlib.redirect_stdout(io.StringIO()):
+        importer.connect()
+        importer.create_reading_tables()
+        start = time.perf_counter()
+        importer.import_storygraph_csv(csv_path)
+        elapsed = time.perf_counter() - start
+        # Nothing changed, so the second import should write nothing
+        start = time.perf_counter()
+        importer.import_storygraph_csv(csv_path)
+        reimport = time.perf_counter() - start
+        rows, matched = importer.cursor.execute('SELECT COUNT(*), COUNT(book_id) FROM reading_history').fetchone()
+        importer.close()
+    return elapsed, reimport, rows, matched
+
+
+def benchmark_matcher(book_count, row_count, seed=1):
+    """Match row_count varied titles against book_count synthetic books; returns (build s, match s, correct)"""
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f'{word}{n}' for word in WORDS for n in range(book_count // 100 + 1)]
+    books = []
+    for book_id in range(1, book_count + 1):
+        words = rng.sample(vocabulary, rng.randrange(2, 6))
+        title = f"The {' and '.join(words[:2])} of {' '.join(words[2:]) or rng.choice(WORDS)}"
+        books.append((book_id, title, f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{book_id % 97}'))
+
+    start = time.perf_counter()
+    matcher = TitleMatcher(books)
+    built = time.perf_counter() - start
+
+    rows = [(book_id, rng.choice(TITLE_VARIATIONS)(title), author) for book_id, title, author in rng.sample(books, row_count)]
+    start = time.perf_counter()
+    correct = sum(1 for book_id, title, author in rows if matcher.match(title, author)[0] == book_id)
+    return built, time.perf_counter() - start, correct
+
+
+def check_regressions():
+    """(title, authors, expected, got) for every REGRESSION_ROWS row the matcher gets wrong"""
+    matcher = TitleMatcher(REGRESSION_BOOKS)
+    failures = []
+    for title, authors, expected in REGRESSION_ROWS:
+        book_id, _ = matcher.match(title, authors)
+        if book_id != expected:
+            failures.append((title, authors, expected, book_id))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=str(DB_PATH), help='catalog database to copy (never modified)')
+    parser.add_argument('--rows', type=int, default=10000, help='rows in the synthetic export')
+    parser.add_argument('--runs', type=int, default=3, help='imports to time, each into a fresh copy')
+    parser.add_argument('--books', type=int, help='time only the title matcher, against this many synthetic books')
+    parser.add_argument('--regressions', action='store_true', help='check the title matcher against known mismatches')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.regressions:
+        failures = check_regressions()
+        for title, authors, expected, got in failures:
+            print(f"  {title!r} by {authors or 'no author'!r}: expected {expected}, got {got}")
+        print(f"{len(REGRESSION_ROWS) - len(failures)} of {len(REGRESSION_ROWS)} regression rows matched as expected")
+        sys.exit(1 if failures else 0)
+
+    if args.books:
+        built, matched, correct = benchmark_matcher(args.books, min(args.rows, args.books), args.seed)
+        print(f"Indexed {args.books} books in {built:.2f}s")
+        print(f"Matched {min(args.rows, args.books)} rows in {matched:.2f}s, {correct} to the right book")
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'storygraph.csv')
+        write_synthetic_export(csv_path, args.db, args.rows, args.seed)
+        print(f"Importing {args.rows} rows into a copy of {args.db}, {args.runs} run(s)")
+
+        timings = []
+        for run in range(args.runs):
+            db_copy = os.path.join(workdir, f'run{run}.db')
+            shutil.copy(args.db, db_copy)
+            # Start from an empty history so every run does the same work
+            conn = sqlite3.connect(db_copy)
+            for table in ('content_warnings', 'book_attributes', 'reading_history'):
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                    conn.execute(f'DELETE FROM {table}')
+            conn.commit()
+            conn.close()
+
+            elapsed, reimport, rows, matched = time_import(db_copy, csv_path)
+            timings.append(elapsed)
+            print(f"  run {run + 1}: {elapsed:.3f}s ({rows / elapsed:,.0f} rows/s, {matched} matched), unchanged re-import {reimport:.3f}s")
+
+    print(f"Best: {min(timings):.3f}s for {args.rows} rows")
+
+
+if __name__ == '__main__':
+    main()